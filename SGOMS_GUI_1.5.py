@@ -31,6 +31,38 @@ File -> print model contents
 
 Version 1.5:
 Paste Slave Node function added
+
+Version 1.6:
+Copy/Paste of multiple selected nodes, and of whole subtrees (Copy Subtree)
+Graph transactions (Graph.beginTransaction) for making many changes with a single update
+SGOMSModelBuilder for building models from Python code or a text format, without the GUI
+File -> Import From ACT-R (ACTRImporter), to rebuild a model from a Python ACT-R file
+Compiling through a cached intermediate representation (SGOMS_Model.lowerToIR, SGOMS_IR) with pluggable ModelEmitters:
+    Python ACT-R (outputToACTR), JSON IR, and Lisp ACT-R (File -> Export To ...)
+Model validation (ModelValidator) after every change, with markers on the nodes, File -> Check Model, and a check before export
+SGOMSSimulator for running the Planning Units of a model without ACT-R (File -> Simulate Model)
+    with an indexed SimulatedDM, which reports retrieval hit rates and ambiguous requests
+Only the buffers the productions use are declared on export; File -> Buffers and Memory sets the buffers and DM parameters
+File -> Export Team To ACT-R, for exporting several models as agents in one ACT-R file (CCMSuiteEmitter.emitAgents)
+BatchSimulator for simulating thousands of agents doing the same Planning Unit at once
+SweepRunner for simulating every variant in a grid of unit task/method orders on a thread pool (the --sweep option)
+A content-addressed SGOMSUnitStore, so that shared and identical units are stored, listed and exported once
+The relations work out their tuppleID and DM strings when they are used, rather than storing copies of them
+A GraphIndex of the nodes' adjacency as integer arrays, which answers the neighbour and distance queries of the Nodes
+    with a least recently used QueryCache of its answers, whose hits and misses are counted (Graph.returnQueryStats)
+The unit tasks of each Planning Unit are kept in a chain, along which their cues and cuelags are set in one pass
+Directed edges (select an edge and press D) for branching and looping unit tasks, with a DM chunk for each way into a unit task
+A union-find ComponentIndex of the connected nodes, so the nodes find the units they contain without a search
+Typed edges (Edge.CONTAINS and Edge.SEQUENCE), from which the GraphIndex works out the PU, UT or Method each node belongs to
+    and its order there (Node.returnParentNode, Node.returnOrder), rather than from the distance to the closest unit
+Collapsing Planning Units, Unit Tasks and Methods in the canvas (select them and press C; View -> Expand All), 
+    which hides the units they contain from drawing and clicking, but not from the exported model
+An SGOMSWorkspace of the models open at once (File -> Load opens a model alongside the others; the Window menu switches),
+    which share the text of the units of one read-only unit library (Window -> Load Unit Library);
+    this saves memory but not load time, since each model's file is still read in full
+GraphBenchmark for timing graph operations, export, and save/load on synthesized models (the --benchmark option)
+SGOMSModelGenerator for streaming random models of any size to a file, for load-testing (the --generate option)
+A PerformanceMonitor timing the editor's hot paths, with View -> Performance Overlay and View -> Export Performance Samples
 '''
 
 
@@ -46,6 +78,7 @@ from javax.swing import BorderFactory
 from javax.swing import JMenu
 from javax.swing import JMenuBar
 from javax.swing import JMenuItem
+from javax.swing import JCheckBoxMenuItem
 from javax.swing import JPopupMenu
 from javax.swing import JDialog
 from javax.swing import JOptionPane
@@ -67,12 +100,30 @@ from java.awt.event import KeyListener
 from java.awt.event import MouseListener
 from java.awt.event import MouseMotionListener
 
-#import os
+from java.lang import Runtime
+from java.util.concurrent import Callable
+from java.util.concurrent import Executors
+from java.util.concurrent import ExecutorCompletionService
+
+import os
 import java.io as io
 import org.python.util as util
 
 from copy import deepcopy
 from copy import copy
+import json
+import re
+import keyword
+import random
+import time
+import sys
+import csv
+import itertools
+import tempfile
+import hashlib
+from array import array
+from collections import deque
+from collections import OrderedDict
 
 ########
 ## The SGOMS-Related model stuff
@@ -118,6 +169,15 @@ class PlanningUnit(io.Serializable):
         
         return "PU: " + self.ID
 
+    def cloneShared(self):
+        '''Returns a new PlanningUnit with the same ID, firing conditions and behaviour as self
+        
+        The firing condition and behaviour lists are shared with self rather than copied (copy-on-write);
+        the dialogs replace these lists instead of modifying them, so editing either unit leaves the other untouched.
+        The unitTaskList is not shared, it is repopulated by PUNode.updatePU()'''
+        
+        return PlanningUnit(self.ID, self.firingConditions, self.behaviour)
+
     def addUnitTask(self, theUnitTask):
         '''Adds theUnitTask to the Planning Unit
 
@@ -196,6 +256,14 @@ class UnitTask(io.Serializable):
         
         return "UT: " + str(self.ID)
     
+    def cloneShared(self):
+        '''Returns a new UnitTask with the same ID, firing conditions and behaviour as self
+        
+        The firing condition and behaviour lists are shared with self (copy-on-write), see PlanningUnit.cloneShared()
+        The methodList is not shared, it is repopulated by UTNode.updateUT()'''
+        
+        return UnitTask(self.ID, self.firingConditions, self.behaviour)
+    
     def addMethod(self, theMethod):
         '''Adds theMethod to theMethodList,
         
@@ -277,6 +345,14 @@ class Method(io.Serializable):
         
         return "Method: " + str(self.ID)
     
+    def cloneShared(self):
+        '''Returns a new Method with the same ID, firing conditions and behaviour as self
+        
+        The firing condition and behaviour lists are shared with self (copy-on-write), see PlanningUnit.cloneShared()
+        The operatorList is not shared, it is repopulated by MNode.updateMethod()'''
+        
+        return Method(self.ID, self.firingConditions, self.behaviour)
+    
     def addOperator(self, theOperator):
         '''Adds theOperator to theOperatorList,
         
@@ -354,6 +430,13 @@ class Operator(io.Serializable):
         
         return "Operator: " + str(self.ID)
     
+    def cloneShared(self):
+        '''Returns a new Operator with the same ID, firing conditions and behaviour as self
+        
+        The firing condition and behaviour lists are shared with self (copy-on-write), see PlanningUnit.cloneShared()'''
+        
+        return Operator(self.ID, self.firingConditions, self.behaviour)
+    
     def printOperatorContents(self):
         '''Prints the contents of the Operator, including its ID, firing conditions, and behaviours'''
         
@@ -407,10 +490,7 @@ class PUxUTRelation(io.Serializable):
         self.location = theLocation ## The location of the unit task within the planning unit/tree
         
         ## The tupple ID is a more complicated representation of the relation; mostly used for test purposes
-        if self.planningUnit == None:
-            self.tuppleID = "PUxUTRelation", self.ID, None, self.unitTask.ID, self.location
-        else:
-            self.tuppleID = "PUxUTRelation", self.ID, self.planningUnit.ID, self.unitTask.ID, self.location
+        ## (it is worked out from the relation when it is used, see the tuppleID property below)
 
         print "(PUxUTRelation.init) Created: ", self.tuppleID
         
@@ -428,46 +508,84 @@ class PUxUTRelation(io.Serializable):
         ## The PUxUTRelations will each have a string representation of the DM chunk to be outputed to ACT-R
         #######################
         
-        ## Maintain some variables to populate the DM string
+        ## Only the cue and cuelag are stored, since they depend on the preceding relation (see Graph.updateChains);
+        ## planning_unit_DM, unit_task_DM and the DM_string are worked out from the relation when they are used
         ## We are assuming that relations are unconnected at startup
-        
-        if self.planningUnit != None:
-            self.planning_unit_DM = self.planningUnit.ID
-        else:
-            self.planning_unit_DM = ''     ## This will not work in ACT-R, it is equivalent to None 
-        
         self.cuelag_DM = 'none'
         self.cue_DM = 'start'
         
-        if self.unitTask != None:
-            self.unit_task_DM = self.unitTask.ID
-        else:
-            self.unit_task_DM = ''
-            
-        self.DM_string = 'planning_unit:' + self.planning_unit_DM + ' cuelag:' + self.cuelag_DM \
-                        + ' cue:' + self.cue_DM + ' unit_task:' + self.unit_task_DM 
+        ## A unit task that can follow more than one unit task (a branch joining, or a loop) has a DM chunk for each
+        ## of them: the [cuelag, cue] of every chunk, the first of which is [cuelag_DM, cue_DM] (see setCues)
+        self.cues = [['none', 'start']]
     
     def __str__(self):
         '''Returns a string representation of the PUxUTRelation (i.e. its tupple ID converted to a string)'''
         
         return str(self.tuppleID[0]) + str(self.tuppleID[1]) + str(self.tuppleID[2]) + str(self.tuppleID[3]) + str(self.tuppleID[4])
     
-    def updateTuppleID(self):
-        '''Updates the tuppleID, based on any changes made to the PUxUTRelation'''
+    @property
+    def tuppleID(self):
+        '''The tupple ID of the relation: ("PUxUTRelation", ID, planning unit ID or None, unit task ID, location)'''
         
         if self.planningUnit == None:
-            self.tuppleID = "PUxUTRelation", self.ID, None, self.unitTask.ID, self.location
-        else:
-            self.tuppleID = "PUxUTRelation", self.ID, self.planningUnit.ID, self.unitTask.ID, self.location
-            
+            return "PUxUTRelation", self.ID, None, self.unitTask.ID, self.location
+        return "PUxUTRelation", self.ID, self.planningUnit.ID, self.unitTask.ID, self.location
+    
+    @property
+    def planning_unit_DM(self):
+        '''The planning_unit slot of the DM chunk: the ID of the Planning Unit, 
+        or '' if the relation is unconnected (this will not work in ACT-R, it is equivalent to None)'''
+        
+        if self.planningUnit == None:
+            return ''
+        return self.planningUnit.ID
+    
+    @property
+    def unit_task_DM(self):
+        '''The unit_task slot of the DM chunk: the ID of the Unit Task, or '' if there is none'''
+        
+        if self.unitTask == None:
+            return ''
+        return self.unitTask.ID
+    
+    @property
+    def DM_string(self):
+        '''The DM chunk of the relation, e.g. 'planning_unit:prep_wrap cuelag:none cue:start unit_task:veggies' '''
+        
+        return 'planning_unit:' + self.planning_unit_DM + ' cuelag:' + self.cuelag_DM \
+            + ' cue:' + self.cue_DM + ' unit_task:' + self.unit_task_DM
+    
+    def setCues(self, theCues):
+        '''Sets the [cuelag, cue] of each of the relation's DM chunks (cuelag_DM and cue_DM are those of the first)
+        
+        theCues should be a non-empty list of [cuelag, cue] lists'''
+        
+        self.cues = [list(cue) for cue in theCues]
+        self.cuelag_DM, self.cue_DM = self.cues[0]
+        
+    def returnCues(self):
+        '''Returns the [cuelag, cue] of each of the relation's DM chunks'''
+        
+        cues = getattr(self, "cues", None)      ## Relations loaded from older files only have one chunk
+        if cues == None or len(cues) == 0 or cues[0] != [self.cuelag_DM, self.cue_DM]:
+            return [[self.cuelag_DM, self.cue_DM]]
+        return cues
+    
+    @property
+    def DM_strings(self):
+        '''The DM chunks of the relation, one for each unit task it can follow (see returnCues)'''
+        
+        return ['planning_unit:' + self.planning_unit_DM + ' cuelag:' + cuelag + ' cue:' + cue + ' unit_task:' 
+                + self.unit_task_DM for cuelag, cue in self.returnCues()]
+    
+    def updateTuppleID(self):
+        '''Prints the tuppleID (which is worked out from the relation whenever it is used, so is always up to date)'''
+        
         print "(PUxUTRelation.updateTuppleID) new ID:", self.tuppleID
         
     def updateDM_string(self):
-        '''Updates the DM_string, based on any changes made to the planning_unit_DM etc.'''
+        '''Prints the DM_string (which is worked out from the relation whenever it is used, so is always up to date)'''
         
-        self.DM_string = 'planning_unit:' + self.planning_unit_DM + ' cuelag:' + self.cuelag_DM \
-                        + ' cue:' + self.cue_DM + ' unit_task:' + self.unit_task_DM
-                        
         print "(PUxUTRelation.updateDM_string) new DM_string:", self.DM_string
 
 class UTxMRelation(io.Serializable):
@@ -490,10 +608,6 @@ class UTxMRelation(io.Serializable):
         self.unitTask = theUnitTask
         self.method = theMethod
         self.location = theLocation ## The location of the unit task within the planning unit/tree
-        if self.unitTask == None:
-            self.tuppleID = "UTxMRelation", self.ID, None, self.method.ID, self.location
-        else:
-            self.tuppleID = "UTxMRelation", self.ID, self.unitTask.ID, self.method.ID, self.location
 
         print "(UTxMRelation.init) Created: ", self.tuppleID
         
@@ -502,14 +616,17 @@ class UTxMRelation(io.Serializable):
         
         return str(self.tuppleID[0]) + str(self.tuppleID[1]) + str(self.tuppleID[2]) + str(self.tuppleID[3]) + str(self.tuppleID[4])
     
-    def updateTuppleID(self):
-        '''Updates the tuppleID, based on any changes made to the UTxMRelation'''
+    @property
+    def tuppleID(self):
+        '''The tupple ID of the relation: ("UTxMRelation", ID, unit task ID or None, method ID, location)'''
         
         if self.unitTask == None:
-            self.tuppleID = "UTxMRelation", self.ID, None, self.method.ID, self.location
-        else:
-            self.tuppleID = "UTxMRelation", self.ID, self.unitTask.ID, self.method.ID, self.location
-            
+            return "UTxMRelation", self.ID, None, self.method.ID, self.location
+        return "UTxMRelation", self.ID, self.unitTask.ID, self.method.ID, self.location
+    
+    def updateTuppleID(self):
+        '''Prints the tuppleID (which is worked out from the relation whenever it is used, so is always up to date)'''
+        
         print "(UTxMRelation.updateTuppleID) new ID:", self.tuppleID
         
 class MxORelation(io.Serializable):
@@ -532,10 +649,6 @@ class MxORelation(io.Serializable):
         self.method = theMethod
         self.operator = theOperator
         self.location = theLocation     ## The location of the operator within the method
-        if self.method == None:
-            self.tuppleID = "MxORelation", self.ID, None, self.operator.ID, self.location
-        else:
-            self.tuppleID = "MxORelation", self.ID, self.method.ID, self.operator.ID, self.location
 
         print "(MxORelation.init) Created: ", self.tuppleID
         
@@ -544,19 +657,138 @@ class MxORelation(io.Serializable):
         
         return str(self.tuppleID[0]) + str(self.tuppleID[1]) + str(self.tuppleID[2]) + str(self.tuppleID[3]) + str(self.tuppleID[4])
     
-    def updateTuppleID(self):
-        '''Updates the tuppleID, based on any changes made to the MxORelation'''
+    @property
+    def tuppleID(self):
+        '''The tupple ID of the relation: ("MxORelation", ID, method ID or None, operator ID, location)'''
         
         if self.method == None:
-            self.tuppleID = "MxORelation", self.ID, None, self.operator.ID, self.location
-        else:
-            self.tuppleID = "MxORelation", self.ID, self.method.ID, self.operator.ID, self.location
-            
+            return "MxORelation", self.ID, None, self.operator.ID, self.location
+        return "MxORelation", self.ID, self.method.ID, self.operator.ID, self.location
+    
+    def updateTuppleID(self):
+        '''Prints the tuppleID (which is worked out from the relation whenever it is used, so is always up to date)'''
+        
         print "(MxORelation.updateTuppleID) new ID:", self.tuppleID
     
         
 ##### The Model #####
         
+class SGOMSUnitStore:
+    '''A content-addressed store of the SGOMS units in an SGOMS_Model (see SGOMS_Model.returnUnitStore)
+    
+    Each unit is keyed by its content: (type, ID, firing conditions, behaviours).
+    The first unit with a given key keeps its firing condition and behaviour lists, and every later unit with the
+    same key is given those same lists, so identical units (e.g. the 'finished' Unit Task of every Planning Unit,
+    or pasted copies) only hold one copy of their text. The lists are shared copy-on-write, like cloneShared().
+    
+    The store also counts how many nodes refer to each unit (in the unit's references attribute), 
+    so that a unit shared by slave nodes is only listed in the SGOMS_Model once, and only removed with its last node.
+    An entry is dropped once the last unit stored with its key is released, so the store does not keep the text 
+    of deleted units (or of units that have since been edited, once they are deleted or stored again).
+    The store itself is not saved; it is rebuilt from the model's lists when needed'''
+    
+    def __init__(self):
+        '''Creates an empty SGOMSUnitStore'''
+        
+        self.entries = {}       ## content key -> [firing conditions, behaviours, the number of units stored with that key]
+        self.unitKeys = {}      ## unit -> the content key it was stored with (its content may have changed since)
+        self.sharedCount = 0    ## The number of units that were given the lists of an existing entry
+        
+    def __str__(self):
+        '''Returns a string representation of the SGOMSUnitStore'''
+        
+        return "SGOMSUnitStore with " + str(len(self.entries)) + " distinct units (" + \
+            str(self.sharedCount) + " units share their text with another unit)"
+        
+    def returnKey(theUnit):
+        '''Returns the content key of theUnit: (type, ID, firing conditions, behaviours), as a tuple of strings and tuples
+        
+        theUnit should be a PlanningUnit, UnitTask, Method, or Operator'''
+        
+        return (theUnit.__class__.__name__, theUnit.ID, tuple(theUnit.firingConditions), tuple(theUnit.behaviour))
+    
+    returnKey = staticmethod(returnKey)
+        
+    def intern(self, theUnit):
+        '''Gives theUnit the firing condition and behaviour lists of the first unit stored with the same content
+        Returns True if theUnit now shares its lists with another unit, False if it is the first unit with its content
+        
+        theUnit should be a PlanningUnit, UnitTask, Method, or Operator'''
+        
+        key = SGOMSUnitStore.returnKey(theUnit)
+        if self.unitKeys.get(theUnit) != key:
+            self.forget(theUnit)    ## The unit has been edited since it was stored
+            entry = self.entries.get(key)
+            if entry == None:
+                self.entries[key] = [theUnit.firingConditions, theUnit.behaviour, 1]
+                self.unitKeys[theUnit] = key
+                return False
+            entry[2] += 1
+            self.unitKeys[theUnit] = key
+        
+        entry = self.entries[key]
+        if theUnit.firingConditions is not entry[0] or theUnit.behaviour is not entry[1]:
+            theUnit.firingConditions = entry[0]
+            theUnit.behaviour = entry[1]
+            self.sharedCount += 1
+        return True
+        
+    def share(self, theUnit):
+        '''Gives theUnit the firing condition and behaviour lists of the unit stored with the same content, if there is one
+        Unlike intern(), theUnit is not stored if there is none, so the store can be shared read-only (see SGOMSWorkspace)
+        Returns True if theUnit now shares its lists with a stored unit
+        
+        theUnit should be a PlanningUnit, UnitTask, Method, or Operator'''
+        
+        entry = self.entries.get(SGOMSUnitStore.returnKey(theUnit))
+        
+        if entry == None:
+            return False
+        
+        if theUnit.firingConditions is not entry[0] or theUnit.behaviour is not entry[1]:
+            theUnit.firingConditions = entry[0]
+            theUnit.behaviour = entry[1]
+            self.sharedCount += 1
+        return True
+        
+    def acquire(self, theUnit):
+        '''Adds a reference to theUnit (i.e. a node now refers to it), and interns its content
+        Returns True if this is the first reference, i.e. theUnit should be added to the model's list of units
+        
+        theUnit should be a PlanningUnit, UnitTask, Method, or Operator'''
+        
+        references = getattr(theUnit, "references", 0)
+        theUnit.references = references + 1
+        self.intern(theUnit)
+        
+        return references < 1
+        
+    def release(self, theUnit):
+        '''Removes a reference to theUnit (i.e. a node that referred to it was deleted)
+        Returns True if that was the last reference, i.e. theUnit should be removed from the model's list of units
+        
+        theUnit should be a PlanningUnit, UnitTask, Method, or Operator'''
+        
+        references = getattr(theUnit, "references", 1) - 1
+        theUnit.references = max(references, 0)
+        
+        if references < 1:
+            self.forget(theUnit)
+        return references < 1
+        
+    def forget(self, theUnit):
+        '''Stops counting theUnit in the entry it was stored with, dropping the entry if no other unit was stored with it'''
+        
+        key = self.unitKeys.pop(theUnit, None)
+        if key == None:
+            return
+        
+        entry = self.entries[key]
+        entry[2] -= 1
+        if entry[2] < 1:
+            del self.entries[key]
+    
+    
 class SGOMS_Model(io.Serializable):
     '''The underlying model that the GUI interacts with
     
@@ -610,19 +842,17 @@ class SGOMS_Model(io.Serializable):
         if theMxORelationList == None:
             self.mxORelationList = []
             
+        self.bufferList = theBufferList
         if theBufferList == None:
-            self.bufferList = []
+            ## The default buffers of an SGOMS_Model, named the way the global productions and firing conditions use them
+            ## These represent buffers that will be used in the ACT-R representation of the model
+            ## Right now buffers are strings, but they could probably be objects in future versions of code
+            ## Only the buffers that the productions actually use are declared in the ACT-R file (see SGOMS_IR)
+            self.bufferList = ["b_context", "b_plan_unit", "b_unit_task", "b_method", "b_operator"]
             
-        ## The default buffers that every SGOMS_Model must have
-        ## These represent buffers that will be used in the ACT-R representation of the model
-        ## Right now buffers are strings, but they could probably be objects in future versions of code
-        ## In the future, users should probably be able to create/select buffers to use from the GUI
-        self.bufferList.append("buffer_context")
-        self.bufferList.append("buffer_DM")
-        self.bufferList.append("buffer_planning_unit")
-        self.bufferList.append("buffer_unit_task")
-        self.bufferList.append("buffer_method")
-        self.bufferList.append("buffer_operator")
+        ## The buffer used by DM (the Memory module), and the Memory's parameters, e.g. {"latency": "0.05"}
+        self.memoryBuffer = "b_DM"
+        self.memoryParameters = {}
 
         
         ## A counter to keep track of the number of relations in the model (i.e, PUxUTRelations, UTxMRelations, and MxORelations
@@ -633,6 +863,16 @@ class SGOMS_Model(io.Serializable):
         ## This will be a list of strings
         self.initialBehaviour = []
         
+        ## The cached SGOMS_IR of the model (see lowerToIR); None when the model has changed since it was lowered
+        self.irCache = None
+        
+        ## The SGOMSUnitStore of the units in the lists above (see returnUnitStore); None until it is needed
+        self.unitStore = None
+        
+        ## The chain of PUxUTRelations of each Planning Unit, in the order of their locations (see updateChains)
+        ## Planning Unit -> list of [relation, list of the relations it follows (None for the start of the PU)]
+        self.chains = {}
+        
     def __str__(self):
         '''Prints a string representation of the SGOMS_Model'''
         
@@ -645,7 +885,9 @@ class SGOMS_Model(io.Serializable):
 
         thePlanningUnit should be a PlanningUnit'''
 
-        self.planningUnitList.append(thePlanningUnit)
+        if self.returnUnitStore().acquire(thePlanningUnit):     ## A shared unit (e.g. of a slave node) is only listed once
+            self.planningUnitList.append(thePlanningUnit)
+        self.invalidateIR()
 
         print "(Model.addPlanningUnit): ", thePlanningUnit.ID, " added. Total number of Planning Units in the model = ", \
         len(self.planningUnitList)
@@ -656,7 +898,9 @@ class SGOMS_Model(io.Serializable):
         theUnitTask should be a UnitTask
         '''
 
-        self.unitTaskList.append(theUnitTask)
+        if self.returnUnitStore().acquire(theUnitTask):     ## A shared unit (e.g. of a slave node) is only listed once
+            self.unitTaskList.append(theUnitTask)
+        self.invalidateIR()
         
         print "(Model.addUnitTask): ", theUnitTask.ID, " added. Total number of Unit Tasks in the model = ", len(self.unitTaskList)
         
@@ -666,7 +910,9 @@ class SGOMS_Model(io.Serializable):
         theMethod should be a Method
         '''
 
-        self.methodList.append(theMethod)
+        if self.returnUnitStore().acquire(theMethod):     ## A shared unit (e.g. of a slave node) is only listed once
+            self.methodList.append(theMethod)
+        self.invalidateIR()
         
         print "(SGOMS_Model.addMethod): ", theMethod.ID, " added. Total number of Methods in the model = ", len(self.methodList)
         
@@ -676,10 +922,82 @@ class SGOMS_Model(io.Serializable):
         theOperator should be an Operator
         '''
 
-        self.operatorList.append(theOperator)
+        if self.returnUnitStore().acquire(theOperator):     ## A shared unit (e.g. of a slave node) is only listed once
+            self.operatorList.append(theOperator)
+        self.invalidateIR()
         
         print "(SGOMS_Model.addOperator): ", theOperator.ID, " added. Total number of Operators in the model = ", len(self.operatorList)
         
+    def releaseUnit(self, theUnit):
+        '''Removes a reference to theUnit, when a node that refers to it is deleted (see SGOMSUnitStore.release)
+        Returns True if no node refers to theUnit anymore, and it should be removed from its list
+        
+        theUnit should be a PlanningUnit, UnitTask, Method, or Operator in one of the model's lists'''
+        
+        self.invalidateIR()
+        return self.returnUnitStore().release(theUnit)
+        
+    def returnUnitStore(self):
+        '''Returns the SGOMSUnitStore of the model, building it from the lists of units if there is none yet
+        
+        The store is not saved with the model, so it is built again after loading.
+        Files saved before the store existed may list a shared unit once per node;
+        those lists are compacted to one entry per unit here, and the entries counted as the unit's references'''
+        
+        if getattr(self, "unitStore", None) == None:
+            self.unitStore = SGOMSUnitStore()
+            
+            for unitList in [self.planningUnitList, self.unitTaskList, self.methodList, self.operatorList]:
+                counts = {}
+                units = []
+                for unit in unitList:
+                    if unit not in counts:
+                        counts[unit] = 0
+                        units.append(unit)
+                    counts[unit] += 1
+                
+                for unit in units:
+                    if getattr(unit, "references", None) == None:
+                        unit.references = counts[unit]
+                    self.unitStore.intern(unit)
+                unitList[:] = units
+            
+            print "(SGOMS_Model.returnUnitStore) built the unit store:", self.unitStore
+        
+        return self.unitStore
+        
+    def addBuffer(self, theBuffer):
+        '''Adds theBuffer (a string, the name of the buffer) to self.bufferList, if it is not already there'''
+        
+        if theBuffer not in self.bufferList:
+            self.bufferList.append(theBuffer)
+            self.invalidateIR()
+            
+    def setMemoryParameter(self, theName, theValue):
+        '''Sets a parameter of the Memory module (e.g. "latency", "threshold"), or removes it if theValue is None
+        
+        theValue should be a string of Python code, e.g. "0.05"'''
+        
+        parameters = self.returnMemoryParameters()
+        if theValue == None:
+            if parameters.has_key(theName):
+                del parameters[theName]
+        else:
+            parameters[theName] = theValue
+        self.memoryParameters = parameters
+        self.invalidateIR()
+    
+    def returnMemoryBuffer(self):
+        '''Returns the name of the buffer used by DM'''
+        
+        ## Models saved before the memory was configurable used buffer_DM, but the global productions always used b_DM
+        return getattr(self, "memoryBuffer", "b_DM")
+    
+    def returnMemoryParameters(self):
+        '''Returns the dictionary of Memory parameters'''
+        
+        return getattr(self, "memoryParameters", {})
+        
     def addUnitTaskToPlanningUnit(self, theUnitTask, thePlanningUnit):
         '''Legacy code, not used in v1.0
         Adds theUnitTask to thePlanningUnit's list of unit tasks, not preventing duplicates
@@ -705,6 +1023,7 @@ class SGOMS_Model(io.Serializable):
 
         self.pUxUTRelationList.append(r)
         self.relationCounter += 1   
+        self.invalidateIR()
 
         print "(Model.addPUxUTRelationReturnSelf) Adding to list : ", r.tuppleID
         
@@ -724,6 +1043,7 @@ class SGOMS_Model(io.Serializable):
 
         self.uTxMRelationList.append(r)
         self.relationCounter += 1   
+        self.invalidateIR()
 
         print "(Model.addUTxMRelationReturnSelf) Adding to list : ", r.tuppleID
         
@@ -743,6 +1063,7 @@ class SGOMS_Model(io.Serializable):
 
         self.mxORelationList.append(r)
         self.relationCounter += 1   
+        self.invalidateIR()
 
         print "(Model.addMxORelationReturnSelf) Adding to list : ", r.tuppleID
         
@@ -766,6 +1087,80 @@ class SGOMS_Model(io.Serializable):
         print "(SGOMS_Model.getPrecedingRelations)", theRelation.ID, "found ", len(returnList), "preceding relations"
         return returnList
         
+    def clearChains(self):
+        '''Empties the chains of PUxUTRelations (before they are built again, see Graph.updateChains)'''
+        
+        self.chains = {}
+        
+    def appendToChain(self, thePlanningUnit, theRelation, thePrecedingRelations=None):
+        '''Adds theRelation to the end of thePlanningUnit's chain
+        
+        The relations should be appended in the order of their locations
+        thePrecedingRelations should be a list of the PUxUTRelations that theRelation follows,
+            with None for the start of the Planning Unit (e.g. [None] for the first relation in a simple chain);
+            a branch joining or a loop gives a relation more than one'''
+        
+        if getattr(self, "chains", None) == None:     ## Models loaded from older files have no chains
+            self.chains = {}
+        
+        if thePrecedingRelations == None:
+            thePrecedingRelations = [None]
+        if thePlanningUnit not in self.chains:
+            self.chains[thePlanningUnit] = []
+        self.chains[thePlanningUnit].append([theRelation, thePrecedingRelations])
+        
+    def returnChain(self, thePlanningUnit):
+        '''Returns the PUxUTRelations in thePlanningUnit's chain, in the order of their locations'''
+        
+        return [relation for relation, preceding in getattr(self, "chains", {}).get(thePlanningUnit, [])]
+        
+    def updateChains(self):
+        '''Sets the cues of every relation in the chains (see PUxUTRelation.setCues), in two passes along each chain
+        
+        The cue of a relation's chunk is the unit task it follows ('start' for the start of the Planning Unit),
+        and the cuelag is the cue that unit task was retrieved with ('none' for the start), so a relation has one chunk 
+        for each (cue of the relation it follows, relation it follows) pair, which the retrieval productions match on.
+        The first pass finds the cues each relation can be retrieved with, the second makes the chunks from them.
+        A relation that follows nothing (e.g. a unit task below a method) has the chunk of the start of the chain.'''
+        
+        for planningUnit, chain in getattr(self, "chains", {}).items():
+            retrievedWith = {}      ## relation -> the cues it is retrieved with
+            for relation, precedingRelations in chain:
+                cues = []
+                for preceding in precedingRelations:
+                    if preceding == None:
+                        cues.append('start')
+                    else:
+                        cues.append(preceding.unitTask.ID)
+                retrievedWith[relation] = self.returnUnique(cues)
+            
+            chunks = 0
+            for relation, precedingRelations in chain:
+                cues = []
+                for preceding in precedingRelations:
+                    if preceding == None:
+                        cues.append(['none', 'start'])
+                    else:
+                        for cuelag in retrievedWith.get(preceding) or ['start']:
+                            cues.append([cuelag, preceding.unitTask.ID])
+                cues = self.returnUnique(cues)
+                if len(cues) == 0:
+                    cues = [['none', 'start']]
+                relation.setCues(cues)
+                chunks += len(cues)
+            
+            print "(SGOMS_Model.updateChains)", planningUnit.ID, "has a chain of", len(chain), "unit tasks and", \
+                chunks, "DM chunks"
+    
+    def returnUnique(self, theList):
+        '''Returns theList without repeats, in its order'''
+        
+        returnList = []
+        for item in theList:
+            if item not in returnList:
+                returnList.append(item)
+        return returnList
+        
     def printModelContentsBasic(self):
         '''Print the IDs of all Planning Units, Unit Tasks, Methods, and Operators in the Model
         Used early on for testing purposes, should use printModelContentsAdvanced'''
@@ -819,6 +1214,7 @@ class SGOMS_Model(io.Serializable):
         as well as each relation in the model'''
 
         print "==== (printModelContentsAdvanced) ===="
+        startTime = PerformanceMonitor.monitor.start()
         print "Planning Units:"
         if len(self.planningUnitList) > 0:
             print "There are ", len(self.planningUnitList), " Planning Units in the Model:"
@@ -876,6 +1272,7 @@ class SGOMS_Model(io.Serializable):
         else:
             print "There are no MxORelations in the Model"
 
+        PerformanceMonitor.monitor.stop("printModelContentsAdvanced", startTime)
         print "==== End of (printModelContentsAdvanced) ===="
         
     def updateRelation(self, theRelation):
@@ -891,52 +1288,493 @@ class SGOMS_Model(io.Serializable):
         
         precedingRelations = self.getPrecedingRelations(theRelation)   ## Returns a list of preceding relations
         
-        ## Set the planning_unit_DM string, regardless if there are preceding relations
-        if theRelation.planningUnit != None:
-            theRelation.planning_unit_DM = theRelation.planningUnit.ID
-        
-        ## Set the unit_task_DM string, regardless if there are preceding relations
-        if theRelation.unitTask != None:
-            theRelation.unit_task_DM = theRelation.unitTask.ID
+        ## (the planning_unit_DM and unit_task_DM strings follow the relation's PU and UT)
         
         ## Set the cue to be 'start' if theRelation's location is 0, and the culag to be 'none'
         if theRelation.location == 0:
             print "(SGOMS_Model.updateRelation) self.location == 0"
-            ## Set the cuelag to 'none'
-            theRelation.cuelag = 'none'
-            ## Set the cue ('start' if location = 0)
-            theRelation.cue_DM = 'start'
+            ## Set the cuelag to 'none', and the cue ('start' if location = 0)
+            theRelation.setCues([['none', 'start']])
         
         if len(precedingRelations) > 0: ## If there are preceding relations...
             print "(SGOMS_Model.updateRelation) self.location is not 0, setting cue etc."
             #FDO print "(SGOMS_Model.updateRelation) preceding relation = ", precedingRelations[0]
             #FDO print "(SGOMS_Model.updateRelation) preceding relations's cue_DM = ", precedingRelations[0].cue_DM 
-            theRelation.cuelag_DM = precedingRelations[0].cue_DM ## Pick an arbitrary node for now
-            #FDO print "(UTNode.updateRelation) self.cuelag=", self.pUxUTRelation.cuelag_DM
-            theRelation.cue_DM = precedingRelations[0].unitTask.ID
+            ## Pick an arbitrary node for now
+            theRelation.setCues([[precedingRelations[0].cue_DM, precedingRelations[0].unitTask.ID]])
             
         theRelation.updateTuppleID()
         theRelation.updateDM_string()
         
 
-    ########## Write to ACT-R ##########
+    ########## Compile the model ##########
+    
+    def lowerToIR(self):
+        '''Returns the SGOMS_IR of the model, lowering the model only if it has changed since the last call
+        
+        The IR is cached until invalidateIR() is called (by the add methods, Graph.update(), and before saving)
+        Call invalidateIR() after changing the SGOMS units directly, outside of a Graph'''
+        
+        ## Models loaded from files saved before the IR existed do not have an irCache
+        if getattr(self, "irCache", None) == None:
+            self.irCache = SGOMS_IR(self)
+            print "(SGOMS_Model.lowerToIR) lowered the model:", self.irCache
+        
+        return self.irCache
+    
+    def invalidateIR(self):
+        '''Discards the cached SGOMS_IR, so the next lowerToIR() call lowers the model again'''
+        
+        self.irCache = None
+        
+    def lowerVariant(self, theUnitTaskOrders=None, theMethodOrders=None):
+        '''Returns the SGOMS_IR of a variant of the model, without changing the model (see SGOMS_IR.returnVariant)
+        
+        theUnitTaskOrders should be a dictionary of planning unit ID -> list of unit task IDs, in their new order
+        theMethodOrders should be a dictionary of unit task ID -> list of method IDs, in their new order'''
+        
+        return self.lowerToIR().returnVariant(theUnitTaskOrders, theMethodOrders)
+        
+    def compileTo(self, theTarget, theFileName):
+        '''Compiles the model with the emitter registered as theTarget (e.g. "ccmsuite", "json", "lisp"),
+        and writes the result to theFileName
+        Returns True if the file was written, False if there is no such emitter
+        
+        Several targets can be compiled from the same model for the cost of a single lowering (see lowerToIR)'''
+        
+        emitter = ModelEmitter.returnEmitter(theTarget)
+        if emitter == None:
+            print "XXX (SGOMS_Model.compileTo) no file written XXX"
+            return False
+        
+        emitter.emitToFile(self.lowerToIR(), theFileName)
+        return True
 
     def outputToACTR(self, theFileName):
         '''Takes what is in the model and outputs it into Python ACT-R readable code
         
         theFileName should be a string that designates the directory to which the file is saved'''
 
-        #directory = os.getcwd()
-        #print "(SGOMS_Model.outputToACTR) Directory = " + directory
+        print "(SGOMS_Model.outputToACTR) filename = ", theFileName
+        
+        self.compileTo("ccmsuite", theFileName)
+        
+        print "(SGOMS_Model.outputToACTR) ACT-R file export completed"
+
 
-        f = open(theFileName, "w")  ## Open a new file for writing
-        #f = open("TestWriting.py", "w")  
+##### Compiling the Model #####
+
+class BufferScanner:
+    '''Finds the buffers that firing conditions and behaviours refer to
+    
+    A firing condition refers to the buffer it tests (b_unit_task='unit_task:veggies'),
+    and a behaviour to each buffer whose set/modify/clear method it calls (b_unit_task.set('unit_task:veggies'))
+    A string is usually only scanned once; the results are memoized in a QueryCache shared by every BufferScanner,
+    which keeps the most recently used BufferScanner.CAPACITY strings, so scanning many models does not grow it without bound'''
+    
+    FIRING_CONDITION = re.compile("^\\s*([A-Za-z_][A-Za-z0-9_]*)\\s*=")
+    BEHAVIOUR = re.compile("\\b([A-Za-z_][A-Za-z0-9_]*)\\.(?:set|modify|clear)\\s*\\(")
+    
+    CAPACITY = 4096     ## The number of strings whose buffers are kept
+    
+    ## (string, pattern) -> the buffers it refers to, shared by every BufferScanner (made by the first scan, 
+    ## since QueryCache is defined further down)
+    cache = None
+    
+    def returnBuffers(self, theFiringConditions, theBehaviours):
+        '''Returns the buffers referred to by theFiringConditions and theBehaviours (lists of strings), in order'''
+        
+        buffers = []
+        for firingCondition in theFiringConditions:
+            for buffer in self.scan(firingCondition, BufferScanner.FIRING_CONDITION):
+                if buffer not in buffers:
+                    buffers.append(buffer)
+        for behaviour in theBehaviours:
+            for buffer in self.scan(behaviour, BufferScanner.BEHAVIOUR):
+                if buffer not in buffers:
+                    buffers.append(buffer)
+        return buffers
+    
+    def scan(self, theString, thePattern):
+        '''Returns the buffers referred to by theString, found with thePattern'''
         
-        print "(SGOMS_Model.outputToACTR) filename = ", theFileName
+        if BufferScanner.cache == None:
+            BufferScanner.cache = QueryCache(BufferScanner.CAPACITY)
+        
+        key = (theString, thePattern.pattern)
+        buffers = BufferScanner.cache.lookup(key)
+        if buffers is QueryCache.MISSING:
+            buffers = thePattern.findall(theString)
+            BufferScanner.cache.store(key, buffers)
+        return buffers
+        
+
+class SGOMS_IR:
+    '''A flat, indexed intermediate representation (IR) of an SGOMS_Model, which the ModelEmitters compile from
+    
+    Made by SGOMS_Model.lowerToIR(), which caches it until the model changes.
+    The IR only holds strings, lists, and dictionaries (copies, not references to the SGOMS units),
+    so emitting from it can not change the model, and it stays valid if the model is edited afterwards'''
+    
+    ## The kinds of productions, in the order they are emitted
+    KINDS = ["PlanningUnit", "UnitTask", "Method", "Operator"]
+    
+    ## The general productions that handle choosing unit tasks, which every model has: [name, firing conditions, behaviours]
+    GLOBAL_PRODUCTIONS = [
+        ["request_next_unit_task",
+         ["b_plan_unit='planning_unit:?planning_unit cuelag:?cuelag cue:?cue unit_task:?unit_task state:running'",
+          "b_unit_task='unit_task:?unit_task state:finished'"],
+         ["DM.request('planning_unit:?planning_unit cue:?unit_task unit_task:? cuelag:?cue')",
+          "b_plan_unit.set('planning_unit:?planning_unit cuelag:?cuelag cue:?cue unit_task:?unit_task state:retrieve')"]],
+        ["retrieve_next_unit_task",
+         ["b_plan_unit='state:retrieve'",
+          "b_DM='planning_unit:?planning_unit cuelag:?cuelag cue:?cue!finished unit_task:?unit_task'"],
+         ["b_plan_unit.set('planning_unit:?planning_unit cuelag:?cuelag cue:?cue unit_task:?unit_task state:running')",
+          "b_unit_task.set('unit_task:?unit_task state:start')"]],
+        ["last_unit_task",
+         ["b_unit_task='unit_task:finished state:start'", "b_plan_unit='planning_unit:?planning_unit'"],
+         ["b_unit_task.set('stop')"]]]
+    
+    def __init__(self, theModel):
+        '''Lowers theModel into the IR, in a single pass over each of its lists
+        
+        theModel should be an SGOMS_Model'''
+        
+        self.memoryBuffer = theModel.returnMemoryBuffer()
+        self.memoryParameters = theModel.returnMemoryParameters().items()    ## (name, value) tuples
+        self.memoryParameters.sort()
+        self.initialBehaviour = list(theModel.initialBehaviour)
+        
+        ## The DM chunks: one [planning_unit, cuelag, cue, unit_task] list and one DM_string per PUxUTRelation,
+        ## or per unit task it follows (see PUxUTRelation.returnCues)
+        self.chunks = []
+        self.chunkStrings = []
+        self.chunkIndex = {}        ## planning_unit -> indexes into self.chunks, in model order
+        
+        for relation in theModel.pUxUTRelationList:
+            for (cuelag, cue), dmString in zip(relation.returnCues(), relation.DM_strings):
+                self.addChunk([relation.planning_unit_DM, cuelag, cue, relation.unit_task_DM], dmString)
+        
+        ## The productions: one [kind, name, firing conditions, behaviours] list per distinct SGOMS unit,
+        ## Planning Units first, then Unit Tasks, Methods, and Operators (the order outputToACTR writes them in)
+        ## Units with the same content (see SGOMSUnitStore.returnKey) are the same production, so it is only emitted once
+        self.productions = []
+        self.productionIndex = {}   ## name -> indexes into self.productions
+        self.kindIndex = {}         ## kind -> indexes into self.productions
+        
+        theModel.returnUnitStore()  ## Compacts the lists of models saved before the store existed
+        lowered = {}                ## The content keys of the units lowered so far
+        
+        unitLists = [theModel.planningUnitList, theModel.unitTaskList, theModel.methodList, theModel.operatorList]
+        for kind, unitList in zip(self.KINDS, unitLists):
+            self.kindIndex[kind] = []
+            for unit in unitList:
+                key = SGOMSUnitStore.returnKey(unit)
+                if key in lowered:
+                    continue
+                lowered[key] = True
+                self.productionIndex.setdefault(unit.ID, []).append(len(self.productions))
+                self.kindIndex[kind].append(len(self.productions))
+                self.productions.append([kind, unit.ID, list(unit.firingConditions), list(unit.behaviour)])
+        
+        self.findBuffers(theModel.bufferList)
+        
+        ## The hierarchy below the Unit Tasks: unit task ID -> Method IDs, and method ID -> Operator IDs (by location)
+        self.methodsOfUnitTask = self.indexRelations(theModel.uTxMRelationList, "unitTask", "method")
+        self.operatorsOfMethod = self.indexRelations(theModel.mxORelationList, "method", "operator")
+        
+    def __str__(self):
+        '''Returns a string representation of the SGOMS_IR'''
+        
+        return "SGOMS_IR with " + str(len(self.chunks)) + " DM chunks and " + str(len(self.productions)) + " productions"
+        
+    def findBuffers(self, theDeclaredBuffers):
+        '''Finds the buffers that the productions and initial behaviour refer to (see BufferScanner), and sets:
+            self.buffers, the buffers to declare: those referred to, plus the memory buffer 
+                (in the order of theDeclaredBuffers, then in the order they are referred to)
+            self.undeclaredBuffers, the buffers referred to that are not in theDeclaredBuffers
+            self.unusedBuffers, the buffers in theDeclaredBuffers that nothing refers to, which are not declared
+        
+        theDeclaredBuffers should be the model's bufferList'''
+        
+        scanner = BufferScanner()
+        referenced = scanner.returnBuffers([], self.initialBehaviour)
+        for production in self.productions + SGOMS_IR.GLOBAL_PRODUCTIONS:
+            for buffer in scanner.returnBuffers(production[-2], production[-1]):
+                if buffer not in referenced:
+                    referenced.append(buffer)
+        if self.memoryBuffer not in referenced:
+            referenced.append(self.memoryBuffer)
+        
+        self.buffers = [buffer for buffer in theDeclaredBuffers if buffer in referenced]
+        self.buffers += [buffer for buffer in referenced if buffer not in self.buffers]
+        self.undeclaredBuffers = [buffer for buffer in referenced 
+                                  if buffer not in theDeclaredBuffers and buffer != self.memoryBuffer]
+        self.unusedBuffers = [buffer for buffer in theDeclaredBuffers if buffer not in referenced]
+        
+    def addChunk(self, theChunk, theDM_string):
+        '''Adds theChunk (a [planning_unit, cuelag, cue, unit_task] list) and its DM_string to the IR'''
+        
+        self.chunkIndex.setdefault(theChunk[0], []).append(len(self.chunks))
+        self.chunks.append(theChunk)
+        self.chunkStrings.append(theDM_string)
+        
+    def returnVariant(self, theUnitTaskOrders=None, theMethodOrders=None):
+        '''Returns a copy of the IR with some Planning Units' Unit Tasks and some Unit Tasks' Methods put in a different order
+        The copy shares everything that is not changed with this IR, so making variants is cheap
+        
+        theUnitTaskOrders should be a dictionary of planning unit ID -> list of unit task IDs, in their new order
+            (the chunks of those planning units are replaced by a chain through the unit tasks; include 'finished' at the end)
+        theMethodOrders should be a dictionary of unit task ID -> list of method IDs, in their new order'''
+        
+        variant = copy(self)
+        
+        if theUnitTaskOrders:
+            variant.chunks = []
+            variant.chunkStrings = []
+            variant.chunkIndex = {}
+            for i in range(len(self.chunks)):
+                if not theUnitTaskOrders.has_key(self.chunks[i][0]):
+                    variant.addChunk(self.chunks[i], self.chunkStrings[i])
+            
+            ## Chain the unit tasks the same way UTNode.updateRelation does: the cue is the previous unit task,
+            ## and the cuelag is the previous cue
+            for planningUnit in sorted(theUnitTaskOrders.keys()):
+                cuelag = 'none'
+                cue = 'start'
+                for unitTask in theUnitTaskOrders[planningUnit]:
+                    variant.addChunk([planningUnit, cuelag, cue, unitTask], 'planning_unit:' + planningUnit + 
+                                     ' cuelag:' + cuelag + ' cue:' + cue + ' unit_task:' + unitTask)
+                    cuelag = cue
+                    cue = unitTask
+        
+        if theMethodOrders:
+            variant.methodsOfUnitTask = dict(self.methodsOfUnitTask)
+            variant.methodsOfUnitTask.update(theMethodOrders)
+            
+        return variant
+    
+    def indexRelations(self, theRelations, theParentName, theChildName):
+        '''Returns a dictionary of parent ID -> list of child IDs, ordered by location, for the connected relations
+        
+        theRelations should be a list of UTxMRelations or MxORelations
+        theParentName and theChildName should be the names of the relation's parent and child attributes'''
+        
+        located = {}
+        for relation in theRelations:
+            parent = getattr(relation, theParentName)
+            if parent != None:
+                located.setdefault(parent.ID, []).append((relation.location, getattr(relation, theChildName).ID))
+        
+        ## Slave nodes have relations of their own, but the same parent, child, and location; each child is listed once
+        index = {}
+        for parentID in located:
+            located[parentID].sort()
+            index[parentID] = []
+            previous = None
+            for location, childID in located[parentID]:
+                if (location, childID) != previous:
+                    index[parentID].append(childID)
+                previous = (location, childID)
+        return index
+    
+    def returnProductions(self, theKind):
+        '''Returns the [kind, name, firing conditions, behaviours] lists of the productions of theKind
+        
+        theKind should be one of SGOMS_IR.KINDS'''
+        
+        return [self.productions[i] for i in self.kindIndex[theKind]]
+    
+    def toDictionary(self):
+        '''Returns the IR as a dictionary of plain lists and strings (e.g. for writing as JSON)'''
+        
+        productions = []
+        for kind, name, firingConditions, behaviour in self.productions:
+            productions.append({"kind": kind, "name": name, 
+                                "firingConditions": firingConditions, "behaviour": behaviour})
+        
+        chunks = []
+        for planningUnit, cuelag, cue, unitTask in self.chunks:
+            chunks.append({"planning_unit": planningUnit, "cuelag": cuelag, "cue": cue, "unit_task": unitTask})
+        
+        return {"buffers": self.buffers,
+                "memoryBuffer": self.memoryBuffer,
+                "memoryParameters": dict(self.memoryParameters),
+                "undeclaredBuffers": self.undeclaredBuffers,
+                "unusedBuffers": self.unusedBuffers,
+                "initialBehaviour": self.initialBehaviour,
+                "chunks": chunks,
+                "productions": productions,
+                "methodsOfUnitTask": self.methodsOfUnitTask,
+                "operatorsOfMethod": self.operatorsOfMethod}
+    
+
+class ModelEmitter:
+    '''The base class of the compilation backends, which write an SGOMS_IR out as a model for some target
+    
+    Each emitter is registered under its name with ModelEmitter.register(), 
+    and is used through SGOMS_Model.compileTo(name, fileName)
+    ModelEmitter is abstract: subclasses must override emit(), and register() refuses emitters that do not'''
+    
+    ## The registered emitters, name -> ModelEmitter
+    registry = {}
+    
+    name = "emitter"
+    description = "Emitter"
+    extension = "txt"   ## The file extension of the files written
+    
+    def register(theEmitter):
+        '''Registers theEmitter under its name, replacing any emitter already registered under that name
+        Returns True if theEmitter was registered, False if it does not override emit()'''
+        
+        if theEmitter.__class__.emit.im_func is ModelEmitter.emit.im_func:
+            print "XXX (ModelEmitter.register)", theEmitter.__class__.__name__, "does not override emit(), not registered XXX"
+            return False
+        
+        ModelEmitter.registry[theEmitter.name] = theEmitter
+        return True
+    register = staticmethod(register)
+    
+    def returnEmitter(theName):
+        '''Returns the emitter registered as theName, or None if there is none'''
+        
+        if not ModelEmitter.registry.has_key(theName):
+            print "XXX (ModelEmitter.returnEmitter) no emitter is registered as", theName, "XXX"
+            return None
+        return ModelEmitter.registry[theName]
+    returnEmitter = staticmethod(returnEmitter)
+    
+    def emit(self, theIR, theFile):
+        '''Writes theIR to theFile (abstract: every emitter overrides this, see register)
+        
+        theIR should be an SGOMS_IR
+        theFile should be a file (or anything with a write(string) method)'''
+        
+        raise NotImplementedError("(ModelEmitter.emit) must be overridden by " + self.__class__.__name__)
+    
+    def emitToFile(self, theIR, theFileName):
+        '''Opens theFileName for writing, and writes theIR to it'''
+        
+        f = open(theFileName, "w")
+        self.emit(theIR, f)
+        f.close()
+        
+        print "(ModelEmitter.emitToFile)", self.name, "file written to", theFileName
+
+
+class CCMSuiteEmitter(ModelEmitter):
+    '''Writes the model as Python ACT-R (CCMSuite) code; the output of File -> Export To ACT-R'''
+    
+    name = "ccmsuite"
+    description = "Python ACT-R (CCMSuite)"
+    extension = "py"
+    
+    ## The comment written at the top of each kind of production, and the comment used when one has no behaviour
+    SECTIONS = [("PlanningUnit", "    \n## Planning Units\n", "Planning Unit"),
+                ("UnitTask", "    \n## Unit Tasks\n", "Unit Task"),
+                ("Method", "    \n## Methods\n", "Method"),
+                ("Operator", "    \n## Operators \n", "Operator")]
+    
+    def emit(self, theIR, f):
+        '''Writes theIR to the file f as Python ACT-R code'''
+        
+        self.emitHeader(f)
 
-        ## Write the basic import statements
-        #f.write("import sys\n")
-        #f.write("sys.path.insert(0, 'C:/CCMSuite/CCMSuite/')\n")
+        ## Write the Agent
+        self.emitAgentClass(f, theIR, "MyAgent", "ACTR")
+        
+        self.emitGlobalProductions(f)
+        
+        ## Write the code to run the model
+        f.write("## Code to run the model\n")
+        f.write("tim = MyAgent()\n")
+        f.write("env = MyEnvironment()\n")
+        f.write("env.agent = tim\n")
+        f.write("ccm.log_everything(env)\n\n")
+
+        f.write("env.run()\n")
+        f.write("ccm.finished()\n")
+        
+    def emitAgents(self, theAgents, f):
+        '''Writes several agents, each with its own model, to the file f as one Python ACT-R file with a shared environment
+        
+        theAgents should be a list of (agent name, SGOMS_IR) tuples; the names should be valid Python identifiers
+        
+        Productions that every agent has (same name, firing conditions, and behaviours) are written once, 
+        in a base class SGOMSAgent that every agent class inherits from, along with the global productions.
+        Each agent class declares its own buffers and DM, adds its own chunks, and has the rest of its productions
+        (a production that only some of the agents have is written in each of their classes, 
+        so that no agent inherits a production, or uses a buffer, that is not in its own model)'''
+        
+        ## The productions of each agent, by content
+        agentKeys = []      ## For each agent, (name, firing conditions, behaviours) -> True
+        agentCounts = {}    ## (name, firing conditions, behaviours) -> number of agents
+        for agentName, ir in theAgents:
+            seen = {}
+            for kind, name, firingConditions, behaviours in ir.productions:
+                key = (name, tuple(firingConditions), tuple(behaviours))
+                if not seen.has_key(key):
+                    seen[key] = True
+                    agentCounts[key] = agentCounts.get(key, 0) + 1
+            agentKeys.append(seen)
+        
+        ## Only productions that every agent has are shared
+        shared = {}     ## name -> (name, firing conditions, behaviours)
+        for key in agentCounts:
+            if agentCounts[key] == len(theAgents):
+                shared[key[0]] = key
+        
+        ## Make sure that no agent would inherit a production from outside its own model
+        for i in range(len(theAgents)):
+            for key in shared.values():
+                if not agentKeys[i].has_key(key):
+                    print "XXX (CCMSuiteEmitter.emitAgents)", theAgents[i][0], "does not have", key[0], "; not shared XXX"
+                    shared.pop(key[0], None)
+        
+        self.emitHeader(f)
+        
+        f.write("## Productions shared by every agent\n")
+        f.write("class SGOMSAgent(ACTR):\n")
+        for name in sorted(shared.keys()):
+            name, firingConditions, behaviours = shared[name]
+            self.emitProduction(f, name, firingConditions, behaviours, "unit")
+        self.emitGlobalProductions(f)
+        
+        for agentName, ir in theAgents:
+            f.write("## Agent " + agentName + "\n")
+            self.emitAgentClass(f, ir, self.returnClassName(agentName), "SGOMSAgent", shared)
+            f.write("\n")
+        
+        ## Write the code to run the model
+        f.write("## Code to run the model\n")
+        f.write("env = MyEnvironment()\n")
+        for agentName, ir in theAgents:
+            f.write("env." + agentName + " = " + self.returnClassName(agentName) + "()\n")
+        f.write("ccm.log_everything(env)\n\n")
+
+        f.write("env.run()\n")
+        f.write("ccm.finished()\n")
+        
+        print "(CCMSuiteEmitter.emitAgents)", len(theAgents), "agents written, sharing", len(shared), "productions"
+    
+    def emitAgentsToFile(self, theAgents, theFileName):
+        '''Writes several agents to theFileName (see emitAgents)
+        
+        theAgents should be a list of (agent name, SGOMS_Model) tuples'''
+        
+        f = open(theFileName, "w")
+        self.emitAgents([(agentName, model.lowerToIR()) for agentName, model in theAgents], f)
+        f.close()
+        
+        print "(CCMSuiteEmitter.emitAgentsToFile) file written to", theFileName
+        
+    def returnClassName(self, theAgentName):
+        '''Returns the name of the class of the agent named theAgentName'''
+        
+        return theAgentName[0].upper() + theAgentName[1:] + "Agent"
+    
+    def emitHeader(self, f):
+        '''Writes the import statements and the environment to the file f'''
         
         ## The ACT-R file must have access to ccm (the Python ACT-R library) in order to run
         ## Either must save ACT-R file to the same directory as ccm, or write import statement at top of ACT-R file.
@@ -951,141 +1789,299 @@ class SGOMS_Model(io.Serializable):
         f.write("## The Environment\n")
         f.write("class MyEnvironment(ccm.Model):\n")
         f.write("   pass    ## Environment is empty\n\n")
+        
+    def emitAgentClass(self, f, theIR, theClassName, theBaseClass, theSharedProductions=None):
+        '''Writes an agent class for theIR to the file f: its buffers, DM, init, and unit productions
+        
+        theSharedProductions is optional; if given (see emitAgents), the productions in it are left out 
+            (they are inherited from theBaseClass), and productions repeated in theIR are only written once'''
+        
+        self.emitAgentHeader(f, theClassName, theBaseClass, theIR.buffers, theIR.memoryBuffer, theIR.memoryParameters)
+        
+        ## In order for the production system to work correctly, the final unit_task slot value must equal 'finished'
+        ## (see SGOMS_Model.outputToACTR)
+        for chunkString in theIR.chunkStrings:
+            self.emitChunk(f, chunkString)
+        
+        self.emitInitialBehaviour(f, theIR.initialBehaviour)
+        
+        ## Write the Planning Unit, Unit Task, Method, and Operator Productions
+        written = {}
+        for kind, comment, unitName in self.SECTIONS:
+            f.write(comment)
+            for unitKind, name, firingConditions, behaviours in theIR.returnProductions(kind):
+                if theSharedProductions != None:
+                    key = (name, tuple(firingConditions), tuple(behaviours))
+                    if theSharedProductions.get(name) == key or written.has_key(key):
+                        continue
+                    written[key] = True
+                self.emitProduction(f, name, firingConditions, behaviours, unitName)
+    
+    def emitAgentHeader(self, f, theClassName, theBaseClass, theBuffers, theMemoryBuffer, theMemoryParameters):
+        '''Writes the start of an agent class to the file f: the class statement, its buffers and DM, 
+        and the start of the init production (which emitChunk() and emitInitialBehaviour() continue)
+        
+        theBuffers should be a list of buffer names, theMemoryBuffer the buffer DM uses, 
+        and theMemoryParameters a list of (name, value) tuples (see SGOMS_IR)'''
+        
+        f.write("class " + theClassName + "(" + theBaseClass + "):\n")
+        for buffer in theBuffers:
+            f.write("    " + buffer + "=Buffer()\n")    ## For each buffer the productions use, write the appropriate ACT-R code
 
-        ## Write the Agent
-        f.write("class MyAgent(ACTR):\n")
-        for buffer in self.bufferList:
-            f.write("    " + buffer + "=Buffer()\n")    ## For each buffer in self.bufferList, write the appropriate ACT-R code
-
-        f.write("    DM=Memory(buffer_DM)\n\n")     ## The DM is hard-coded for now, note that "buffer_DM" must be a buffer
-                                                    ## instantiated above (i.e. is in the bufferList) or else the ACT-R code won't run
-        ## Write the init method, adding chunks to DM
+        ## The DM and its parameters
+        f.write("    DM=Memory(" + theMemoryBuffer)
+        for name, value in theMemoryParameters:
+            f.write(", " + name + "=" + value)
+        f.write(")\n\n")
+        
+        ## Write the init method, which adds the chunks to DM
         f.write("    def init():\n")
-        for relation in self.pUxUTRelationList:
-            f.write("        DM.add('" + relation.DM_string + "')\n")
-            
-        ## ^Each PUxUTRelation has a string representation of the unit task, planning unit, and firing conditions
-        ## of the unit task (represented by cue and cuelag). 
-        ## This is input into declarative memory in ACT-R, and is how unit tasks/planning units are represented in ACT-R
-        ## (in addition to planning unit and unit task productions)
         
-        ## In order for the production system to work correctly, the final unit_task slot value must equal 'finished'
-        ## e.g. 'planning_unit:prep_wrap    cuelag:spreads    cue:sauce    unit_task:finished'
-        ## This 'finished' unit task may have no behaviour, but must be represented in the DM_string
-        ## by having a PUxUTRelation with a 'finished' unit task exist at the end of the planning unit.
-        ## This is so the lastUnitTask production at the end of the ACT-R file can fire
+    def emitChunk(self, f, theChunkString):
+        '''Writes the line of the init production that adds theChunkString to DM, to the file f'''
         
-        ## Write the initial behaviour of the model
+        f.write("        DM.add('" + theChunkString + "')\n")
         
-        f.write("\n\n##Initial Model Behaviours\n")
+    def emitInitialBehaviour(self, f, theInitialBehaviour):
+        '''Writes the initial behaviour of the model (a list of strings) to the file f, at the end of the init production'''
         
+        f.write("\n\n##Initial Model Behaviours\n")
         
         ## For syntax reasons, there should be a pass at the end of each function that has no other behaviour (otherwise error)
-        if len(self.initialBehaviour) < 1:
+        if len(theInitialBehaviour) < 1:
             f.write("        pass    ## No initial model behaviours\n")
         else:
-            for behaviour in self.initialBehaviour:
+            for behaviour in theInitialBehaviour:
                 f.write("        " + behaviour + "\n")
+    
+    def emitProduction(self, f, theName, theFiringConditions, theBehaviours, theUnitName):
+        '''Writes a single production to the file f
         
-        ## Write the Planning Unit Productions
-        f.write("    \n## Planning Units\n")
-        for planningUnit in self.planningUnitList:
-            f.write("\n    def " + planningUnit.ID + "(")
-            for firingCondition in planningUnit.firingConditions:
-                f.write(firingCondition + ",\n")
-            f.write("):\n")
-            
-            if len(planningUnit.behaviour) < 1:
-                f.write("        pass    ## No behaviour specified for this Planning Unit\n")
-            else:
-                for behaviour in planningUnit.behaviour:
-                    f.write("        " + behaviour + "\n")
-            
-        ## Write the Unit Task Productions
-        f.write("    \n## Unit Tasks\n")
-        for unitTask in self.unitTaskList:
-            f.write("\n    def " + unitTask.ID + "(")
-            for firingCondition in unitTask.firingConditions:
-                f.write(firingCondition + ",\n") 
-            f.write("):\n")
-            
-            if len(unitTask.behaviour) < 1:
-                f.write("        pass    ## No behaviour specified for this Unit Task\n")
-            else:
-                for behaviour in unitTask.behaviour:
-                    f.write("        " + behaviour + "\n")
-                
-                    
-        ## Write the Method Productions
-        f.write("    \n## Methods\n")
-        for method in self.methodList:
-            f.write("\n    def " + method.ID + "(")
-            for firingCondition in method.firingConditions:
-                f.write(firingCondition + ",\n")
-            f.write("):\n")
-            
-            if len(method.behaviour) < 1:
-                f.write("        pass    ## No behaviour specified for this Method\n")
-            else:
-                for behaviour in method.behaviour:
-                    f.write("        " + behaviour + "\n")
-            
-        ## Write the Operator Productions
-        f.write("    \n## Operators \n")
-        for operator in self.operatorList:
-            f.write("\n    def " + operator.ID + "(")
-            for firingCondition in operator.firingConditions:
-                f.write(firingCondition + ",\n")
-            f.write("):\n")
-            
-            if len(operator.behaviour) < 1:
-                f.write("        pass    ## No behaviour specified for this Operator\n")
-            else:
-                for behaviour in operator.behaviour:
-                    f.write("        " + behaviour + "\n")
-            
-        ## Write the general productions that handle choosing unit tasks
+        theUnitName is the kind of unit, for the comment written when there are no behaviours'''
+        
+        f.write("\n    def " + theName + "(")
+        for firingCondition in theFiringConditions:
+            f.write(firingCondition + ",\n")
+        f.write("):\n")
+        
+        if len(theBehaviours) < 1:
+            f.write("        pass    ## No behaviour specified for this " + theUnitName + "\n")
+        else:
+            for behaviour in theBehaviours:
+                f.write("        " + behaviour + "\n")
+        
+    def emitGlobalProductions(self, f):
+        '''Writes the general productions that handle choosing unit tasks (SGOMS_IR.GLOBAL_PRODUCTIONS) to the file f'''
         
         f.write("\n## Global productions for retrieving Unit Tasks from DM\n\n")
         
-        ## Request Next Unit Task
-        f.write("    def request_next_unit_task(b_plan_unit='planning_unit:?planning_unit " \
-                + "cuelag:?cuelag cue:?cue unit_task:?unit_task state:running', " \
-                + "b_unit_task='unit_task:?unit_task state:finished'):\n")
-        f.write("        DM.request('planning_unit:?planning_unit cue:?unit_task unit_task:? cuelag:?cue')\n")
-        f.write("        b_plan_unit.set('planning_unit:?planning_unit cuelag:?cuelag " \
-                + "cue:?cue unit_task:?unit_task state:retrieve')\n\n")
-        
-        ## Retrive Next Unit Task
-        f.write("    def retrieve_next_unit_task(b_plan_unit='state:retrieve', " \
-                                + "b_DM='planning_unit:?planning_unit cuelag:?cuelag cue:?cue!finished unit_task:?unit_task'):\n")
-        f.write("        b_plan_unit.set('planning_unit:?planning_unit cuelag:?cuelag " \
-                + "cue:?cue unit_task:?unit_task state:running')\n")
-        f.write("        b_unit_task.set('unit_task:?unit_task state:start')\n\n")
-        
-        ## Last Unit Task
-        f.write("    def last_unit_task(b_unit_task='unit_task:finished state:start', " \
-                       + "b_plan_unit='planning_unit:?planning_unit'):\n")
-        f.write("        b_unit_task.set('stop')\n\n")
+        for name, firingConditions, behaviours in SGOMS_IR.GLOBAL_PRODUCTIONS:
+            f.write("    def " + name + "(" + ", ".join(firingConditions) + "):\n")
+            for behaviour in behaviours:
+                f.write("        " + behaviour + "\n")
+            f.write("\n")
         
         ########### Not sure what to do about setting the context at end of PU, how to make general?
         #f.write("        b_context.set('customer:new order:wrap status:prepped done:?planning_unit')\n\n")
 
 
-        ## Write the code to run the model
+class JSONEmitter(ModelEmitter):
+    '''Writes the IR itself as JSON, for use by other tools'''
+    
+    name = "json"
+    description = "JSON IR"
+    extension = "json"
+    
+    def emit(self, theIR, f):
+        '''Writes theIR to the file f as a JSON object (see SGOMS_IR.toDictionary)'''
+        
+        json.dump(theIR.toDictionary(), f, indent=2, sort_keys=True)
+        f.write("\n")
 
-        f.write("## Code to run the model\n")
-        f.write("tim = MyAgent()\n")
-        f.write("env = MyEnvironment()\n")
-        f.write("env.agent = tim\n")
-        f.write("ccm.log_everything(env)\n\n")
 
-        f.write("env.run()\n")
-        f.write("ccm.finished()\n")
+class LispACTREmitter(ModelEmitter):
+    '''Writes the model as Lisp ACT-R code
+    
+    The Python ACT-R firing conditions and behaviours are translated to buffer tests and actions:
+        b_x='slot:value slot:?var slot:!value'   ->   =b_x>  slot value  slot =var  - slot value
+        b_x.set('...') -> =b_x> ... (or +b_x> if the production does not test b_x),  b_x.clear() -> -b_x>
+        DM.request('...') -> +retrieval> ...,  and the DM buffer is tested as =retrieval>
+    Anything else (e.g. Python code in a behaviour) is written as a comment to be translated by hand.
+    The Memory parameters latency and threshold are set with sgp (:lf and :rt); any other parameter, 
+    or one whose value is not a number, is written as a comment.
+    The buffers other than retrieval are not standard Lisp ACT-R buffers; they must be provided by a module'''
+    
+    name = "lisp"
+    description = "Lisp ACT-R"
+    extension = "lisp"
+    
+    ## The Python ACT-R names for declarative memory and its buffer
+    MEMORY_NAMES = ["DM", "b_DM", "buffer_DM"]
+    
+    CHUNK_TYPE = "sgoms-unit-task"
+    SLOTS = ["planning_unit", "cuelag", "cue", "unit_task"]
+    
+    ## The Python ACT-R Memory parameters that Lisp ACT-R has: [name, sgp parameter, default (None for Lisp ACT-R's own)]
+    ## (the latency defaults to Python ACT-R's 0.05, rather than Lisp ACT-R's 1.0)
+    MEMORY_PARAMETERS = [["latency", ":lf", "0.05"], ["threshold", ":rt", None]]
+    
+    def emit(self, theIR, f):
+        '''Writes theIR to the file f as a Lisp ACT-R model'''
+        
+        f.write(";;; Lisp ACT-R model written by the SGOMS GUI\n")
+        f.write(";;; Buffers used by the Python ACT-R model: " + " ".join(theIR.buffers) + "\n\n")
+        f.write("(clear-all)\n\n")
+        f.write("(define-model sgoms-model\n\n")
+        self.emitParameters(f, theIR.memoryParameters)
+        f.write("(chunk-type " + self.CHUNK_TYPE + " " + " ".join(self.SLOTS) + ")\n\n")
+        
+        ## The DM chunks of the planning units
+        f.write("(add-dm\n")
+        for i in range(len(theIR.chunks)):
+            slots = []
+            for slot, value in zip(self.SLOTS, theIR.chunks[i]):
+                slots.append(slot + " " + self.returnValue(value))
+            f.write(" (chunk-" + str(i) + " isa " + self.CHUNK_TYPE + " " + " ".join(slots) + ")\n")
+        f.write(")\n")
+        
+        if len(theIR.initialBehaviour) > 0:
+            f.write("\n;; Initial model behaviours (set these up with goal-focus or set-buffer-chunk):\n")
+            for behaviour in theIR.initialBehaviour:
+                f.write(";;   " + behaviour + "\n")
+        
+        ## Units shared by several nodes (e.g. each Planning Unit's 'finished' Unit Task) are only written once,
+        ## since Lisp ACT-R would redefine the production
+        emitted = {}
+        for kind in SGOMS_IR.KINDS:
+            f.write("\n;; " + kind + "s\n")
+            for unitKind, name, firingConditions, behaviours in theIR.returnProductions(kind):
+                if not emitted.has_key(name):
+                    emitted[name] = True
+                    self.emitProduction(f, name, firingConditions, behaviours)
+        
+        f.write("\n;; Global productions for retrieving Unit Tasks from DM\n")
+        for name, firingConditions, behaviours in SGOMS_IR.GLOBAL_PRODUCTIONS:
+            self.emitProduction(f, name, firingConditions, behaviours)
+        
+        f.write(")\n")
+        
+    def emitParameters(self, f, theMemoryParameters):
+        '''Writes the sgp call setting the parameters of the model to the file f
+        
+        theMemoryParameters should be a list of (name, value) tuples (see SGOMS_IR.memoryParameters)'''
+        
+        values = {}
+        unmapped = []
+        for name, value in theMemoryParameters:
+            if self.returnParameter(name) != None and self.isNumber(value):
+                values[name] = value.strip()
+            else:
+                unmapped.append(name + "=" + value)
         
-        f.close()
+        if len(unmapped) > 0:
+            f.write(";; Memory parameters with no Lisp ACT-R equivalent (set these by hand): " + " ".join(unmapped) + "\n")
         
-        print "(SGOMS_Model.outputToACTR) ACT-R file export completed"
+        sgp = ["(sgp :esc t"]
+        for name, parameter, default in self.MEMORY_PARAMETERS:
+            value = values.get(name, default)
+            if value != None:
+                sgp.append(parameter + " " + value)
+        f.write(" ".join(sgp) + ")\n\n")
+    
+    def returnParameter(self, theName):
+        '''Returns the sgp parameter for the Memory parameter theName, or None if Lisp ACT-R does not have it'''
+        
+        for name, parameter, default in self.MEMORY_PARAMETERS:
+            if name == theName:
+                return parameter
+        return None
+    
+    def isNumber(self, theValue):
+        '''Returns True if theValue (a string of Python code) is a number that Lisp can read as it is'''
+        
+        ## Not float(), which also accepts "inf" and "nan"
+        return re.match("^\\s*[-+]?[0-9]*\\.?[0-9]+([eE][-+]?[0-9]+)?\\s*$", theValue) != None
+        
+    def emitProduction(self, f, theName, theFiringConditions, theBehaviours):
+        '''Writes a single (p ...) production to the file f'''
+        
+        f.write("\n(p " + theName + "\n")
+        
+        tested = []
+        for firingCondition in theFiringConditions:
+            if firingCondition.find("=") < 1:
+                f.write("   ;; " + firingCondition.strip() + "\n")
+                continue
+            buffer = self.returnBuffer(firingCondition[:firingCondition.find("=")].strip())
+            tested.append(buffer)
+            f.write("   =" + buffer + ">\n")
+            self.emitSlots(f, firingCondition[firingCondition.find("=")+1:])
+        
+        f.write("==>\n")
+        
+        for behaviour in theBehaviours:
+            behaviour = behaviour.strip()
+            dot = behaviour.find(".")
+            bracket = behaviour.find("(")
+            if dot < 1 or bracket < dot:
+                f.write("   ;; " + behaviour + "\n")
+                continue
+            
+            buffer = self.returnBuffer(behaviour[:dot])
+            action = behaviour[dot+1:bracket].strip()
+            if action == "request" and buffer == "retrieval":
+                f.write("   +retrieval>\n")
+                self.emitSlots(f, behaviour[bracket+1:behaviour.rfind(")")])
+            elif action == "set" and buffer in tested:
+                f.write("   =" + buffer + ">\n")
+                self.emitSlots(f, behaviour[bracket+1:behaviour.rfind(")")])
+            elif action == "set":
+                f.write("   +" + buffer + ">\n")
+                self.emitSlots(f, behaviour[bracket+1:behaviour.rfind(")")])
+            elif action == "clear":
+                f.write("   -" + buffer + ">\n")
+            else:
+                f.write("   ;; " + behaviour + "\n")
+        
+        f.write(")\n")
+    
+    def emitSlots(self, f, thePattern):
+        '''Writes the slot tests/values of a Python ACT-R pattern (e.g. 'slot:value slot:?var') to the file f'''
+        
+        pattern = thePattern.strip().strip("'\"")
+        for token in pattern.split():
+            if token.find(":") < 0:
+                f.write("      ;; " + token + "\n")   ## A positional (unnamed) slot value
+                continue
+            
+            slot, value = token.split(":", 1)
+            if value.find("!") >= 0:
+                value, notValue = value.split("!", 1)
+                if value != "" and value != "?":
+                    f.write("      " + slot + " " + self.returnValue(value) + "\n")
+                f.write("    - " + slot + " " + self.returnValue(notValue) + "\n")
+            elif value != "?":
+                f.write("      " + slot + " " + self.returnValue(value) + "\n")
+    
+    def returnValue(self, theValue):
+        '''Returns a Python ACT-R slot value as a Lisp ACT-R one (?var becomes =var, an empty value becomes nil)'''
+        
+        if theValue == "":
+            return "nil"
+        if theValue.startswith("?"):
+            return "=" + theValue[1:]
+        return theValue
+    
+    def returnBuffer(self, theBuffer):
+        '''Returns the Lisp ACT-R name of a Python ACT-R buffer (declarative memory becomes retrieval)'''
+        
+        if theBuffer in self.MEMORY_NAMES:
+            return "retrieval"
+        return theBuffer
+        
+ModelEmitter.register(CCMSuiteEmitter())
+ModelEmitter.register(JSONEmitter())
+ModelEmitter.register(LispACTREmitter())
 
 #######
 # The GUI model classes (i.e. the GUI back-end related stuff)
@@ -1096,6 +2092,8 @@ class Node(io.Serializable):
     Nodes by themselves are not used in the GUI (although they could be); only their subclasses are
     The entire GUI consists basically of nodes and edges'''
     
+    PARENT_TYPE = None     ## The nodeType of the node that contains this kind of node (see returnParentNode)
+    
     RADIUS = 15     ## Nodes are by default circles, and their radius is set here
     
     def __init__(self, aLabel = "Node", aLocation = None, theIncidentEdges = None):
@@ -1124,6 +2122,8 @@ class Node(io.Serializable):
                                 ## getClosestNodeType("Node"), and getHopsToNodeType("Node") are used instead of getHopsToRootNode()
         self.selected = False   ## Indicates whether the node is selected or not
         self.recursed = False   ## A flag for using recursive functions such as getRootNode()
+        self.graph = None       ## The Graph the node is in (set by the Graph), whose GraphIndex answers the queries below
+        self.collapsed = False  ## Whether the units the node contains are hidden in the canvas (see Graph.returnHiddenNodes)
         
         ## Specifies the default order within the hierarchy (distance from the root)
         ## Order is essentially the number of hops from some specified node (e.g. the root node, or a PUNode)
@@ -1150,9 +2150,97 @@ class Node(io.Serializable):
         '''Adds theIncidentEdge to the list of incidentEdges'''
         
         self.incidentEdges.append(theIncidentEdge)
+        if self.returnGraph() != None:
+            self.graph.invalidateIndex()
+            self.graph.joinComponents(self, theIncidentEdge.otherEndFrom(self))
+            
+    def returnGraph(self):
+        '''Returns the Graph the node is in, or None if it is not in a Graph (or was loaded from an older file)'''
+        
+        return getattr(self, "graph", None)
+        
+    def returnGraphIndex(self):
+        '''Returns the GraphIndex of the node's Graph, 
+        or None if the node is not in a Graph, in which case the queries search the incident edges directly'''
+        
+        if self.returnGraph() == None:
+            return None
+        
+        index = self.graph.returnIndex()
+        if not index.contains(self):
+            return None
+        return index
+        
+    def isCollapsed(self):
+        '''Returns True if the units the node contains are hidden in the canvas (nodes from older files are not collapsed)'''
+        
+        return getattr(self, "collapsed", False)
+    
+    def drawCollapsed(self, aPen, theCount):
+        '''Draws the number of nodes hidden by collapsing the node, in its centre (e.g. +12)
+        
+        aPen should be a Graphics object, theCount an int'''
+        
+        stringVar = "+" + str(theCount)
+        aPen.setColor(Color.black)
+        aPen.drawString(stringVar, self.location.x - 4 * len(stringVar), self.location.y + 5)
+        
+    def returnParentNode(self):
+        '''Returns the node that contains this node in the hierarchy (a UTNode's PUNode, an MNode's UTNode,
+        an ONode's MNode), or None; found by following the CONTAINS and SEQUENCE edges (see GraphIndex.buildHierarchy)'''
+        
+        if self.PARENT_TYPE == None:
+            return None
+        
+        index = self.returnGraphIndex()
+        if index != None:
+            return index.returnParent(self)
+        
+        ## Nodes outside a Graph search for the closest node of their parent's type instead
+        return self.getClosestNodeType(self.PARENT_TYPE)
+    
+    def returnOrder(self):
+        '''Returns the order of the node in its container: 1 for the first node of the sequence, 2 for the next, etc.
+        or None if the node has no container'''
+        
+        if self.PARENT_TYPE == None:
+            return None
+        
+        index = self.returnGraphIndex()
+        if index != None:
+            location = index.returnLocation(self)
+            if location == None:
+                return None
+            return location + 1
+        
+        return self.getHopsToNodeType(self.PARENT_TYPE)
+        
+    def returnComponentNodes(self, theNodeType=None):
+        '''Returns a list of every node the current node is (indirectly) connected to, of theNodeType only if it is given
+        Unlike getEveryConnectedNode(), the nodes are not in any particular order, 
+        and are looked up in the Graph's ComponentIndex rather than searched for
+        
+        theNodeType should be a string == "PUNode", "UTNode", "MNode", or "ONode" (or None for every type)'''
+        
+        if self.returnGraph() != None:
+            components = self.graph.returnComponentIndex()
+            if components.contains(self):
+                return components.returnMembers(self, theNodeType)
+        
+        ## Nodes outside a Graph search their edges instead
+        returnList = []
+        for node in self.getEveryConnectedNode():
+            if theNodeType == None or node.nodeType == theNodeType:
+                returnList.append(node)
+        return returnList
         
     def returnNeighbourNodes(self):
         '''Returns a list of nodes that the current node is connected to'''
+        
+        index = self.returnGraphIndex()
+        if index != None:
+            return index.returnNeighbourNodes(self)
+        
         returnList = []
         
         for edge in self.incidentEdges:
@@ -1240,6 +2328,8 @@ class Node(io.Serializable):
         
         E.g. nodes a(root) --> b --> c
         c.getHopsToRootNode() --> returns 2'''
+        
+        ## (This obsolete search is not in the GraphIndex, since the root flag is not part of the index)
                        
         nodeList = self.returnUnvisitedNeighbourNodes()  ## The initial list of related nodes to send to helper
         
@@ -1371,6 +2461,13 @@ class Node(io.Serializable):
             ")as the supplied node, returning self:", self.label
             return self  
         
+        ## Search the graph's index if there is one (the recursive search below is used for nodes outside a Graph)
+        index = self.returnGraphIndex()
+        if index != None:
+            returnVar = index.returnClosestNodeOfType(self, theNodeType)
+            print "(Node.getClosestNodeType) closest node to ", self.label, " of specified type =", returnVar
+            return returnVar
+        
         ## Return None if there are no neighbour nodes (i.e. throw an exception)
         if len(nodeList) < 1:
             print "(Node.getClosestNodeType) ", self.label, " is not connected to anything, returning None"
@@ -1487,6 +2584,13 @@ class Node(io.Serializable):
         if self.nodeType == theNodeType:
             print "(Node.getHopsToNodeType) self is of the same type", theNodeType, "as the supplied nodeType, returning 0"
             return 0
+        
+        ## Search the graph's index if there is one (the recursive search below is used for nodes outside a Graph)
+        index = self.returnGraphIndex()
+        if index != None:
+            returnVar = index.returnHopsToNodeType(self, theNodeType)
+            print "(Node.getHopsToNodeType) hops to nearest", theNodeType, " from ", self.label, "=", returnVar
+            return returnVar
                 
         ## Return None if there are no neighbour nodes (i.e. throw an exception)
         if len(nodeList) < 1:
@@ -1589,6 +2693,13 @@ class Node(io.Serializable):
         
         Eg. Nodes a --> b --> c
         c.getEveryConnectedNode() --> returns [a, b]'''
+        
+        ## Search the graph's index if there is one (the recursive search below is used for nodes outside a Graph)
+        index = self.returnGraphIndex()
+        if index != None:
+            returnList = index.returnConnectedNodes(self)
+            print "(Node.getEveryConnectedNode)", self.label, "is connected to", len(returnList), "nodes"
+            return returnList
        
         self.recursed = True  ## Prevent the function from finding itself
         
@@ -1701,6 +2812,8 @@ class PUNode(Node):
     PUNode inherits from Node
     Each PUNode will point to a unique underlying PlanningUnit'''
     
+    PARENT_TYPE = None     ## The nodeType of the node that contains this kind of node (see returnParentNode)
+    
     HEIGHT = 40
     WIDTH = 50
     
@@ -1736,6 +2849,7 @@ class PUNode(Node):
         self.nodeType = "PUNode"    ## A shortcut flag for determining the type of node, 
                                     ##^ used in getClosestNodeType(), and getHopsToNodeType()
         self.recursed = False
+        self.graph = None       ## The Graph the node is in (see Node.returnGraphIndex)
         self.order = 0
         
         print "(PUNode) initiated, ", self 
@@ -1783,7 +2897,7 @@ class PUNode(Node):
         ## Clear the list and repopulate on each update
         del self.planningUnit.unitTaskList[:]
         
-        connectedNodes = self.getEveryConnectedNode()
+        connectedNodes = self.returnComponentNodes("UTNode")
         
         ## We are not adding anything to SGOMS model here, we are only modifying what already exists
         ## e.g. no UnitTasks or PlanningUnits are being deleted or added to the SGOMS lists
@@ -1824,6 +2938,8 @@ class UTNode(Node):
     UTNode inherits from Node
     Each UTNode points directly to a unique underlying PUxUTRelation'''
     
+    PARENT_TYPE = "PUNode"     ## The nodeType of the node that contains this kind of node (see returnParentNode)
+    
     RADIUS = 20
     
     def __init__(self, aLabel = "UTNode", aLocation = None, theIncidentEdges = None, thePUxUTRelation = None):
@@ -1841,6 +2957,7 @@ class UTNode(Node):
         self.nodeType = "UTNode"    ## A shortcut flag for determining the type of node, 
                                     ##^ used in getClosestNodeType(), and getHopsToNodeType()
         self.recursed = False  ## A flag for recursive functions to use    
+        self.graph = None      ## The Graph the node is in (see Node.returnGraphIndex)
         
         if aLocation == None:
             self.location = Point(0,0)
@@ -1884,10 +3001,11 @@ class UTNode(Node):
     
     def getPrecedingUTNodes(self):
         '''Returns a list of nodes where the node's order is self.order -1
-        This is used for setting the cuelag and cue, which relies on the previous node in the PU order
+        This was used for setting the cuelag and cue, which relies on the previous node in the PU order
+        (they are now set along the chain of the PU, see Graph.updateChains)
         '''
         
-        connectedNodes = self.getEveryConnectedNode()
+        connectedNodes = self.returnComponentNodes("UTNode")
         returnList = []
         
         for node in connectedNodes:
@@ -1925,9 +3043,9 @@ class UTNode(Node):
         
     
     def updateOrder(self):
-        '''Updates self.order based on the distance to root node'''
+        '''Updates self.order based on the node's location in its PU (see returnOrder)'''
         
-        orderVar = self.getHopsToNodeType("PUNode") ## Will return None if can't find root node
+        orderVar = self.returnOrder() ## Will return None if the node is not in a PU
         if orderVar == None:    ## If can't find a root node, distance is zero
             self.order = 0
         else:
@@ -1952,7 +3070,7 @@ class UTNode(Node):
         ## I believe this is the syntax for clearing a list in python
         del self.pUxUTRelation.unitTask.methodList[:]
         
-        connectedNodes = self.getEveryConnectedNode()
+        connectedNodes = self.returnComponentNodes("MNode")
         
         ## We are not adding anything to SGOMS model here, we are only modifying what already exists
         ## e.g. no UnitTasks or Methods are being deleted or added to the SGOMS lists
@@ -1966,68 +3084,33 @@ class UTNode(Node):
                 self.pUxUTRelation.unitTask.addMethod(node.uTxMRelation.method)
     
     def updateRelation(self):
-        '''Updates self.pUxUTRelation based on the node's distance to the PU root
+        '''Updates self.pUxUTRelation based on the node's PU (see returnParentNode)
         
         Sets the relation's PU to be that of the PUNode's, none if there is no PUNode root
-        Sets the relation's location to be hops to root node - 1, 0 if there is not PUNode root
-        Sets the relation's planning_unit_DM, cuelag_DM, cue_DM, and unit_task_DM, based on the location
-        Does not worry about the UT or PU lists in SGOMS
-        Updates the relation's tuppleID and DM_string'''
+        Sets the relation's location to be order - 1, 0 if there is not PUNode root
+        Sets the relation's cuelag_DM and cue_DM to 'none' and 'start' if there is no PUNode root
+        (otherwise they are set by Graph.updateChains; the relation's planning_unit_DM, unit_task_DM, tuppleID and DM_string follow from its PU, UT and location)
+        Does not worry about the UT or PU lists in SGOMS'''
         
         #FDO print "(", self.label, ".updateRelation)"
         
-        root = self.getClosestNodeType("PUNode")
+        root = self.returnParentNode()
         
         ## If the root is a PUNode (i.e. not None), assign the PU to the relation, and the relation's location is order-1
+        ## The cue and cuelag depend on the preceding relation, so they are set afterwards for the whole chain 
+        ## of the PU at once (see Graph.updateChains), rather than by searching for the preceding node here
         if isinstance(root, PUNode):
             print "(UTNode.updateRelation) root is a PUNode"
             self.pUxUTRelation.planningUnit = root.planningUnit
             self.pUxUTRelation.location = self.order-1      ## Here we just use the node's order to set the relation's location
                                                         ## order = hops away; location 0 means it is the first in a chain or unconnected    
-            ### ACT-R Stuff ###
-            ## Set the planning_unit_DM string
-            self.pUxUTRelation.planning_unit_DM = root.planningUnit.ID
-            
-            ## Set the cuelag (previous relation's cue, 'none' if location = 0), 
-            ###### This should probably be changed in future versions #######
-            if self.pUxUTRelation.location == 0:    ## Location == 0 represents either an unconnected node or the first of a chain
-                print "(UTNode.updateRelation) self.location == 0"
-                self.pUxUTRelation.cuelag = 'none'
-                ## Set the cue ('start' if location = 0)
-                self.pUxUTRelation.cue_DM = 'start'
-            else:   ## If the location is not 0:
-                print "(UTNode.updateRelation) self.location is not 0, setting cuelag etc."
-                precedingNodes = self.getPrecedingUTNodes() ## A list of nodes with an order of self.order-1
-                #FDO print "(UTNode.updateRelation) preceding node = ", precedingNodes[0]
-                #FDO print "(UTNode.updateRelation) preceding node's cue_DM = ", precedingNodes[0].pUxUTRelation.cue_DM 
-                
-                if len(precedingNodes) > 0:     ## Check to see if there are preceding nodes
-                    ## If there are preceding Nodes:
-                    ## Make sure the preceding node is updated (we only care about the one arbitrary preceding node)
-                    ## ^Order etc. is updated elsewhere
-                    precedingNodes[0].updateRelation()  ## This needs to be done to avoid bugs
-                    ## Pick an arbitrary preceding node to set the cue and cuelag, don't deal with splitting or looping
-                    self.pUxUTRelation.cuelag_DM = precedingNodes[0].pUxUTRelation.cue_DM 
-                    #FDO print "(UTNode.updateRelation) self.cuelag=", self.pUxUTRelation.cuelag_DM
-                    self.pUxUTRelation.cue_DM = precedingNodes[0].pUxUTRelation.unitTask.ID
-                    
-                else:
-                    print "(UTNode.updateRelation) there are no preceding UT nodes, but ", self.label, \
-                    " is connected to a PU:", self.pUxUTRelation.planningUnit.ID
-                    ## If there are no preceding nodes (i.e. this node is the first in the series), set the attributes to their defaults
-                    self.pUxUTRelation.cuelag_DM = 'none'
-                    self.pUxUTRelation.cue_DM = 'start'
         
         else:   ## If there is no PUNode as a root, set the attributes back to their defaults
             print "(UTNode.updateRelation) there is no PUNode Root"
             self.pUxUTRelation.planningUnit = None
             self.pUxUTRelation.location = 0
             
-            self.pUxUTRelation.planning_unit_DM = ''
-            self.pUxUTRelation.cuelag_DM = 'none'
-            self.pUxUTRelation.cue_DM = 'start'
-            
-        self.pUxUTRelation.unit_task_DM = self.pUxUTRelation.unitTask.ID
+            self.pUxUTRelation.setCues([['none', 'start']])
         
         self.pUxUTRelation.updateTuppleID()
         self.pUxUTRelation.updateDM_string()
@@ -2066,6 +3149,8 @@ class MNode(Node):
     MNode inherits from Node
     Each MNode points directly to a unique underlying UTxMRelation'''
     
+    PARENT_TYPE = "UTNode"     ## The nodeType of the node that contains this kind of node (see returnParentNode)
+    
     RADIUS = 15
     
     def __init__(self, aLabel = "MNode", aLocation = None, theIncidentEdges = None, theUTxMRelation = None):
@@ -2083,6 +3168,7 @@ class MNode(Node):
         self.nodeType = "MNode"    ## A shortcut flag for determining the type of node, 
                                     ##^ used in getClosestNodeType(), and getHopsToNodeType()
         self.recursed = False  ## A flag for recursive functions to use    
+        self.graph = None      ## The Graph the node is in (see Node.returnGraphIndex)
         
         if aLocation == None:
             self.location = Point(0,0)
@@ -2138,9 +3224,9 @@ class MNode(Node):
         self.updateRelation()
     
     def updateOrder(self):
-        '''Updates self.order based on the distance to the closest UTNode'''
+        '''Updates self.order based on the node's location in its UT (see returnOrder)'''
         
-        orderVar = self.getHopsToNodeType("UTNode") ## Will return None if can't find root node
+        orderVar = self.returnOrder() ## Will return None if the node is not in a UT
         if orderVar == None:    ## If can't find a root node, distance is zero
             self.order = 0
         else:
@@ -2163,7 +3249,7 @@ class MNode(Node):
         ## I believe this is the syntax for clearing a list in python
         del self.uTxMRelation.method.operatorList[:]
         
-        connectedNodes = self.getEveryConnectedNode()
+        connectedNodes = self.returnComponentNodes("ONode")
         
         ## We are not adding anything to SGOMS model here, we are only modifying what already exists
         ## e.g. no UnitTasks or Methods are being deleted or added to the SGOMS lists
@@ -2177,15 +3263,15 @@ class MNode(Node):
                 self.uTxMRelation.method.addOperator(node.mxORelation.operator)
             
     def updateRelation(self):
-        '''Updates self.uTxMRelation based on the node's distance to the UT root
+        '''Updates self.uTxMRelation based on the node's UT (see returnParentNode)
         
-        Sets the relation's UT to be that of the closest connected UTNode, none if there is no connected UTNode
-        Sets the relation's location to be hops to closest UTNode - 1, 0 if there is no connected UTNode
+        Sets the relation's UT to be that of the UTNode containing it, none if there is none
+        Sets the relation's location to be order - 1, 0 if there is no UTNode containing it
         '''
         
         #FDO print "(MNode: ", self.label, ".updateRelation)"
         
-        root = self.getClosestNodeType("UTNode")     
+        root = self.returnParentNode()
         
         ## If the root is a UTNode (i.e. not None), assign the UT to the relation, and the relation's location is order-1
         if isinstance(root, UTNode):
@@ -2228,6 +3314,8 @@ class ONode(Node):
     ONode inherits from Node
     Each ONode points directly to a unique underlying MxORelation'''
     
+    PARENT_TYPE = "MNode"     ## The nodeType of the node that contains this kind of node (see returnParentNode)
+    
     RADIUS = 12
     
     def __init__(self, aLabel = "ONode", aLocation = None, theIncidentEdges = None, theMxORelation = None):
@@ -2245,6 +3333,7 @@ class ONode(Node):
         self.nodeType = "ONode"    ## A shortcut flag for determining the type of node, 
                                     ##^ used in getClosestNodeType(), and getHopsToNodeType()
         self.recursed = False  ## A flag for recursive functions to use    
+        self.graph = None      ## The Graph the node is in (see Node.returnGraphIndex)
         
         if aLocation == None:
             self.location = Point(0,0)
@@ -2297,9 +3386,9 @@ class ONode(Node):
         self.updateRelation()
     
     def updateOrder(self):
-        '''Updates self.order based on the distance to the closest MNode'''
+        '''Updates self.order based on the node's location in its Method (see returnOrder)'''
         
-        orderVar = self.getHopsToNodeType("MNode") ## Will return None if can't find root node
+        orderVar = self.returnOrder() ## Will return None if the node is not in a Method
         if orderVar == None:    ## If can't find a root node, distance is zero
             self.order = 0
         else:
@@ -2308,11 +3397,11 @@ class ONode(Node):
         print "(ONode.updateOrder)", self.label, " order = ", self.order
             
     def updateRelation(self):
-        '''Updates self.mxORelation based on the node's distance to the MNode root
+        '''Updates self.mxORelation based on the node's Method (see returnParentNode)
         
         Makes sure the label of the ONode corresponds to the ID of the Operator
-        Sets the relation's Method to be that of the closest connected MNode, none if there is no connected MNode
-        Sets the relation's location to be hops to closest MNode - 1, 0 if there is no connected MNode
+        Sets the relation's Method to be that of the MNode containing it, none if there is none
+        Sets the relation's location to be order - 1, 0 if there is no MNode containing it
         '''
         
         #FDO print "(ONode: ", self.label, ".updateRelation)"
@@ -2320,7 +3409,7 @@ class ONode(Node):
         ## Update the label
         self.label = self.mxORelation.operator.ID
         
-        root = self.getClosestNodeType("MNode")     
+        root = self.returnParentNode()
         
         ## If the root is a MNode (i.e. not None), assign the Method to the relation, and the relation's location is order-1
         if isinstance(root, MNode):
@@ -2358,16 +3447,31 @@ class ONode(Node):
         aPen.drawString(self.mxORelation.operator.ID, self.location.x + self.RADIUS, self.location.y - self.RADIUS)
 
 class Edge(io.Serializable):
-    '''Defines the model edge (i.e. the line that connects two nodes on the graph)'''
+    '''Defines the model edge (i.e. the line that connects two nodes on the graph)
+    
+    The type of an edge follows from the nodes it connects (see returnType):
+    a CONTAINS edge connects a unit to a unit one level below it (PU -> UT, UT -> Method, Method -> Operator),
+    and a SEQUENCE edge connects two units of the same level, one following the other (see isSequence)'''
+    
+    CONTAINS = "contains"
+    SEQUENCE = "sequence"
+    
+    ## The level of each kind of node in the hierarchy
+    LEVELS = {"PUNode": 0, "UTNode": 1, "MNode": 2, "ONode": 3}
     
-    def __init__(self, theStartNode, theEndNode, theLabel=None):
+    def __init__(self, theStartNode, theEndNode, theLabel=None, theDirected=False):
         '''Initializes the Edge with a startnode and end node
         
         theStartNode should be a Node
-        theEndNode should be a Node'''
+        theEndNode should be a Node
+        theDirected should be True if the edge goes from theStartNode to theEndNode (see isSequence)'''
         
         self.startNode = theStartNode
         self.endNode = theEndNode
+        
+        ## An undirected edge between two UTNodes goes from the one closer to the PU to the other;
+        ## a directed edge goes from its startNode to its endNode, so it can join branches or loop back
+        self.directed = theDirected
         if theLabel == None:
             self.label = theStartNode.label + " --> " + theEndNode.label 
         else:
@@ -2387,6 +3491,60 @@ class Edge(io.Serializable):
                     
         print "(Edge.toggleSelected) selected = ", self.selected
         
+    def isDirected(self):
+        '''Returns True if the edge goes from its startNode to its endNode'''
+        
+        return getattr(self, "directed", False)     ## Edges loaded from older files are undirected
+    
+    def toggleDirected(self):
+        '''Makes the edge directed from its startNode to its endNode, or undirected again
+        The GraphIndex of the edge's graph is rebuilt, since the successors of its nodes change'''
+        
+        self.directed = not self.isDirected()
+        print "(Edge.toggleDirected) directed = ", self.directed
+        
+        graph = self.startNode.returnGraph()
+        if graph != None:
+            graph.invalidateIndex()
+        
+    def returnType(self):
+        '''Returns Edge.CONTAINS, Edge.SEQUENCE, or None if the edge connects nodes that are not related in the hierarchy
+        (e.g. a PUNode to an MNode, or two PUNodes)'''
+        
+        startLevel = Edge.LEVELS.get(self.startNode.nodeType)
+        endLevel = Edge.LEVELS.get(self.endNode.nodeType)
+        if startLevel == None or endLevel == None:
+            return None
+        if startLevel - endLevel in (1, -1):
+            return Edge.CONTAINS
+        if startLevel == endLevel and startLevel > 0:
+            return Edge.SEQUENCE
+        return None
+    
+    def returnContainer(self):
+        '''Returns the node at the upper end of a CONTAINS edge (e.g. the PUNode of a PU -> UT edge), or None'''
+        
+        if self.returnType() != Edge.CONTAINS:
+            return None
+        if Edge.LEVELS[self.startNode.nodeType] < Edge.LEVELS[self.endNode.nodeType]:
+            return self.startNode
+        return self.endNode
+    
+    def leadsTo(self, theNode):
+        '''Returns True if a SEQUENCE edge can lead from its other end to theNode
+        (an undirected edge leads both ways, a directed one only to its endNode)'''
+        
+        return not self.isDirected() or self.endNode is theNode
+    
+    def isSequence(self, theFromNode, theToNode):
+        '''Returns True if the edge makes theToNode follow theFromNode in a Planning Unit
+        
+        theFromNode and theToNode should be the UTNodes at the ends of the edge (with up to date orders)'''
+        
+        if self.isDirected():
+            return self.startNode is theFromNode and self.endNode is theToNode
+        return theFromNode.order == theToNode.order - 1
+        
     def otherEndFrom(self, aNode):
         '''If given a node that the edge is connected to, returns the other node
         
@@ -2424,15 +3582,443 @@ class Edge(io.Serializable):
         aPen.fillOval(self.returnMidpoint().x - 4, self.returnMidpoint().y - 4,     ## Draw an oval at the midpoint for selecting
                       8, 8)
         
+        ## Directed edges have a second oval three quarters of the way along, towards the endNode
+        if self.isDirected():
+            aPen.fillOval((self.startNode.location.x + 3 * self.endNode.location.x) / 4 - 3, 
+                          (self.startNode.location.y + 3 * self.endNode.location.y) / 4 - 3, 6, 6)
+        
     def printEdge(self):
         '''Prints the Edge as sNode(x,y) --> eNode(x,y)'''
         
         print self.startNode.label, "(", self.startNode.location.x, ",", self.startNode.location.y, ")", \
         " --> ", self.endNode.label, "(", self.endNode.location.x, ",", self.endNode.location.y, ")"
        
+class ComponentIndex:
+    '''The connected components of the nodes of a Graph, kept with union-find (a disjoint set forest)
+    
+    Adding an edge joins the components of its nodes (see Graph.joinComponents), so the index stays up to date
+    as a model is built without searching the graph. Deleting an edge or a node may split a component, which
+    union-find cannot do, so the index is marked stale instead and is rebuilt from the edges the next time 
+    it is needed (see Graph.returnComponentIndex).
+    
+    Each component keeps its members by nodeType, so returnMembers(node, "UTNode") is every UTNode connected 
+    to node without any traversal (see Node.returnComponentNodes). The index is not saved.'''
+    
+    def __init__(self, theNodes=None):
+        '''Builds the index of theNodes, joining the nodes at the ends of each of their incident edges
+        
+        theNodes should be the list of Nodes of a Graph (or None for an empty index)'''
+        
+        self.parent = {}        ## node -> its parent in the forest (the root of a component is its own parent)
+        self.members = {}       ## root -> {nodeType -> [the nodes of that type in the component]}
+        self.size = {}          ## root -> the number of nodes in the component
+        self.stale = False      ## True once an edge or node has been deleted (see Graph.splitComponents)
+        
+        if theNodes == None:
+            theNodes = []
+        
+        for node in theNodes:
+            self.addNode(node)
+        for node in theNodes:
+            for edge in node.incidentEdges:
+                other = edge.otherEndFrom(node)
+                if other in self.parent:    ## Edges to nodes outside the graph are left out
+                    self.union(node, other)
+                    
+    def __len__(self):
+        '''Returns the number of nodes in the index'''
+        
+        return len(self.parent)
+    
+    def contains(self, theNode):
+        '''Returns True if theNode is in the index'''
+        
+        return theNode in self.parent
+    
+    def addNode(self, theNode):
+        '''Adds theNode to the index, in a component of its own'''
+        
+        if theNode in self.parent:
+            return
+        self.parent[theNode] = theNode
+        self.members[theNode] = {theNode.nodeType: [theNode]}
+        self.size[theNode] = 1
+        
+    def find(self, theNode):
+        '''Returns the root of theNode's component (halving the path to it on the way)'''
+        
+        parent = self.parent
+        node = theNode
+        while parent[node] is not node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+    
+    def union(self, theNode, theOtherNode):
+        '''Joins the components of theNode and theOtherNode (the smaller component is merged into the larger one)'''
+        
+        root = self.find(theNode)
+        otherRoot = self.find(theOtherNode)
+        if root is otherRoot:
+            return
+        
+        if self.size[root] < self.size[otherRoot]:
+            root, otherRoot = otherRoot, root
+        
+        self.parent[otherRoot] = root
+        self.size[root] += self.size.pop(otherRoot)
+        members = self.members[root]
+        for nodeType, nodes in self.members.pop(otherRoot).items():
+            if nodeType in members:
+                members[nodeType].extend(nodes)
+            else:
+                members[nodeType] = nodes
+                
+    def returnMembers(self, theNode, theNodeType=None):
+        '''Returns a list of the other nodes in theNode's component (of theNodeType only, if it is given)
+        
+        theNode should be a Node in the index
+        theNodeType should be a string == "PUNode", "UTNode", "MNode", or "ONode" (or None for every type)'''
+        
+        members = self.members[self.find(theNode)]
+        
+        if theNodeType == None:
+            returnList = []
+            for nodes in members.values():
+                returnList.extend(nodes)
+        else:
+            returnList = list(members.get(theNodeType, []))
+        
+        if theNode.nodeType == theNodeType or theNodeType == None:
+            returnList.remove(theNode)
+        return returnList
+    
+    def returnComponentCount(self):
+        '''Returns the number of connected components'''
+        
+        return len(self.members)
+    
+    
+class QueryCache:
+    '''A least recently used cache of the answers to the GraphIndex's queries (see GraphIndex.returnClosestNodeOfType,
+    returnHopsToNodeType, returnConnectedNodes), so that asking the same node the same question again in one Graph.update
+    (e.g. each UTNode asking for its Planning Unit, and then its preceding nodes asking again) does not search again
+    
+    The answers are keyed by the node's position in the index, so the Graph empties the cache whenever it rebuilds 
+    the index (i.e. after the nodes or edges change). The counts of hits, misses, evictions and nodes visited 
+    are kept across rebuilds, and returned by returnStats() (see Graph.returnQueryStats).'''
+    
+    CAPACITY = 4096     ## The number of answers kept by default
+    
+    MISSING = object()  ## Returned by lookup() when the answer is not in the cache (an answer can be None)
+    
+    def __init__(self, theCapacity=None):
+        '''Initializes the QueryCache
+        
+        theCapacity should be the number of answers to keep (QueryCache.CAPACITY by default)'''
+        
+        self.capacity = theCapacity
+        if theCapacity == None:
+            self.capacity = QueryCache.CAPACITY
+        
+        self.entries = OrderedDict()    ## key -> answer, least recently used first
+        self.clearStats()
+        
+    def clearStats(self):
+        '''Sets the counts back to 0 (the answers are kept)'''
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.visits = 0         ## The nodes visited by the searches made on a miss
+        
+    def invalidate(self):
+        '''Discards every answer (called when the GraphIndex is rebuilt)'''
+        
+        if len(self.entries) > 0:
+            self.entries.clear()
+            self.invalidations += 1
+        
+    def lookup(self, theKey):
+        '''Returns the answer stored for theKey (and marks it most recently used), or QueryCache.MISSING'''
+        
+        answer = self.entries.pop(theKey, QueryCache.MISSING)
+        if answer is QueryCache.MISSING:
+            self.misses += 1
+            return answer
+        
+        self.entries[theKey] = answer
+        self.hits += 1
+        return answer
+    
+    def store(self, theKey, theAnswer, theVisits=0):
+        '''Stores theAnswer for theKey, evicting the least recently used answer if the cache is full
+        
+        theVisits should be the number of nodes visited to find theAnswer'''
+        
+        self.visits += theVisits
+        self.entries[theKey] = theAnswer
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(False)
+            self.evictions += 1
+            
+    def returnStats(self):
+        '''Returns a dict of the counts: hits, misses, evictions, invalidations, entries, capacity,
+        hit_rate (hits per query), and mean_visits (nodes visited per query, so 0 when every query is a hit)'''
+        
+        queries = self.hits + self.misses
+        stats = {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, 
+                 "invalidations": self.invalidations, "entries": len(self.entries), "capacity": self.capacity,
+                 "hit_rate": 0.0, "mean_visits": 0.0}
+        if queries > 0:
+            stats["hit_rate"] = float(self.hits) / queries
+            stats["mean_visits"] = float(self.visits) / queries
+        return stats
+    
+    
+class GraphIndex:
+    '''An index of the adjacency of the nodes in a Graph, stored as arrays of integers (compressed sparse rows)
+    
+    Each node has a position (its index in the Graph's list of nodes when the index was built);
+    the positions of the neighbours of the node at position i are neighbours[offsets[i]:offsets[i+1]],
+    in the same order as the node's incidentEdges.
+    
+    The neighbour and distance queries of the Nodes (returnNeighbourNodes, getEveryConnectedNode, getClosestNodeType, 
+    getHopsToNodeType) run on the index, with breadth first searches that reuse the same arrays on every call.
+    
+    The index also keeps the adjacency of each type of edge (see Edge.returnType): the containers of each node 
+    (the upper ends of its CONTAINS edges) and its successors (the nodes its SEQUENCE edges lead to), and from them
+    the hierarchy: the container each node belongs to (its PU, UT or Method) and its location in the container's
+    sequence, so that Node.returnParentNode() and Node.returnOrder() are array lookups (see buildHierarchy).
+    The Graph builds the index when it is first needed after the nodes or edges change (see Graph.returnIndex), 
+    so a batch of changes only rebuilds it once. The index is not saved.
+    The answers to the queries are kept in the Graph's QueryCache until the index is rebuilt.'''
+    
+    def __init__(self, theNodes, theVersion=0, theCache=None):
+        '''Builds the index of theNodes
+        
+        theNodes should be the list of Nodes of a Graph
+        theVersion should be the Graph's topologyVersion when the index is built
+        theCache should be a QueryCache to keep the answers to the queries in (it is emptied), or None to not keep them'''
+        
+        self.version = theVersion
+        self.cache = theCache
+        if theCache != None:
+            theCache.invalidate()
+        self.nodes = list(theNodes)
+        self.nodeTypes = [node.nodeType for node in self.nodes]
+        
+        self.position = {}      ## node -> position
+        for i in range(len(self.nodes)):
+            self.position[self.nodes[i]] = i
+        
+        ## The adjacency, one row of neighbour positions per node (edges to nodes outside the graph are left out)
+        ## Every edge is followed both ways here, directed or not, since connectivity does not depend on direction;
+        ## the direction only matters to the successor rows below (see Edge.leadsTo)
+        self.offsets = array('i', [0]) * (len(self.nodes) + 1)
+        self.neighbours = array('i')
+        for i in range(len(self.nodes)):
+            node = self.nodes[i]
+            for edge in node.incidentEdges:
+                j = self.position.get(edge.otherEndFrom(node))
+                if j != None:
+                    self.neighbours.append(j)
+            self.offsets[i + 1] = len(self.neighbours)
+        
+        ## The adjacency of each type of edge, as rows in the same way as above
+        self.containerOffsets = array('i', [0]) * (len(self.nodes) + 1)
+        self.containers = array('i')
+        self.successorOffsets = array('i', [0]) * (len(self.nodes) + 1)
+        self.successors = array('i')
+        for i in range(len(self.nodes)):
+            node = self.nodes[i]
+            for edge in node.incidentEdges:
+                j = self.position.get(edge.otherEndFrom(node))
+                if j == None:
+                    continue
+                edgeType = edge.returnType()
+                if edgeType == Edge.CONTAINS and edge.returnContainer() is not node:
+                    self.containers.append(j)
+                elif edgeType == Edge.SEQUENCE and edge.leadsTo(self.nodes[j]):
+                    self.successors.append(j)
+            self.containerOffsets[i + 1] = len(self.containers)
+            self.successorOffsets[i + 1] = len(self.successors)
+        
+        self.buildHierarchy()
+        
+        ## The working space of the searches: a node has been found by the current search if seen[i] == stamp
+        ## (so nothing needs to be cleared between searches), queue holds the positions in the order they were found,
+        ## and depth the number of hops from the start of the search
+        self.seen = array('i', [0]) * len(self.nodes)
+        self.stamp = 0
+        self.queue = array('i', [0]) * len(self.nodes)
+        self.depth = array('i', [0]) * len(self.nodes)
+        self.found = 0      ## The length of the queue after the last search
+        
+        print "(GraphIndex.__init__) indexed", len(self.nodes), "nodes and", len(self.neighbours) / 2, "edges"
+        
+    def contains(self, theNode):
+        '''Returns True if theNode is in the index'''
+        
+        return theNode in self.position
+    
+    def buildHierarchy(self):
+        '''Works out the container and location of every node, in one breadth first pass over the typed edges:
+        
+        A node directly contained by a unit (e.g. a UTNode with an edge from a PUNode) is at location 0 of that unit
+        (the first of its containers, in the order of its incidentEdges, if it has more than one);
+        a node that a SEQUENCE edge leads to from a node at location n is at location n+1 of the same container,
+        unless it was already reached at a smaller location. 
+        Nodes that cannot be reached this way have no container (self.parent[i] == -1)'''
+        
+        self.parent = array('i', [-1]) * len(self.nodes)
+        self.location = array('i', [0]) * len(self.nodes)
+        queue = array('i')
+        
+        for i in range(len(self.nodes)):
+            if self.containerOffsets[i] < self.containerOffsets[i + 1]:
+                self.parent[i] = self.containers[self.containerOffsets[i]]
+                queue.append(i)
+        
+        head = 0
+        while head < len(queue):
+            i = queue[head]
+            head += 1
+            for k in range(self.successorOffsets[i], self.successorOffsets[i + 1]):
+                j = self.successors[k]
+                if self.parent[j] < 0:
+                    self.parent[j] = self.parent[i]
+                    self.location[j] = self.location[i] + 1
+                    queue.append(j)
+    
+    def returnParent(self, theNode):
+        '''Returns the node that contains theNode (its PUNode, UTNode or MNode), or None (see buildHierarchy)'''
+        
+        i = self.parent[self.position[theNode]]
+        if i < 0:
+            return None
+        return self.nodes[i]
+    
+    def returnLocation(self, theNode):
+        '''Returns the location of theNode in its container's sequence (0 for the first), or None if it has no container'''
+        
+        i = self.position[theNode]
+        if self.parent[i] < 0:
+            return None
+        return self.location[i]
+        
+    def search(self, theNode, theNodeType=None):
+        '''Runs a breadth first search from theNode, finding nodes in the same order as getEveryConnectedNode()
+        Stops when it finds a node whose nodeType is theNodeType (searches every connected node if theNodeType is None)
+        Returns the position of the node of theNodeType, or -1 if none was found
+        
+        Afterwards, self.queue[1:self.found] are the positions of the nodes found, and self.depth[i] their hops from theNode
+        
+        theNode should be a Node in the index'''
+        
+        self.stamp += 1
+        stamp = self.stamp
+        seen = self.seen
+        queue = self.queue
+        depth = self.depth
+        offsets = self.offsets
+        neighbours = self.neighbours
+        nodeTypes = self.nodeTypes
+        
+        start = self.position[theNode]
+        seen[start] = stamp
+        depth[start] = 0
+        queue[0] = start
+        head = 0
+        tail = 1
+        
+        while head < tail:
+            i = queue[head]
+            head += 1
+            hops = depth[i] + 1
+            k = offsets[i]
+            end = offsets[i + 1]
+            while k < end:
+                j = neighbours[k]
+                k += 1
+                if seen[j] != stamp:
+                    seen[j] = stamp
+                    depth[j] = hops
+                    queue[tail] = j
+                    tail += 1
+                    if nodeTypes[j] == theNodeType:
+                        self.found = tail
+                        PerformanceMonitor.monitor.count("node_visits", tail)
+                        return j
+        
+        self.found = tail
+        PerformanceMonitor.monitor.count("node_visits", tail)
+        return -1
+    
+    def returnNeighbourNodes(self, theNode):
+        '''Returns a list of the nodes theNode is connected to (see Node.returnNeighbourNodes)'''
+        
+        i = self.position[theNode]
+        return [self.nodes[j] for j in self.neighbours[self.offsets[i]:self.offsets[i + 1]]]
+    
+    def returnConnectedNodes(self, theNode):
+        '''Returns a list of every node theNode is (indirectly) connected to (see Node.getEveryConnectedNode)'''
+        
+        key = ("connected", self.position[theNode])
+        if self.cache != None:
+            connected = self.cache.lookup(key)
+            if connected is not QueryCache.MISSING:
+                return list(connected)
+        
+        self.search(theNode)
+        connected = [self.nodes[j] for j in self.queue[1:self.found]]
+        
+        if self.cache != None:
+            self.cache.store(key, connected, self.found)
+            return list(connected)      ## So that changing the returned list does not change the cached one
+        return connected
+    
+    def searchNodeType(self, theNode, theNodeType):
+        '''Returns (the position of the closest node to theNode of theNodeType, its hops from theNode), or (-1, None)
+        Both closest node and hops queries are answered by the same cached search'''
+        
+        key = ("nodeType", self.position[theNode], theNodeType)
+        if self.cache != None:
+            answer = self.cache.lookup(key)
+            if answer is not QueryCache.MISSING:
+                return answer
+        
+        j = self.search(theNode, theNodeType)
+        answer = (j, None)
+        if j >= 0:
+            answer = (j, self.depth[j])
+        
+        if self.cache != None:
+            self.cache.store(key, answer, self.found)
+        return answer
+    
+    def returnClosestNodeOfType(self, theNode, theNodeType):
+        '''Returns the closest node to theNode whose nodeType is theNodeType, or None (see Node.getClosestNodeType)'''
+        
+        j, hops = self.searchNodeType(theNode, theNodeType)
+        if j < 0:
+            return None
+        return self.nodes[j]
+    
+    def returnHopsToNodeType(self, theNode, theNodeType):
+        '''Returns the number of hops from theNode to the closest node of theNodeType, or None (see Node.getHopsToNodeType)'''
+        
+        j, hops = self.searchNodeType(theNode, theNodeType)
+        return hops
+    
+    
 class Graph(io.Serializable):
     '''Defines the collection of Nodes, Edges, the SGOMS_Model and their behaviour'''
     
+    ## The rank of each type of node in the SGOMS hierarchy (used by returnSubtreeNodes)
+    HIERARCHY_RANK = {"PUNode": 1, "UTNode": 2, "MNode": 3, "ONode": 4}
+    
     def __init__(self, theLabel = "Graph", theNodes = None, theSGOMS_Model = None):
         '''Initializes the Graph, with a set of nodes and edges, as well as an SGOMS_Model
         
@@ -2460,6 +4046,18 @@ class Graph(io.Serializable):
         ## Store a filename for the save function (so don't have to select location each time)
         ## Set by the loadFrom function and saveAs function
         self.saveFile = None
+        
+        ## The ValidationIssues found in the model by the last validate() (not saved; see save)
+        self.issues = []
+        
+        ## The GraphIndex of the nodes and edges (not saved), and a counter of the changes to them (see returnIndex)
+        self.graphIndex = None
+        self.topologyVersion = 0
+        self.queryCache = None      ## The QueryCache of the index's answers (not saved; see returnQueryCache)
+        self.componentIndex = None  ## The ComponentIndex of the connected nodes (not saved; see returnComponentIndex)
+        self.hiddenNodes = None     ## The nodes hidden by collapsed units, their counts, and the index they were found with (not saved)
+        for node in self.nodes:
+            node.graph = self
              
     
     def __str__(self):
@@ -2471,14 +4069,164 @@ class Graph(io.Serializable):
         '''Returns all Edges contained in self.nodes'''
         
         returnList = []
+        found = {}      ## Each edge is in the incidentEdges of both of its nodes, so keep track of those found
         
         for node in self.nodes:
             for edge in node.incidentEdges:
-                if edge not in returnList:
+                if edge not in found:
+                    found[edge] = True
                     returnList.append(edge)
                     
         return returnList
     
+    def invalidateIndex(self):
+        '''Records a change to the nodes or edges of the graph, so the GraphIndex is rebuilt the next time it is needed'''
+        
+        self.topologyVersion = getattr(self, "topologyVersion", 0) + 1
+        
+    def returnIndex(self):
+        '''Returns the GraphIndex of the graph, rebuilding it if the nodes or edges have changed since it was built
+        
+        Adding or deleting nodes and edges through the Graph (or Node.addIncidentEdge) calls invalidateIndex();
+        call it after changing self.nodes or the incidentEdges directly'''
+        
+        index = getattr(self, "graphIndex", None)
+        version = getattr(self, "topologyVersion", 0)
+        
+        if index == None or index.version != version or len(index.nodes) != len(self.nodes):
+            for node in self.nodes:     ## Nodes loaded from older files do not know their graph
+                node.graph = self
+            self.graphIndex = GraphIndex(self.nodes, version, self.returnQueryCache())
+        
+        return self.graphIndex
+    
+    def returnComponentIndex(self):
+        '''Returns the ComponentIndex of the graph, rebuilding it if an edge or node has been deleted since it was built
+        (or if self.nodes has been changed directly)'''
+        
+        components = getattr(self, "componentIndex", None)
+        
+        if components == None or components.stale or len(components) != len(self.nodes):
+            for node in self.nodes:     ## Nodes loaded from older files do not know their graph
+                node.graph = self
+            self.componentIndex = ComponentIndex(self.nodes)
+            print "(Graph.returnComponentIndex) found", self.componentIndex.returnComponentCount(), "components"
+        
+        return self.componentIndex
+    
+    def returnHiddenNodes(self):
+        '''Returns a dict of the nodes that are hidden in the canvas (each mapped to True), 
+        i.e. that are contained (directly or not) by a collapsed PUNode, UTNode or MNode (see GraphIndex.buildHierarchy)
+        
+        The dict is kept until the GraphIndex is rebuilt, or a node is collapsed or expanded (see toggleCollapsed)'''
+        
+        return self.returnHiddenNodesAndCounts()[0]
+    
+    def returnHiddenCounts(self):
+        '''Returns a dict mapping each collapsed node that is not itself hidden to the number of nodes it hides'''
+        
+        return self.returnHiddenNodesAndCounts()[1]
+    
+    def returnHiddenNodesAndCounts(self):
+        '''Returns the dicts of returnHiddenNodes() and returnHiddenCounts(), finding them again if the index has changed'''
+        
+        index = self.returnIndex()
+        hiddenNodes = getattr(self, "hiddenNodes", None)
+        if hiddenNodes != None and hiddenNodes[0] is index:
+            return hiddenNodes[1], hiddenNodes[2]
+        
+        hidden = {}
+        counts = {}
+        for i in range(len(index.nodes)):
+            ## Go up the containers of the node (at most three: its Method, UT and PU)
+            j = index.parent[i]
+            while j >= 0:
+                container = index.nodes[j]
+                if container.isCollapsed():
+                    hidden[index.nodes[i]] = True
+                    counts[container] = counts.get(container, 0) + 1
+                j = index.parent[j]
+        
+        for node in counts.keys():
+            if node in hidden:  ## Hidden by a collapsed unit containing it, so its count is not drawn
+                del counts[node]
+        
+        self.hiddenNodes = (index, hidden, counts)
+        return hidden, counts
+    
+    def isHidden(self, theNode):
+        '''Returns True if theNode is hidden in the canvas by a collapsed unit containing it'''
+        
+        return theNode in self.returnHiddenNodes()
+    
+    def toggleCollapsed(self, theNodes):
+        '''Collapses each of theNodes (PUNodes, UTNodes or MNodes) into a single glyph, or expands it again if it was collapsed
+        The nodes that become hidden are unselected, so that they are not moved or deleted along with the selection
+        
+        theNodes should be a list of Nodes'''
+        
+        for node in theNodes:
+            if isinstance(node, PUNode) or isinstance(node, UTNode) or isinstance(node, MNode):
+                node.collapsed = not node.isCollapsed()
+                print "(Graph.toggleCollapsed)", node.label, "collapsed =", node.collapsed
+            else:
+                print "XXX (Graph.toggleCollapsed) only Planning Units, Unit Tasks and Methods can be collapsed:", node.label, "XXX"
+        
+        self.hiddenNodes = None
+        for node in self.nodes:
+            if self.isHidden(node):
+                node.selected = False
+                
+    def expandAll(self):
+        '''Expands every collapsed node in the graph'''
+        
+        for node in self.nodes:
+            node.collapsed = False
+        self.hiddenNodes = None
+    
+    def joinComponents(self, theNode, theOtherNode):
+        '''Records a new edge between theNode and theOtherNode in the ComponentIndex (called by Node.addIncidentEdge)'''
+        
+        components = getattr(self, "componentIndex", None)
+        if components == None or components.stale:
+            return
+        
+        if components.contains(theNode) and components.contains(theOtherNode):
+            components.union(theNode, theOtherNode)
+        else:   ## One of the nodes is not in the graph yet, so leave the edge until the index is rebuilt
+            components.stale = True
+            
+    def splitComponents(self):
+        '''Records the deletion of an edge or a node, after which the ComponentIndex must be rebuilt'''
+        
+        components = getattr(self, "componentIndex", None)
+        if components != None:
+            components.stale = True
+    
+    def returnQueryCache(self):
+        '''Returns the QueryCache of the answers to the GraphIndex's queries, making it if needed'''
+        
+        if getattr(self, "queryCache", None) == None:      ## Not saved, and missing in graphs from older files
+            self.queryCache = QueryCache()
+        return self.queryCache
+    
+    def returnQueryStats(self):
+        '''Returns the counts of the QueryCache (see QueryCache.returnStats), 
+        e.g. graph.returnQueryStats()["hit_rate"] is the fraction of the node queries that did not search the graph'''
+        
+        return self.returnQueryCache().returnStats()
+    
+    def appendNode(self, theNode):
+        '''Adds theNode to self.nodes (without changing the SGOMS_Model)'''
+        
+        self.nodes.append(theNode)
+        theNode.graph = self
+        self.invalidateIndex()
+        
+        components = getattr(self, "componentIndex", None)
+        if components != None and not components.stale:
+            components.addNode(theNode)
+    
     def returnSelectedNodes(self):
         '''Returns a list of all currently selected nodes'''
         
@@ -2506,7 +4254,7 @@ class Graph(io.Serializable):
         aNode should be a Node
         '''
         
-        self.nodes.append(aNode)
+        self.appendNode(aNode)
         
         self.update()
         
@@ -2516,7 +4264,7 @@ class Graph(io.Serializable):
         
         node = Node(aLabel, aPoint)
         
-        self.nodes.append(node)
+        self.appendNode(node)
         
         self.update()
         
@@ -2527,7 +4275,7 @@ class Graph(io.Serializable):
         
         aPUNode should be a PUNode, with an instantiated planning unit'''
         
-        self.nodes.append(aPUNode)
+        self.appendNode(aPUNode)
         self.sGOMS.addPlanningUnit(aPUNode.planningUnit)
         
         self.update()
@@ -2546,19 +4294,22 @@ class Graph(io.Serializable):
         pU = PlanningUnit(aLabel)
         pUNode = PUNode(pU.ID, aPoint, None, pU)
         
-        self.nodes.append(pUNode)
+        self.appendNode(pUNode)
         self.sGOMS.addPlanningUnit(pU)
         
         self.update()
         
         print "(Graph.addPUNodeAdvanced)", pUNode
         
-    def addPUNodeAdvancedNew(self, aPlanningUnit, aPoint):
+    def addPUNodeAdvancedNew(self, aPlanningUnit, aPoint, updateGraph=True):
         '''Creates new PUNode, with aPlanningUnit and aPoint as the PlanningUnit and point of the PUNode
+        Returns the new PUNode
         
         The aPlanningUnit will be added to SGOMS_Model, it should be a PlanningUnit
         The PUNode will be added to self.nodes
         aPoint should be a point
+        updateGraph specifies whether to call self.update() afterwards 
+            (False when adding many nodes at once, the caller should then call self.update() once at the end)
         '''
         
         self.sGOMS.addPlanningUnit(aPlanningUnit)   ## Adds the new Planning Unit to the list of PlanningUnits in SGOMS
@@ -2567,11 +4318,13 @@ class Graph(io.Serializable):
         ## (self, aLabel = "PUNode", aLocation = None, theIncidentEdges = None, thePU = None):
         pUNode = PUNode(aPlanningUnit.ID, aPoint, None, aPlanningUnit)
         
-        self.nodes.append(pUNode)
+        self.appendNode(pUNode)
         
-        self.update()
+        if updateGraph == True:
+            self.update()
         
         print "(Graph.addPUNodeAdvancedNew)", pUNode
+        return pUNode
         
         
     def addUTNode(self, aUTNode):
@@ -2581,7 +4334,7 @@ class Graph(io.Serializable):
         
         aUTNode should be a UTNode, with an instantiated relation'''
         
-        self.nodes.append(aUTNode)
+        self.appendNode(aUTNode)
         self.sGOMS.pUxUTRelationList.append(aUTNode.pUxUTRelation)
         self.sGOMS.addUnitTask(aUTNode.pUxUTRelation.unitTask)
         
@@ -2607,48 +4360,53 @@ class Graph(io.Serializable):
         ## Add the new node
         uTNode = UTNode(aLabel, aPoint, None, relation)
         
-        self.nodes.append(uTNode)
+        self.appendNode(uTNode)
         
         self.update()
         
         print "(Graph.addUTNodeAdvanced)", uTNode
     
-    def addUTNodeAdvancedNew(self, aUnitTask, aPoint):
+    def addUTNodeAdvancedNew(self, aUnitTask, aPoint, updateGraph=True):
         '''Creates new UTNode,
         Creates a new PUxUTRelation and adds it to SGOMS, aUnitTask is fed to the PUxUTRelation
         aUnitTask is added to SGOMS
         The PUxUTRelation is fed to the UTNode, the UTNode is added to self.nodes
+        Returns the new UTNode
         
         aUnitTask should be a UnitTask
         aPoint should be a Point
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)
         '''
         
         ## Add a new PUxUTRelation to the SGOMS_Model
         relation = self.sGOMS.addPUxUTRelationReturnSelf(aUnitTask)  ##This returns the new relation and stores it in the variable
         
         ## Adds the new UT to the list of Unit Tasks
-        ## As of v1.0, duplicate Unit Tasks are allowed in SGOMS_Model,
-        ## Future versions may wish to exclude duplicates
+        ## (a Unit Task shared with another node, i.e. a slave node, is counted rather than listed again)
         self.sGOMS.addUnitTask(relation.unitTask)   
         
         ## Add the new node
         uTNode = UTNode(aUnitTask.ID, aPoint, None, relation)
         
-        self.nodes.append(uTNode)
+        self.appendNode(uTNode)
         
-        self.update()
+        if updateGraph == True:
+            self.update()
         
         print "(Graph.addUTNodeAdvancedNew)", uTNode
+        return uTNode
         
-    def addMNodeAdvancedNew(self, aMethod, aPoint):
+    def addMNodeAdvancedNew(self, aMethod, aPoint, updateGraph=True):
         '''Creates new MNode,
         Creates a new UTxMRelation and adds it to SGOMS, aMethod is fed to the UTxMRelation
         aMethod is added to SGOMS
         The newly created UTxMRelation is fed to the MNode
         The MNode is added to self.nodes
+        Returns the new MNode
         
         aMethod should be a Method
         aPoint should be a Point
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)
         '''
         
         relation = self.sGOMS.addUTxMRelationReturnSelf(aMethod)  ##This returns the new relation and stores it
@@ -2658,21 +4416,25 @@ class Graph(io.Serializable):
         ## Add the new node
         mNode = MNode(aMethod.ID, aPoint, None, relation)
         
-        self.nodes.append(mNode)
+        self.appendNode(mNode)
         
-        self.update()
+        if updateGraph == True:
+            self.update()
         
         print "(Graph.addMNodeAdvancedNew)", mNode
+        return mNode
     
-    def addONodeAdvancedNew(self, anOperator, aPoint):
+    def addONodeAdvancedNew(self, anOperator, aPoint, updateGraph=True):
         '''Creates new ONode,
         Creates a new MxORelation and adds it to SGOMS, anOperator is fed to the MxORelation
         anOperator is added to SGOMS
         The newly created MxORelation is fed to the ONode
         The ONode is added to self.nodes
+        Returns the new ONode
         
         anOperator should be an Operator
         aPoint should be a Point
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)
         '''
         
         relation = self.sGOMS.addMxORelationReturnSelf(anOperator)  ##This returns the new relation and stores it
@@ -2682,39 +4444,52 @@ class Graph(io.Serializable):
         ## Add the new node
         oNode = ONode(anOperator.ID, aPoint, None, relation)
         
-        self.nodes.append(oNode)
+        self.appendNode(oNode)
         
-        self.update()
+        if updateGraph == True:
+            self.update()
         
         print "(Graph.addONodeAdvancedNew)", oNode
+        return oNode
     
-    def addEdge(self, startNode, endNode):
+    def addEdge(self, startNode, endNode, updateGraph=True, theDirected=False):
         '''Adds an edge to the Nodes' incident edges
+        Returns the new Edge
         
         startNode should be a Node
-        endNode should be a Node'''
+        endNode should be a Node
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)
+        theDirected should be True for an edge from startNode to endNode (see Edge.isSequence)'''
         
         print "(Graph.addEdge)"
         
-        anEdge = Edge(startNode, endNode)
+        anEdge = Edge(startNode, endNode, None, theDirected)
         
         startNode.addIncidentEdge(anEdge)
         endNode.addIncidentEdge(anEdge)
+        self.invalidateIndex()
         
-        self.update()
+        if updateGraph == True:
+            self.update()
+        
+        return anEdge
         
             
-    def deleteEdge(self, theEdge):
+    def deleteEdge(self, theEdge, updateGraph=True):
         '''Deletes the parameter edge from the nodes that contain it
         
-        theEdge should be an Edge'''
+        theEdge should be an Edge
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)'''
         
         theEdge.startNode.incidentEdges.remove(theEdge)
         theEdge.endNode.incidentEdges.remove(theEdge)
+        self.invalidateIndex()
+        self.splitComponents()
         
-        self.update()
+        if updateGraph == True:
+            self.update()
         
-    def deleteNode(self, theNode):
+    def deleteNode(self, theNode, updateGraph=True):
         '''Deletes the parameter node, and all of its incident edges
         
         If theNode is a PUNode, delete the PU from the SGOMS model
@@ -2722,43 +4497,247 @@ class Graph(io.Serializable):
         If theNode is an MNode, delete the relation from the SGOMS model, and the relation's Method
         If theNode is an ONode, delete the relation from the SGOMS model, and the relation's Operator
         
-        ^Future versions of code may wish to delete the UT, Method or Operator under only certain conditions,
-        such as if there is only one relation that points to the UT 
-        (don't want to accidently create null pointers if two relations point to the same UT, and one is deleted)'''
+        The PU, UT, Method or Operator is only deleted from the SGOMS model with the last node that refers to it
+        (slave nodes share their unit, see SGOMS_Model.releaseUnit)
+        
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)'''
+        
+        self.deleteNodes([theNode], updateGraph)
+        
+    def deleteNodes(self, theNodes, updateGraph=True):
+        '''Deletes every node in theNodes, and all of their incident edges (see deleteNode)
+        
+        The nodes, units and relations are removed from their lists in a single pass over each list,
+        so deleting many nodes at once takes linear rather than quadratic time
+        
+        theNodes should be a list of Nodes in self.nodes
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)'''
+        
+        planningUnits = []
+        unitTasks = []
+        pUxUTRelations = []
+        methods = []
+        uTxMRelations = []
+        operators = []
+        mxORelations = []
+        
+        ## Each node has its own relation, but the units are only removed once no node refers to them
+        for theNode in theNodes:
+            if isinstance(theNode, PUNode):
+                if self.sGOMS.releaseUnit(theNode.planningUnit):
+                    planningUnits.append(theNode.planningUnit)
+                
+            if isinstance(theNode, UTNode):
+                if self.sGOMS.releaseUnit(theNode.pUxUTRelation.unitTask):
+                    unitTasks.append(theNode.pUxUTRelation.unitTask)
+                pUxUTRelations.append(theNode.pUxUTRelation)
+                
+            if isinstance(theNode, MNode):
+                if self.sGOMS.releaseUnit(theNode.uTxMRelation.method):
+                    methods.append(theNode.uTxMRelation.method)
+                uTxMRelations.append(theNode.uTxMRelation)
+                
+            if isinstance(theNode, ONode):
+                if self.sGOMS.releaseUnit(theNode.mxORelation.operator):
+                    operators.append(theNode.mxORelation.operator)
+                mxORelations.append(theNode.mxORelation)
+            
+            ## Remove the edges from the other end (the edge might connect two deleted nodes, so check it's still there)
+            for edge in theNode.incidentEdges:
+                otherEnd = edge.otherEndFrom(theNode)
+                if edge in otherEnd.incidentEdges:
+                    otherEnd.incidentEdges.remove(edge)
+        
+        self.removeEach(self.sGOMS.planningUnitList, planningUnits)
+        self.removeEach(self.sGOMS.unitTaskList, unitTasks)
+        self.removeEach(self.sGOMS.pUxUTRelationList, pUxUTRelations)
+        self.removeEach(self.sGOMS.methodList, methods)
+        self.removeEach(self.sGOMS.uTxMRelationList, uTxMRelations)
+        self.removeEach(self.sGOMS.operatorList, operators)
+        self.removeEach(self.sGOMS.mxORelationList, mxORelations)
+        self.removeEach(self.nodes, theNodes)
+        for theNode in theNodes:
+            theNode.graph = None
+        self.invalidateIndex()
+        self.splitComponents()
+        
+        print "(Graph.deleteNodes) deleted", len(theNodes), "nodes"
+        
+        if updateGraph == True:
+            self.update()
+            
+    def removeEach(self, theList, theItems):
+        '''Removes one occurrence of each item in theItems from theList (like calling theList.remove() for each item)
+        The list is filtered in place in a single pass, and keeps its order
+        
+        theList should be a list
+        theItems should be a list of items contained in theList (an item may be in theItems more than once)'''
+        
+        if len(theItems) < 1:
+            return
+        
+        ## Count how many times each item should be removed (an item may be in theList more than once)
+        removeCounts = {}
+        for item in theItems:
+            removeCounts[item] = removeCounts.get(item, 0) + 1
+        
+        keepList = []
+        for item in theList:
+            if removeCounts.get(item, 0) > 0:
+                removeCounts[item] -= 1
+            else:
+                keepList.append(item)
+        
+        theList[:] = keepList
+        
+    def beginTransaction(self):
+        '''Returns a new GraphTransaction for making many changes to the graph at once
+        
+        Usage: transaction = graph.beginTransaction()
+               puNode = transaction.addSGOMSNode(PlanningUnit("pu"), Point(10, 10))
+               utNode = transaction.addSGOMSNode(UnitTask("ut"), Point(10, 60))
+               transaction.addEdge(puNode, utNode)
+               transaction.commit()     ## --> one self.update() for all of the changes'''
+        
+        return GraphTransaction(self)
+    
+    def addSGOMSNode(self, theSGOMSUnit, aPoint, updateGraph=True):
+        '''Adds a new node of the right kind for theSGOMSUnit (PUNode, UTNode, MNode or ONode)
+        Returns the new node
+        
+        theSGOMSUnit should be a PlanningUnit, UnitTask, Method, or Operator
+        aPoint should be a Point
+        updateGraph specifies whether to call self.update() afterwards (see addPUNodeAdvancedNew)'''
+        
+        if isinstance(theSGOMSUnit, PlanningUnit):
+            return self.addPUNodeAdvancedNew(theSGOMSUnit, aPoint, updateGraph)
+        
+        if isinstance(theSGOMSUnit, UnitTask):
+            return self.addUTNodeAdvancedNew(theSGOMSUnit, aPoint, updateGraph)
+        
+        if isinstance(theSGOMSUnit, Method):
+            return self.addMNodeAdvancedNew(theSGOMSUnit, aPoint, updateGraph)
+        
+        if isinstance(theSGOMSUnit, Operator):
+            return self.addONodeAdvancedNew(theSGOMSUnit, aPoint, updateGraph)
+        
+        print "XXX (Graph.addSGOMSNode) not an SGOMS unit:", theSGOMSUnit, "XXX"
+        return None
+    
+    def returnSGOMSUnit(self, theNode):
+        '''Returns the SGOMS unit that underlies theNode (i.e. a PlanningUnit, UnitTask, Method, or Operator)
+        Returns None if theNode is a plain Node
+        
+        theNode should be a Node'''
         
         if isinstance(theNode, PUNode):
-            #self.deletePUNode()
-            self.sGOMS.planningUnitList.remove(theNode.planningUnit)
-            
+            return theNode.planningUnit
         if isinstance(theNode, UTNode):
-            #self.deleteUTNode()
-            self.sGOMS.unitTaskList.remove(theNode.pUxUTRelation.unitTask)
-            self.sGOMS.pUxUTRelationList.remove(theNode.pUxUTRelation)
-            
+            return theNode.pUxUTRelation.unitTask
         if isinstance(theNode, MNode):
-            #self.deleteUTNode()
-            self.sGOMS.methodList.remove(theNode.uTxMRelation.method)
-            self.sGOMS.uTxMRelationList.remove(theNode.uTxMRelation)
-            
+            return theNode.uTxMRelation.method
         if isinstance(theNode, ONode):
-            #self.deleteUTNode()
-            self.sGOMS.operatorList.remove(theNode.mxORelation.operator)
-            self.sGOMS.mxORelationList.remove(theNode.mxORelation)
+            return theNode.mxORelation.operator
+        return None
+    
+    def returnSubtreeNodes(self, theNode):
+        '''Returns theNode, followed by every node below it in the SGOMS hierarchy
         
-        for edge in theNode.incidentEdges:
-            edge.otherEndFrom(theNode).incidentEdges.remove(edge)
-        self.nodes.remove(theNode)
+        The nodes below theNode are the connected nodes that can be reached from theNode 
+        without passing through a node of the same or higher rank than theNode 
+        (PUNode > UTNode > MNode > ONode)
+        E.g. the subtree of a UTNode is the UTNode, its MNodes, and their ONodes (but not the next UTNode in the chain)
         
-        self.update()
+        theNode should be a Node'''
         
-    def nodeAt(self, p):
-        '''Return the first node in which point p is contained, if none, return None
+        rootRank = Graph.HIERARCHY_RANK.get(theNode.nodeType, 0)
+        
+        returnList = [theNode]
+        found = {theNode: True}     ## Keep track of the nodes found so far, so that nothing is found twice
+        
+        ## A breadth first search that only steps down the hierarchy
+        i = 0
+        while i < len(returnList):
+            for neighbour in returnList[i].returnNeighbourNodes():
+                if neighbour not in found and Graph.HIERARCHY_RANK.get(neighbour.nodeType, 0) > rootRank:
+                    found[neighbour] = True
+                    returnList.append(neighbour)
+            i += 1
+        
+        print "(Graph.returnSubtreeNodes) subtree of", theNode.label, "has", len(returnList), "nodes"
+        return returnList
+    
+    def pasteNodes(self, theNodes, thePoint, shareUnits=False):
+        '''Pastes copies of theNodes (and the edges between them) onto the graph in one GraphTransaction
+        Returns the list of new nodes
+        
+        The copies keep their positions relative to each other; the first node in theNodes is placed at thePoint
+        Edges are only copied if both of their ends are in theNodes
+        The graph is updated once, after everything has been pasted
+        
+        If shareUnits is False, each new node gets a new SGOMS unit made with cloneShared(), 
+            (the firing conditions and behaviours are shared copy-on-write, rather than deep copied)
+        If shareUnits is True, each new node points to the same SGOMS unit as the original (i.e. a slave node)
+        
+        theNodes should be a list of Nodes
+        thePoint should be a Point'''
+        
+        if len(theNodes) < 1:
+            print "(Graph.pasteNodes) there is nothing to paste"
+            return []
+        
+        ## The offset from the original location of the first node to the paste point
+        dx = thePoint.x - theNodes[0].location.x
+        dy = thePoint.y - theNodes[0].location.y
+        
+        transaction = self.beginTransaction()
+        copies = {}     ## Maps each original node to its (pending) copy
+        
+        for node in theNodes:
+            unit = self.returnSGOMSUnit(node)
+            if unit == None:    ## Plain Nodes have nothing to paste
+                continue
+            if shareUnits == False:
+                unit = unit.cloneShared()
+            
+            copies[node] = transaction.addSGOMSNode(unit, Point(node.location.x + dx, node.location.y + dy))
+            
+        ## Copy every edge that is between two copied nodes (each edge is found from both of its ends, so check for repeats)
+        copiedEdges = {}
+        for node in theNodes:
+            for edge in node.incidentEdges:
+                if edge not in copiedEdges and edge.startNode in copies and edge.endNode in copies:
+                    copiedEdges[edge] = True
+                    transaction.addEdge(copies[edge.startNode], copies[edge.endNode], edge.isDirected())
+        
+        ## Only the pasted nodes are selected afterwards, so that they can be dragged together
+        for node in self.nodes:
+            node.selected = False
+        
+        if transaction.commit() == False:
+            return []
+        
+        newNodes = []
+        for node in theNodes:
+            if node in copies:
+                copies[node].node.selected = True
+                newNodes.append(copies[node].node)
+        
+        print "(Graph.pasteNodes) pasted", len(newNodes), "nodes and", len(copiedEdges), "edges"
+        return newNodes
+        
+    def nodeAt(self, p):
+        '''Return the first node in which point p is contained, if none, return None
         Used primarily as a helper to handle mouseClick events 
         
         p should be a Point'''
 
+        hidden = self.returnHiddenNodes()
+        
         for node in self.nodes:
             #FDO print "(Graph.nodeAt) Node: ", node.label
+            if node in hidden:    ## Nodes hidden by a collapsed unit cannot be clicked on
+                continue
             c = node.location ##This returns a point
             
             ## Check to see what kind of node it is to determine whether the point is contained by the node
@@ -2810,9 +4789,12 @@ class Graph(io.Serializable):
         
         mX = 0
         mY = 0
+        hidden = self.returnHiddenNodes()
         
         for e in self.returnEdges():
             #FDO print "(Graph.edgeAt) edges ", e.label
+            if e.startNode in hidden or e.endNode in hidden:
+                continue
             mX = (e.startNode.location.x +
                   e.endNode.location.x) / 2
             
@@ -2834,107 +4816,2520 @@ class Graph(io.Serializable):
         
         calls update() on all nodes'''
         
-        print "***** (Graph.update) *****"
+        print "***** (Graph.update) *****"
+        startTime = PerformanceMonitor.monitor.start()
+        
+        for node in self.nodes:
+            node.updateOrder()
+        
+        for node in self.nodes:
+            node.updateEverythingButOrder()
+        
+        self.updateChains()
+        
+        ## The relations may have changed, so the model must be lowered again before it is next compiled
+        self.sGOMS.invalidateIR()
+        
+        self.validate()
+            
+        self.sGOMS.printModelContentsAdvanced()
+        
+        PerformanceMonitor.monitor.stop("Graph.update", startTime)
+        
+    def updateChains(self):
+        '''Builds the chain of PUxUTRelations of each Planning Unit in the SGOMS_Model, then sets their cues and cuelags
+        along each chain (see SGOMS_Model.updateChains)
+        
+        The UTNodes of each PUNode are those in its component (see returnComponentIndex) that are closest to it.
+        The unit tasks a UTNode follows are those at the other end of its sequence edges (see Edge.isSequence):
+        a directed edge ending at the UTNode, or an undirected edge from a UTNode one hop closer to the PU;
+        the UTNodes next to the PUNode also follow the start of the PU.
+        Only the UTNodes whose closest PUNode is the one being searched from are added to its chain.
+        Called by update(), after the orders and the relations' PUs and locations have been updated'''
+        
+        self.sGOMS.clearChains()
+        index = self.returnIndex()
+        
+        for pUNode in self.nodes:
+            if not isinstance(pUNode, PUNode):
+                continue
+            
+            ## The UTNodes of the PU, in the order of their locations (then in the order of the graph's nodes)
+            nodes = [(node.order, index.position[node], node) for node in pUNode.returnComponentNodes("UTNode")
+                     if node.returnParentNode() is pUNode]
+            nodes.sort()
+            
+            for order, position, node in nodes:
+                precedingRelations = []
+                if node.order == 1:
+                    precedingRelations.append(None)
+                for edge in node.incidentEdges:
+                    other = edge.otherEndFrom(node)
+                    if isinstance(other, UTNode) and edge.isSequence(other, node) \
+                            and other.returnParentNode() is pUNode:
+                        precedingRelations.append(other.pUxUTRelation)
+                
+                self.sGOMS.appendToChain(pUNode.planningUnit, node.pUxUTRelation, precedingRelations)
+        
+        self.sGOMS.updateChains()
+        
+    def validate(self):
+        '''Checks the model for problems that would make the exported ACT-R file fail (see ModelValidator)
+        Stores and returns the list of ValidationIssues found, which are drawn as markers on their nodes'''
+        
+        self.issues = ModelValidator().validate(self)
+        return self.issues
+    
+    def returnIssues(self, theSeverity=None):
+        '''Returns the ValidationIssues found by the last validate(), or only those of theSeverity if it is given'''
+        
+        ## Graphs loaded from files saved before validation existed have no issues until their first update
+        issues = getattr(self, "issues", [])
+        if theSeverity == None:
+            return issues
+        return [issue for issue in issues if issue.severity == theSeverity]
+        
+    def draw(self, aPen):
+        '''Draws the graph - i.e. tell all nodes and edges to draw themselves
+        
+        aPen should be a Graphics object
+        
+        The nodes hidden by a collapsed unit (see returnHiddenNodes) are not drawn, nor are their edges; 
+        the collapsed unit is drawn with the number of nodes it hides'''
+        
+        edges = self.returnEdges()
+        hidden, counts = self.returnHiddenNodesAndCounts()
+        
+        for edge in edges:  #Draw the edges first
+            if edge.startNode in hidden or edge.endNode in hidden:
+                continue
+            edge.draw(aPen)
+        
+        drawn = 0
+        for node in self.nodes: #Draw the nodes second
+            if node in hidden:
+                continue
+            node.draw(aPen)
+            if node in counts:
+                node.drawCollapsed(aPen, counts[node])
+            drawn += 1
+        PerformanceMonitor.monitor.count("nodes_drawn", drawn)
+            
+        for issue in self.returnIssues():   #Draw the validation markers last, on top of the nodes
+            issue.draw(aPen)
+            
+    def printGraph(self):
+        '''Prints the graph, including all of the nodes'''
+        
+        print "@@@@@ Graph.printGraph @@@@@"
+        print self.label, "(", len(self.nodes), ",", len(self.returnEdges()), ")"
+        for node in self.nodes:
+            print node
+            
+        print "@@@@@ Graph.printGraph Completed @@@@@"
+        
+    def save(self):
+        '''Saves the graph to self.saveFile'''
+        
+        ## This is taken from http://www.onlamp.com/pub/a/python/2002/04/11/jythontips.html?page=2
+        print "(Graph.save) Saving to self.saveFile:", self.saveFile
+        
+        if self.saveFile == None:
+            print "XXX (Graph.save) Save not completed - self.saveFile is None XXX"
+            return False
+        
+        else:
+            self.writeTo(self.saveFile)
+        
+        print "(Graph.save) Save complete"
+        return True
+        
+    def saveAs(self, theFileName):
+        '''Saves the graph to a selected file passed in by the Java save dialog box
+        Sets self.saveFile to be theFileName
+        
+        theFileName should be a string (a FileName)
+        '''
+        
+        ## Update the save location for the save function
+        self.saveFile = theFileName
+        print "(Graph.saveAs) theFileName = ", theFileName, " self.saveFile (after updating) =", self.saveFile
+        
+        ## This is taken from http://www.onlamp.com/pub/a/python/2002/04/11/jythontips.html?page=2
+        print "(Graph.saveAs) Saving to saveFile:", self.saveFile
+        
+        if self.saveFile == None:
+            print "XXX (Graph.saveAs) Save not completed - self.saveFile is None XXX"
+            return False
+        
+        else:
+            self.writeTo(self.saveFile)
+        
+        print "(Graph.saveAs) Save complete"
+        return True
+        
+    def writeTo(self, theFileName):
+        '''Writes the graph to theFileName (used by save and saveAs)
+        
+        The caches and indexes are not written; they are cleared first, and rebuilt when they are next needed.
+        The issues and the QueryCache (kept for its counts) are put back afterwards, even if the write fails'''
+        
+        ## This is taken from http://www.onlamp.com/pub/a/python/2002/04/11/jythontips.html?page=2
+        self.sGOMS.invalidateIR()   ## The cached IR is not saved; it is rebuilt when needed
+        self.sGOMS.unitStore = None   ## Nor is the unit store (the units keep their reference counts)
+        self.graphIndex = None   ## Nor is the index of the nodes and edges
+        queryCache = self.returnQueryCache()   ## Nor the answers to its queries (kept for their counts)
+        self.queryCache = None
+        self.componentIndex = None   ## Nor the connected components
+        self.hiddenNodes = None   ## Nor the nodes hidden by collapsed units (the collapsed flags are saved)
+        issues = self.returnIssues()   ## Neither are the issues, which are found again by the next update
+        self.issues = []
+        try:
+            outFile = io.FileOutputStream(theFileName)
+            try:
+                outStream = io.ObjectOutputStream(outFile)
+                outStream.writeObject(self)
+            finally:
+                outFile.close()
+        finally:
+            self.issues = issues
+            self.queryCache = queryCache
+        
+    def loadFrom(self, theFileName):
+        '''Loads a graph from a selected file
+        sets self.saveFile to be theFileName
+        
+        theFileName should be a string (a FileName)'''
+        
+        self.saveFile = theFileName
+        
+        print "(Graph.loadFrom) saveFile set; Loading from file:", self.saveFile
+        
+        ## This is taken from http://www.onlamp.com/pub/a/python/2002/04/11/jythontips.html?page=2
+        inFile = io.FileInputStream(self.saveFile)
+        inStream = util.PythonObjectInputStream(inFile) ## Note Python Utilities use; different from standard Java IO
+        
+        newGraph = inStream.readObject()
+        print "(Graph.loadFrom) Printing graph"
+        newGraph.printGraph()
+        
+        print "(Graph.loadFrom) Returning new graph"
+        return newGraph
+        
+        
+class PendingNode:
+    '''A placeholder for a node that has been queued in a GraphTransaction, but not yet added to the Graph
+    
+    PendingNodes can be passed to GraphTransaction.addEdge() in place of Nodes
+    Once the transaction is committed, self.node is the new Node'''
+    
+    def __init__(self, theSGOMSUnit, aPoint):
+        '''Initializes the PendingNode
+        
+        theSGOMSUnit should be a PlanningUnit, UnitTask, Method, or Operator
+        aPoint should be a Point'''
+        
+        self.sGOMSUnit = theSGOMSUnit
+        self.location = aPoint
+        self.node = None    ## Set by GraphTransaction.commit()
+        
+    def __str__(self):
+        '''Returns a string representation of the PendingNode'''
+        
+        return "PendingNode: " + str(self.sGOMSUnit)
+        
+class GraphTransaction:
+    '''Queues changes to a Graph (adding/deleting nodes and edges), 
+    so that they can be validated together and applied with a single Graph.update()
+    
+    Created by Graph.beginTransaction()
+    Nothing happens to the Graph until commit() is called; if any queued change is invalid, nothing is applied'''
+    
+    def __init__(self, theGraph):
+        '''Initializes the GraphTransaction
+        
+        theGraph should be the Graph to be changed'''
+        
+        self.graph = theGraph
+        self.pendingNodes = []      ## PendingNodes to be added, in order
+        self.newEdges = []          ## (startNode, endNode, directed) tuples to be added; either end may be a PendingNode
+        self.deletedEdges = []      ## Edges to be deleted
+        self.deletedNodes = []      ## Nodes to be deleted
+        self.committed = False
+        
+    def addSGOMSNode(self, theSGOMSUnit, aPoint):
+        '''Queues a new node for theSGOMSUnit at aPoint (see Graph.addSGOMSNode)
+        Returns a PendingNode, which can be used in addEdge() before the transaction is committed'''
+        
+        pendingNode = PendingNode(theSGOMSUnit, aPoint)
+        self.pendingNodes.append(pendingNode)
+        return pendingNode
+    
+    def addEdge(self, startNode, endNode, theDirected=False):
+        '''Queues a new edge between startNode and endNode
+        
+        startNode and endNode should be Nodes in the Graph, or PendingNodes from this transaction
+        theDirected should be True for an edge from startNode to endNode (see Edge.isSequence)'''
+        
+        self.newEdges.append((startNode, endNode, theDirected))
+        
+    def deleteEdge(self, theEdge):
+        '''Queues theEdge to be deleted
+        
+        theEdge should be an Edge in the Graph'''
+        
+        self.deletedEdges.append(theEdge)
+        
+    def deleteNode(self, theNode):
+        '''Queues theNode (and its incident edges) to be deleted
+        
+        theNode should be a Node in the Graph'''
+        
+        self.deletedNodes.append(theNode)
+        
+    def validate(self):
+        '''Checks all of the queued changes together
+        Returns a list of strings describing each problem found (an empty list if the transaction can be committed)'''
+        
+        problems = []
+        
+        if self.committed == True:
+            problems.append("the transaction has already been committed")
+        
+        graphNodes = {}
+        for node in self.graph.nodes:
+            graphNodes[node] = True
+            
+        ## Nodes to be deleted must be in the graph, and should only be deleted once
+        deleted = {}
+        for node in self.deletedNodes:
+            if node not in graphNodes:
+                problems.append("cannot delete " + str(node) + ", it is not in the graph")
+            elif node in deleted:
+                problems.append(str(node) + " is deleted more than once")
+            deleted[node] = True
+            
+        ## Edges to be deleted must be in the graph, and should only be deleted once
+        deletedEdges = {}
+        for edge in self.deletedEdges:
+            if edge.startNode not in graphNodes or edge not in edge.startNode.incidentEdges:
+                problems.append("cannot delete edge " + str(edge) + ", it is not in the graph")
+            elif edge in deletedEdges:
+                problems.append("edge " + str(edge) + " is deleted more than once")
+            deletedEdges[edge] = True
+            
+        ## New nodes must be SGOMS units
+        pending = {}
+        for pendingNode in self.pendingNodes:
+            pending[pendingNode] = True
+            if not isinstance(pendingNode.sGOMSUnit, (PlanningUnit, UnitTask, Method, Operator)):
+                problems.append("cannot add " + str(pendingNode) + ", it is not an SGOMS unit")
+        
+        ## New edges must connect two different nodes that will exist once the changes are made
+        for (startNode, endNode, directed) in self.newEdges:
+            for end in (startNode, endNode):
+                if end in deleted:
+                    problems.append("cannot connect " + str(end) + ", it is being deleted")
+                elif end not in graphNodes and end not in pending:
+                    problems.append("cannot connect " + str(end) + ", it is not in the graph or this transaction")
+            if startNode == endNode:
+                problems.append("cannot connect " + str(startNode) + " to itself")
+        
+        for problem in problems:
+            print "XXX (GraphTransaction.validate)", problem, "XXX"
+        return problems
+    
+    def commit(self, theView=None):
+        '''Validates and applies every queued change, then updates the graph once
+        Returns True if the changes were applied, False if validation failed (in which case nothing is changed)
+        
+        theView is optional; if given, its update() method is called once at the end 
+            (e.g. a GraphEditorPanel, to repaint the changes)'''
+        
+        if len(self.validate()) > 0:
+            return False
+        
+        ## Deleted edges go first, so that deleteNodes() does not see them
+        for edge in self.deletedEdges:
+            self.graph.deleteEdge(edge, False)
+            
+        self.graph.deleteNodes(self.deletedNodes, False)
+        
+        for pendingNode in self.pendingNodes:
+            pendingNode.node = self.graph.addSGOMSNode(pendingNode.sGOMSUnit, pendingNode.location, False)
+            
+        for (startNode, endNode, directed) in self.newEdges:
+            if isinstance(startNode, PendingNode):
+                startNode = startNode.node
+            if isinstance(endNode, PendingNode):
+                endNode = endNode.node
+            self.graph.addEdge(startNode, endNode, False, directed)
+            
+        self.committed = True
+        
+        print "(GraphTransaction.commit)", len(self.pendingNodes), "nodes added,", len(self.newEdges), "edges added,", \
+            len(self.deletedNodes), "nodes deleted,", len(self.deletedEdges), "edges deleted"
+        
+        self.graph.update()     ## The single update for every change
+        
+        if theView != None:
+            theView.update()
+            
+        return True
+        
+#####
+## Checking models before export
+#####
+
+class ValidationIssue:
+    '''A problem found in a model by a ModelValidator, which would make the exported ACT-R file fail or misbehave'''
+    
+    ERROR = "error"         ## The exported model will not run, or will not run as intended
+    WARNING = "warning"     ## The exported model will run, but probably not as intended
+    
+    def __init__(self, theSeverity, theMessage, theNode=None):
+        '''Initializes the ValidationIssue
+        
+        theSeverity should be ValidationIssue.ERROR or ValidationIssue.WARNING
+        theMessage should be a string describing the problem
+        theNode should be the Node the problem was found at (or None if it is not at a particular node)'''
+        
+        self.severity = theSeverity
+        self.message = theMessage
+        self.node = theNode
+        
+    def __str__(self):
+        '''Returns the ValidationIssue as "severity (node): message"'''
+        
+        if self.node == None:
+            return self.severity + ": " + self.message
+        return self.severity + " (" + self.node.label + "): " + self.message
+    
+    def draw(self, aPen):
+        '''Draws a marker at the top left of the node (red for errors, orange for warnings)
+        
+        aPen should be a Graphics object'''
+        
+        if self.node == None:
+            return
+        
+        if self.severity == ValidationIssue.ERROR:
+            aPen.setColor(Color.red)
+        else:
+            aPen.setColor(Color.orange)
+        aPen.fillOval(self.node.location.x - 30, self.node.location.y - 30, 12, 12)
+        aPen.setColor(Color.white)
+        aPen.drawString("!", self.node.location.x - 26, self.node.location.y - 20)
+
+
+class ModelValidator:
+    '''Checks a Graph's model for the problems that otherwise only show up when the exported ACT-R file is run:
+        duplicate production names (different units with the same ID; shared units and identical copies are fine)
+        IDs that are not valid Python identifiers, or that clash with the global productions
+        Unit Tasks that are not connected to a Planning Unit (their DM chunk has an empty planning_unit)
+        Planning Units without a final 'finished' Unit Task (needed by the last_unit_task production)
+        Methods and Operators that are not connected to a Unit Task or Method
+        buffers that are used but are not in the model's bufferList (they are declared automatically on export)
+    
+    validate() makes a single pass over the nodes, indexing units by name and unit tasks by planning unit as it goes,
+    so it is cheap enough to be run by every Graph.update()
+    (The whole graph is checked each time, since most of the checks depend on more than the nodes that were changed:
+    a renamed unit can clash with, or stop clashing with, any other unit, and an edge can move a Planning Unit's last 
+    Unit Task; the pass costs about as much as the Graph.update() that calls it)
+    Checking an ID is memoized across validators, since the IDs rarely change between edits
+    (in a QueryCache of the ModelValidator.CAPACITY most recently checked IDs, so renaming does not grow it without bound)'''
+    
+    CAPACITY = 4096     ## The number of IDs whose problems are kept
+    
+    ## ID -> problem with the ID (or None), shared by every ModelValidator
+    identifierCache = QueryCache(CAPACITY)
+    
+    ## Names that are used by the exported file itself
+    RESERVED_NAMES = ["init"] + [production[0] for production in SGOMS_IR.GLOBAL_PRODUCTIONS]
+    
+    def validate(self, theGraph):
+        '''Returns a list of the ValidationIssues found in theGraph (an empty list if there are none)'''
+        
+        issues = []
+        
+        ## The buffers in the model's bufferList, and the one used by DM
+        declaredBuffers = {theGraph.sGOMS.returnMemoryBuffer(): True}
+        for buffer in theGraph.sGOMS.bufferList:
+            declaredBuffers[buffer] = True
+        scanner = BufferScanner()
+        
+        ## The global productions and the initial behaviour are not at a node
+        globalBuffers = scanner.returnBuffers([], theGraph.sGOMS.initialBehaviour)
+        for name, firingConditions, behaviours in SGOMS_IR.GLOBAL_PRODUCTIONS:
+            globalBuffers += scanner.returnBuffers(firingConditions, behaviours)
+        for buffer in globalBuffers:
+            if not declaredBuffers.has_key(buffer):
+                declaredBuffers[buffer] = True  ## Only report it once
+                issues.append(ValidationIssue(ValidationIssue.WARNING, "the buffer " + buffer + 
+                    " is used by the global productions or initial behaviour, but is not in the model's buffer list"))
+        
+        unitsByName = {}        ## ID -> the first unit found with that ID
+        unitTasksByPU = {}      ## PlanningUnit -> PUxUTRelations of its Unit Tasks
+        planningUnitNodes = []
+        
+        for node in theGraph.nodes:
+            unit = theGraph.returnSGOMSUnit(node)
+            
+            ## Plain Nodes (from the legacy Graph.addNode methods) have no unit, and are left out of the ACT-R file
+            if unit == None:
+                issues.append(ValidationIssue(ValidationIssue.WARNING, 
+                    "is not a Planning Unit, Unit Task, Method or Operator, so it is not in the ACT-R file", node))
+                continue
+            
+            ## Names
+            problem = self.checkIdentifier(unit.ID)
+            if problem != None:
+                issues.append(ValidationIssue(ValidationIssue.ERROR, problem, node))
+            
+            if not unitsByName.has_key(unit.ID):
+                unitsByName[unit.ID] = unit
+            else:
+                first = unitsByName[unit.ID]
+                if first is not unit and (first.firingConditions != unit.firingConditions or first.behaviour != unit.behaviour):
+                    issues.append(ValidationIssue(ValidationIssue.ERROR, "another unit is also named '" + unit.ID + 
+                        "' but has different firing conditions or behaviour; only one will be kept in the ACT-R file", node))
+            
+            for buffer in scanner.returnBuffers(unit.firingConditions, unit.behaviour):
+                if not declaredBuffers.has_key(buffer):
+                    issues.append(ValidationIssue(ValidationIssue.WARNING, "uses the buffer " + buffer + 
+                        ", which is not in the model's buffer list", node))
+            
+            ## Connections
+            if isinstance(node, PUNode):
+                planningUnitNodes.append(node)
+                
+            elif isinstance(node, UTNode):
+                relation = node.pUxUTRelation
+                if relation.planning_unit_DM == '':
+                    issues.append(ValidationIssue(ValidationIssue.WARNING, 
+                        "not connected to a Planning Unit; its DM chunk will have an empty planning_unit", node))
+                else:
+                    unitTasksByPU.setdefault(relation.planningUnit, []).append(relation)
+                    
+            elif isinstance(node, MNode) and node.uTxMRelation.unitTask == None:
+                issues.append(ValidationIssue(ValidationIssue.WARNING, "not connected to a Unit Task", node))
+                
+            elif isinstance(node, ONode) and node.mxORelation.method == None:
+                issues.append(ValidationIssue(ValidationIssue.WARNING, "not connected to a Method", node))
+        
+        ## Each Planning Unit must end with a 'finished' Unit Task
+        for node in planningUnitNodes:
+            relations = unitTasksByPU.get(node.planningUnit, [])
+            if len(relations) == 0:
+                issues.append(ValidationIssue(ValidationIssue.WARNING, "has no Unit Tasks", node))
+                continue
+            
+            last = max([relation.location for relation in relations])
+            finished = [relation.location for relation in relations if relation.unit_task_DM == "finished"]
+            if len(finished) == 0:
+                issues.append(ValidationIssue(ValidationIssue.ERROR, 
+                    "has no 'finished' Unit Task, so the last_unit_task production will never fire", node))
+            elif last not in finished:
+                issues.append(ValidationIssue(ValidationIssue.WARNING, 
+                    "has Unit Tasks after its 'finished' Unit Task, which will never be reached", node))
+        
+        if len(issues) > 0:
+            print "(ModelValidator.validate) found", len(issues), "issues:"
+            for issue in issues:
+                print "XXX", issue, "XXX"
+        
+        return issues
+        
+    def checkIdentifier(self, theID):
+        '''Returns a string describing why theID cannot be used as a production name, or None if it can'''
+        
+        problem = ModelValidator.identifierCache.lookup(theID)
+        if problem is not QueryCache.MISSING:
+            return problem
+        
+        problem = None
+        if re.match("^[A-Za-z_][A-Za-z0-9_]*$", theID) == None:
+            problem = "'" + theID + "' is not a valid Python identifier (use letters, digits, and _ only)"
+        elif keyword.iskeyword(theID):
+            problem = "'" + theID + "' is a Python keyword"
+        elif theID in ModelValidator.RESERVED_NAMES:
+            problem = "'" + theID + "' is the name of a production that every exported model has"
+            
+        ModelValidator.identifierCache.store(theID, problem)
+        return problem
+        
+#####
+## Building models without the GUI
+#####
+
+class SGOMSModelBuilder:
+    '''Builds a Graph (and its SGOMS_Model) from Python code, or from the SGOMS text format, without the GUI
+    
+    Everything is queued in a single GraphTransaction, so the hierarchy is only computed once, when build() is called.
+    Nodes are laid out automatically: one column per Planning Unit, 
+    with its Unit Tasks below it and Methods/Operators indented to the right.
+    
+    Python usage:
+        builder = SGOMSModelBuilder()
+        pu = builder.planningUnit("prep_wrap", ["b_context='order:wrap'"], ["b_plan_unit.set('...')"])
+        veggies = builder.unitTask(pu, "veggies")
+        builder.unitTask(pu, "finished")
+        builder.operator(builder.method(veggies, "get_veggies"), "grab_lettuce")
+        graph = builder.build()
+        
+    Text usage (see parse()):
+        graph = SGOMSModelBuilder().buildFromText(theText)
+    
+    To use the builder from another script, load this file as a module; the GUI only starts when the file is run directly:
+        import imp
+        sgoms = imp.load_source("sgoms", "SGOMS_GUI_1.5.py")'''
+    
+    ## The kind of SGOMS unit that each keyword in the text format creates, and the kind of parent it must be under
+    UNIT_KEYWORDS = {"PU": PlanningUnit, "UT": UnitTask, "M": Method, "O": Operator}
+    PARENT_KEYWORDS = {"PU": None, "UT": "PU", "M": "UT", "O": "M"}
+    
+    ## Layout of the automatically placed nodes
+    COLUMN_WIDTH = 250
+    ROW_HEIGHT = 50
+    INDENT_WIDTH = 60
+    
+    def __init__(self, theGraph=None):
+        '''Initializes the SGOMSModelBuilder
+        
+        theGraph should be a Graph to add to (a new Graph is created by default)'''
+        
+        if theGraph == None:
+            self.graph = Graph()
+        else:
+            self.graph = theGraph
+            
+        self.transaction = self.graph.beginTransaction()
+        
+        ## The last child added to each parent (e.g. the last UT of a PU), new children are chained onto it
+        self.lastChild = {}
+        
+        ## The column each planning unit is in, and the next free row in each column
+        self.columns = {}
+        self.nextRow = []
+        
+        ## Problems found by parse()
+        self.problems = []
+        
+    def planningUnit(self, theID, theFiringConditions=None, theBehaviour=None):
+        '''Queues a new Planning Unit in a new column
+        Returns a PendingNode to be passed to unitTask()'''
+        
+        return self.addSGOMSUnit(None, PlanningUnit(theID, theFiringConditions, theBehaviour))
+    
+    def unitTask(self, thePlanningUnit, theID, theFiringConditions=None, theBehaviour=None):
+        '''Queues a new Unit Task at the end of thePlanningUnit's sequence of Unit Tasks
+        Returns a PendingNode to be passed to method()
+        
+        thePlanningUnit should be a PendingNode returned by planningUnit(), 
+            or None for an unconnected Unit Task'''
+        
+        return self.addChild(thePlanningUnit, UnitTask(theID, theFiringConditions, theBehaviour), 0)
+    
+    def unitTaskSequence(self, thePlanningUnit, theIDs):
+        '''Queues a Unit Task (with no firing conditions or behaviour) for each ID in theIDs, in order
+        Returns the list of PendingNodes
+        
+        theIDs should be a list of strings (the last one should normally be "finished")'''
+        
+        returnList = []
+        for theID in theIDs:
+            returnList.append(self.unitTask(thePlanningUnit, theID))
+        return returnList
+    
+    def method(self, theUnitTask, theID, theFiringConditions=None, theBehaviour=None):
+        '''Queues a new Method at the end of theUnitTask's Methods
+        Returns a PendingNode to be passed to operator()'''
+        
+        return self.addChild(theUnitTask, Method(theID, theFiringConditions, theBehaviour), 1)
+    
+    def operator(self, theMethod, theID, theFiringConditions=None, theBehaviour=None):
+        '''Queues a new Operator at the end of theMethod's Operators
+        Returns a PendingNode'''
+        
+        return self.addChild(theMethod, Operator(theID, theFiringConditions, theBehaviour), 2)
+    
+    def addSGOMSUnit(self, theParent, theSGOMSUnit):
+        '''Queues a node for an existing SGOMS unit (e.g. to share one unit between several nodes, like a slave node)
+        Returns a PendingNode
+        
+        theParent should be a PendingNode of the right kind for theSGOMSUnit (see unitTask(), method(), and operator()),
+            it is ignored for PlanningUnits
+        theSGOMSUnit should be a PlanningUnit, UnitTask, Method, or Operator'''
+        
+        if isinstance(theSGOMSUnit, PlanningUnit):
+            column = len(self.nextRow)
+            self.nextRow.append(1)
+            pendingNode = self.transaction.addSGOMSNode(theSGOMSUnit, self.returnPoint(column, 0, 0))
+            self.columns[pendingNode] = column
+            return pendingNode
+        
+        if isinstance(theSGOMSUnit, UnitTask):
+            return self.addChild(theParent, theSGOMSUnit, 0)
+        if isinstance(theSGOMSUnit, Method):
+            return self.addChild(theParent, theSGOMSUnit, 1)
+        return self.addChild(theParent, theSGOMSUnit, 2)
+    
+    def initialBehaviour(self, theBehaviour):
+        '''Adds theBehaviour (a string) to the initial behaviour of the model'''
+        
+        self.graph.sGOMS.initialBehaviour.append(theBehaviour)
+    
+    def addChild(self, theParent, theSGOMSUnit, theIndent):
+        '''Queues a node for theSGOMSUnit, and an edge from the last child of theParent 
+        (or from theParent itself if it has no children yet)
+        Returns the new PendingNode
+        
+        theIndent is how far to the right of the Planning Unit's column the node goes'''
+        
+        if theParent == None:   ## Unconnected units get a column of their own
+            column = len(self.nextRow)
+            self.nextRow.append(0)
+        else:
+            column = self.columns[theParent]
+        
+        pendingNode = self.transaction.addSGOMSNode(theSGOMSUnit, self.returnPoint(column, self.nextRow[column], theIndent))
+        self.nextRow[column] += 1
+        self.columns[pendingNode] = column
+        
+        if theParent != None:
+            self.transaction.addEdge(self.lastChild.get(theParent, theParent), pendingNode)
+            self.lastChild[theParent] = pendingNode
+            
+        return pendingNode
+    
+    def returnPoint(self, theColumn, theRow, theIndent):
+        '''Returns the Point for a node in theColumn and theRow, indented theIndent steps to the right'''
+        
+        return Point(80 + theColumn * SGOMSModelBuilder.COLUMN_WIDTH + theIndent * SGOMSModelBuilder.INDENT_WIDTH,
+                     40 + theRow * SGOMSModelBuilder.ROW_HEIGHT)
+    
+    def parse(self, theText):
+        '''Queues the SGOMS units described by theText
+        Returns True if the text was valid, False otherwise (the problems are stored in self.problems)
+        
+        The text format has one statement per line, and uses indentation to nest units, e.g.:
+        
+            # Comments start with a hash
+            init: b_context.set('order:wrap')
+            PU prep_wrap
+                if: b_context='order:wrap'
+                do: b_plan_unit.set('planning_unit:prep_wrap cuelag:none cue:start unit_task:veggies state:running')
+                UT veggies
+                    M get_veggies
+                        O grab_lettuce
+                        O grab_tomato
+                UT finished
+                
+        PU, UT, M and O create a Planning Unit, Unit Task, Method, or Operator with the given ID
+        A UT must be nested under a PU (or not nested at all, for an unconnected Unit Task), an M under a UT, and an O under an M
+        Units nested under the same parent are chained in the order they are written
+        "if:" adds a firing condition and "do:" adds a behaviour to the unit the line is nested under
+        "init:" adds to the initial behaviour of the model'''
+        
+        stack = []  ## (indent, keyword, PendingNode) of the units that enclose the current line
+        lineNumber = 0
+        
+        for line in theText.splitlines():
+            lineNumber += 1
+            stripped = line.strip()
+            if stripped == "" or stripped.startswith("#"):
+                continue
+            
+            indent = len(line) - len(line.lstrip())
+            while len(stack) > 0 and stack[-1][0] >= indent:
+                stack.pop()
+                
+            if stripped.startswith("init:"):
+                self.initialBehaviour(stripped[5:].strip())
+                continue
+            
+            if stripped.startswith("if:") or stripped.startswith("do:"):
+                if len(stack) < 1:
+                    self.problems.append("line " + str(lineNumber) + ": '" + stripped[:3] + "' is not nested under a unit")
+                elif stripped.startswith("if:"):
+                    stack[-1][2].sGOMSUnit.firingConditions.append(stripped[3:].strip())
+                else:
+                    stack[-1][2].sGOMSUnit.behaviour.append(stripped[3:].strip())
+                continue
+            
+            words = stripped.split(None, 1)
+            keyword = words[0]
+            if keyword not in SGOMSModelBuilder.UNIT_KEYWORDS or len(words) < 2:
+                self.problems.append("line " + str(lineNumber) + ": expected PU, UT, M or O and an ID, found '" + stripped + "'")
+                continue
+            theID = words[1].strip()
+            
+            ## Find the parent, and check that it is the right kind of unit
+            parent = None
+            if len(stack) > 0:
+                if stack[-1][1] != SGOMSModelBuilder.PARENT_KEYWORDS[keyword]:
+                    self.problems.append("line " + str(lineNumber) + ": " + keyword + " cannot be nested under " + stack[-1][1])
+                    continue
+                parent = stack[-1][2]
+            elif keyword != "PU" and keyword != "UT":
+                self.problems.append("line " + str(lineNumber) + ": " + keyword + " must be nested under " + \
+                                     SGOMSModelBuilder.PARENT_KEYWORDS[keyword])
+                continue
+            
+            if keyword == "PU":
+                pendingNode = self.planningUnit(theID)
+            if keyword == "UT":
+                pendingNode = self.unitTask(parent, theID)
+            if keyword == "M":
+                pendingNode = self.method(parent, theID)
+            if keyword == "O":
+                pendingNode = self.operator(parent, theID)
+                
+            stack.append((indent, keyword, pendingNode))
+            
+        for problem in self.problems:
+            print "XXX (SGOMSModelBuilder.parse)", problem, "XXX"
+        
+        return len(self.problems) == 0
+    
+    def build(self):
+        '''Adds everything that has been queued to the graph in one transaction (i.e. one Graph.update())
+        Returns the Graph, or None if the transaction could not be committed'''
+        
+        if self.transaction.commit() == False:
+            return None
+        
+        print "(SGOMSModelBuilder.build)", self.graph
+        return self.graph
+    
+    def buildFromText(self, theText):
+        '''Parses theText (see parse()) and builds the graph
+        Returns the Graph, or None if the text was not valid'''
+        
+        if self.parse(theText) == False:
+            return None
+        
+        return self.build()
+
+class ACTRImporter:
+    '''Imports a Python ACT-R (CCMSuite) model file, such as one written by SGOMS_Model.outputToACTR(), into a Graph
+    
+    The file is read one line at a time in a single pass, collecting:
+        the DM chunks added with DM.add('planning_unit:... cuelag:... cue:... unit_task:...')
+        the productions (def statements) of every ACTR agent class, with their firing conditions and behaviours
+        the initial behaviours (the rest of the init() production)
+    
+    build() then rebuilds each Planning Unit's sequence of Unit Tasks by following the cue/cuelag links of its chunks,
+    and lays the result out with an SGOMSModelBuilder.
+    
+    Productions are matched to units by name: a production named after a planning_unit in DM becomes that PlanningUnit,
+    and one named after a unit_task becomes that UnitTask. Other productions become Methods or Operators, using the 
+    section comments written by outputToACTR() when they are present (Methods otherwise). A Method is put under the 
+    Unit Task named in a 'unit_task:' slot of its firing conditions, and an Operator under the Method named in a
+    'method:' slot; the rest are left unconnected.'''
+    
+    ## Productions written by outputToACTR() for every model, which are not SGOMS units
+    GLOBAL_PRODUCTIONS = ["init", "request_next_unit_task", "retrieve_next_unit_task", "last_unit_task"]
+    
+    ## The section comments written by outputToACTR(), and the kind of unit that follows them
+    SECTION_COMMENTS = [("## Planning Units", "PU"), ("## Unit Tasks", "UT"), ("## Methods", "M"), ("## Operators", "O")]
+    
+    def __init__(self):
+        '''Initializes an empty ACTRImporter'''
+        
+        self.chunks = []            ## Each chunk is a dictionary of slot:value
+        self.buffers = []           ## The buffers declared by the agent classes (name=Buffer())
+        self.memory = None          ## The arguments of DM=Memory(...): the buffer, then any "name=value" parameters
+        self.productions = []       ## Each production is a list: [name, firing conditions, behaviours, section kind]
+        self.initialBehaviour = []
+        
+        ## The state of the line-by-line reader
+        self.section = None         ## The kind of unit ("PU", "UT", "M", "O") of the current section comment, if any
+        self.inAgentClass = False   ## Whether the reader is inside an ACTR agent class
+        self.header = None          ## The text of a def statement whose parentheses have not been closed yet
+        self.headerIndent = 0
+        self.production = None      ## The production whose body is being read
+        self.lineCount = 0
+        
+    def readFile(self, theFileName):
+        '''Reads the ACT-R file theFileName, one line at a time'''
+        
+        f = open(theFileName, "r")
+        for line in f:
+            self.readLine(line)
+        f.close()
+        
+        print "(ACTRImporter.readFile) read", self.lineCount, "lines from", theFileName, ":", len(self.chunks), \
+            "DM chunks and", len(self.productions), "productions"
+        
+    def readLine(self, theLine):
+        '''Reads a single line of an ACT-R file'''
+        
+        self.lineCount += 1
+        line = theLine.rstrip()
+        stripped = line.strip()
+        indent = len(line) - len(line.lstrip())
+        
+        ## Continue a def statement that spans several lines (outputToACTR() puts each firing condition on its own line)
+        if self.header != None:
+            self.header += "\n" + line
+            self.readHeader()
+            return
+        
+        if stripped == "":
+            return
+        
+        ## Comments do not end a production's body (outputToACTR() writes some at the start of the line)
+        if stripped.startswith("#"):
+            for (comment, kind) in ACTRImporter.SECTION_COMMENTS:
+                if stripped.startswith(comment):
+                    self.section = kind
+            return
+        
+        ## A line that is not indented past the def ends the production's body
+        if self.production != None and indent <= self.headerIndent:
+            self.production = None
+        
+        if self.production != None:
+            self.readBodyLine(stripped)
+            return
+        
+        if indent == 0:
+            ## Only the productions of the ACT-R agent classes are imported (not the environment's)
+            if stripped.startswith("class "):
+                self.inAgentClass = "ACTR" in stripped[stripped.find("("):]
+                self.section = None
+            else:
+                self.inAgentClass = False
+            return
+            
+        if self.inAgentClass == True and stripped.startswith("def "):
+            self.header = line
+            self.headerIndent = indent
+            self.readHeader()
+        
+        elif self.inAgentClass == True and stripped.replace(" ", "").endswith("=Buffer()"):
+            buffer = stripped[:stripped.find("=")].strip()
+            if buffer not in self.buffers:
+                self.buffers.append(buffer)
+                
+        elif self.inAgentClass == True and stripped.replace(" ", "").startswith("DM=Memory("):
+            openIndex = stripped.find("(")
+            self.memory = self.splitArguments(stripped[openIndex+1:self.findClosingBracket(stripped, openIndex)])
+            
+    def readHeader(self):
+        '''Checks whether the def statement in self.header is complete (i.e. its parentheses are closed), 
+        and if so starts a new production'''
+        
+        openIndex = self.header.find("(")
+        closeIndex = self.findClosingBracket(self.header, openIndex)
+        if closeIndex < 0:      ## Wait for the next line
+            return
+        
+        name = self.header[:openIndex].strip()[3:].strip()
+        firingConditions = []
+        for argument in self.splitArguments(self.header[openIndex+1:closeIndex]):
+            if argument != "" and argument != "self":
+                firingConditions.append(argument)
+        
+        self.production = [name, firingConditions, [], self.section]
+        self.productions.append(self.production)
+        
+        ## A one-line production, e.g. "def name(): pass"
+        rest = self.header[closeIndex+1:].strip()
+        self.header = None
+        if rest.startswith(":") and rest[1:].strip() != "":
+            self.readBodyLine(rest[1:].strip())
+    
+    def readBodyLine(self, theLine):
+        '''Adds a line of a production's body to the production's behaviours 
+        (or to the DM chunks and initial behaviours, for the init() production)'''
+        
+        if theLine.startswith("DM.add"):
+            self.readChunk(theLine)
+            return
+        
+        ## outputToACTR() writes "pass" for units without behaviour
+        if theLine == "pass" or theLine.startswith("pass ") or theLine.startswith("pass#"):
+            return
+        
+        if self.production[0] == "init":
+            self.initialBehaviour.append(theLine)
+        else:
+            self.production[2].append(theLine)
+            
+    def readChunk(self, theLine):
+        '''Adds the chunk in a DM.add('...') line to self.chunks'''
+        
+        openIndex = theLine.find("(")
+        closeIndex = self.findClosingBracket(theLine, openIndex)
+        chunkString = theLine[openIndex+1:closeIndex].strip()
+        if len(chunkString) > 1 and chunkString[0] in "'\"":
+            chunkString = chunkString[1:-1]
+        
+        chunk = {}
+        for slot in chunkString.split():
+            if ":" in slot:
+                key, value = slot.split(":", 1)
+                chunk[key] = value
+        self.chunks.append(chunk)
+        
+    def findClosingBracket(self, theText, theOpenIndex):
+        '''Returns the index of the bracket that closes the one at theOpenIndex in theText, 
+        ignoring brackets inside quotes. Returns -1 if it is not closed'''
+        
+        if theOpenIndex < 0:
+            return -1
+        
+        depth = 0
+        quote = None
+        for i in range(theOpenIndex, len(theText)):
+            c = theText[i]
+            if quote != None:
+                if c == quote:
+                    quote = None
+            elif c == "'" or c == '"':
+                quote = c
+            elif c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth -= 1
+                if depth == 0:
+                    return i
+        return -1
+    
+    def splitArguments(self, theText):
+        '''Splits theText at each comma that is not inside quotes or brackets
+        Returns the list of stripped pieces'''
+        
+        returnList = []
+        depth = 0
+        quote = None
+        start = 0
+        for i in range(len(theText)):
+            c = theText[i]
+            if quote != None:
+                if c == quote:
+                    quote = None
+            elif c == "'" or c == '"':
+                quote = c
+            elif c in "([{":
+                depth += 1
+            elif c in ")]}":
+                depth -= 1
+            elif c == "," and depth == 0:
+                returnList.append(theText[start:i].strip())
+                start = i + 1
+        returnList.append(theText[start:].strip())
+        return returnList
+    
+    def findSlotValue(self, theFiringConditions, theSlot):
+        '''Returns the value of the first "theSlot:value" found in theFiringConditions (None if there is none)'''
+        
+        for firingCondition in theFiringConditions:
+            index = firingCondition.find(theSlot + ":")
+            while index >= 0:
+                ## Make sure this is the whole slot name (e.g. not 'next_unit_task:')
+                if index == 0 or not (firingCondition[index-1].isalnum() or firingCondition[index-1] == "_"):
+                    value = firingCondition[index + len(theSlot) + 1:].split()
+                    if len(value) > 0:
+                        return value[0].strip("'\",)")
+                index = firingCondition.find(theSlot + ":", index + 1)
+        return None
+    
+    def build(self, theGraph=None):
+        '''Builds the graph from everything that has been read (see the class description)
+        Returns the Graph
+        
+        theGraph should be a Graph to add to (a new Graph is created by default)'''
+        
+        builder = SGOMSModelBuilder(theGraph)
+        for behaviour in self.initialBehaviour:
+            builder.initialBehaviour(behaviour)
+        
+        ## The buffers and memory (the memory buffer is kept out of the bufferList, as in a new model)
+        model = builder.graph.sGOMS
+        if self.memory != None and len(self.memory) > 0:
+            model.memoryBuffer = self.memory[0]
+            for parameter in self.memory[1:]:
+                if parameter.find("=") > 0:
+                    model.setMemoryParameter(parameter[:parameter.find("=")].strip(), parameter[parameter.find("=")+1:].strip())
+        if len(self.buffers) > 0:
+            model.bufferList = [buffer for buffer in self.buffers if buffer != model.returnMemoryBuffer()]
+        
+        ## Index the chunks and productions
+        planningUnitIDs = []        ## In the order they are first seen
+        chunksByPlanningUnit = {}
+        unitTaskIDs = {}
+        for chunk in self.chunks:
+            pu = chunk.get("planning_unit", "")
+            if pu not in chunksByPlanningUnit:
+                chunksByPlanningUnit[pu] = []
+                planningUnitIDs.append(pu)
+            chunksByPlanningUnit[pu].append(chunk)
+            unitTaskIDs[chunk.get("unit_task", "")] = True
+            
+        units = {}      ## Maps each PU/UT production name to its unit
+        otherProductions = []
+        for (name, firingConditions, behaviours, section) in self.productions:
+            if name in ACTRImporter.GLOBAL_PRODUCTIONS:
+                continue
+            if name in chunksByPlanningUnit or (section == "PU" and name not in unitTaskIDs):
+                units[name] = PlanningUnit(name, firingConditions, behaviours)
+            elif name in unitTaskIDs or section == "UT":
+                units[name] = UnitTask(name, firingConditions, behaviours)
+            else:
+                otherProductions.append((name, firingConditions, behaviours, section))
+                
+        ## Rebuild each Planning Unit's chain of Unit Tasks by following the cue/cuelag links
+        ## (the next chunk's cue is the previous unit_task, and its cuelag is the previous cue)
+        unitTaskNodes = {}      ## Maps each Unit Task ID to the first PendingNode made for it
+        placed = {}             ## The IDs of the Planning Units that have been given a node
+        for pu in planningUnitIDs:
+            chunks = chunksByPlanningUnit[pu]
+            nextChunk = {}
+            for chunk in chunks:
+                nextChunk[(chunk.get("cue"), chunk.get("cuelag"))] = chunk
+            
+            puNode = None
+            if pu != "":
+                if pu not in units or not isinstance(units[pu], PlanningUnit):
+                    units[pu] = PlanningUnit(pu)
+                puNode = builder.addSGOMSUnit(None, units[pu])
+                placed[pu] = True
+            
+            visited = {}
+            chunk = nextChunk.get(("start", "none"))
+            while chunk != None and id(chunk) not in visited:
+                visited[id(chunk)] = True
+                unitTaskNodes.setdefault(chunk.get("unit_task"), 
+                                         builder.addSGOMSUnit(puNode, self.returnUnitTask(units, chunk.get("unit_task"))))
+                chunk = nextChunk.get((chunk.get("unit_task"), chunk.get("cue")))
+                
+            for chunk in chunks:
+                if id(chunk) not in visited:
+                    print "XXX (ACTRImporter.build) chunk", chunk, "is not in the cue/cuelag chain of", pu, \
+                        ", adding it as an unconnected Unit Task XXX"
+                    unitTaskNodes.setdefault(chunk.get("unit_task"),
+                                             builder.addSGOMSUnit(None, self.returnUnitTask(units, chunk.get("unit_task"))))
+                    
+        ## Planning Units and Unit Tasks that have productions but no chunks
+        for (name, firingConditions, behaviours, section) in self.productions:
+            if name in units and name not in placed and name not in unitTaskNodes:
+                if isinstance(units[name], PlanningUnit):
+                    builder.addSGOMSUnit(None, units[name])
+                    placed[name] = True
+                else:
+                    unitTaskNodes[name] = builder.addSGOMSUnit(None, units[name])
+                
+        ## Methods first, then the Operators (which may belong to them)
+        methodNodes = {}
+        for (name, firingConditions, behaviours, section) in otherProductions:
+            if section != "O":
+                parent = unitTaskNodes.get(self.findSlotValue(firingConditions, "unit_task"))
+                methodNodes[name] = builder.addSGOMSUnit(parent, Method(name, firingConditions, behaviours))
+        for (name, firingConditions, behaviours, section) in otherProductions:
+            if section == "O":
+                parent = methodNodes.get(self.findSlotValue(firingConditions, "method"))
+                builder.addSGOMSUnit(parent, Operator(name, firingConditions, behaviours))
+        
+        return builder.build()
+    
+    def returnUnitTask(self, theUnits, theID):
+        '''Returns the UnitTask for theID from theUnits, adding a blank one if there is none
+        (The same UnitTask is shared by every node for that ID, like a slave node)'''
+        
+        if theID not in theUnits or not isinstance(theUnits[theID], UnitTask):
+            theUnits[theID] = UnitTask(theID)
+        return theUnits[theID]
+    
+    def importFile(self, theFileName, theGraph=None):
+        '''Reads theFileName and builds the graph (see readFile() and build())
+        Returns the Graph, or None if it could not be built'''
+        
+        self.readFile(theFileName)
+        return self.build(theGraph)
+
+#####
+## Simulating models without ACT-R
+#####
+
+class SimulationEpisode:
+    '''The result of simulating one Planning Unit with an SGOMSSimulator'''
+    
+    FINISHED = "finished"                   ## last_unit_task fired
+    RETRIEVAL_FAILURE = "retrieval_failure" ## No DM chunk matched the request for the next unit task
+    STEP_LIMIT = "step_limit"               ## The episode was stopped after too many unit tasks (e.g. a cue/cuelag loop)
+    
+    def __init__(self, thePlanningUnitID):
+        '''Initializes an empty episode for the Planning Unit named thePlanningUnitID'''
+        
+        self.planningUnit = thePlanningUnitID
+        self.events = []            ## (production, planning_unit, unit_task) for each production fired, in order
+        self.unitTasks = []         ## The unit tasks retrieved, in order
+        self.outcome = None
+        self.ambiguities = 0        ## The number of requests that matched more than one chunk
+        
+    def __str__(self):
+        '''Returns a summary of the episode'''
+        
+        return "SimulationEpisode " + self.planningUnit + ": " + " -> ".join(self.unitTasks) + " (" + self.outcome + ")"
+    
+    def returnTrace(self):
+        '''Returns the names of the productions fired, in order'''
+        
+        return [event[0] for event in self.events]
+
+
+class SimulatedDM:
+    '''An in-process stand-in for the declarative memory of the exported model, holding its planning unit chunks
+    
+    The chunks are indexed by (planning_unit, cue, cuelag) when the SimulatedDM is made, so that a request for the next 
+    unit task, DM.request('planning_unit:?planning_unit cue:?unit_task unit_task:? cuelag:?cue'),
+    is a single dictionary lookup however many chunks there are.
+    Every request is counted, so the hit rate and the ambiguous requests can be reported.'''
+    
+    def __init__(self, theChunks):
+        '''Initializes the SimulatedDM
+        
+        theChunks should be a list of [planning_unit, cuelag, cue, unit_task] lists (e.g. SGOMS_IR.chunks)'''
+        
+        self.index = {}     ## (planning_unit, cue, cuelag) -> the matching chunks
+        for chunk in theChunks:
+            self.index.setdefault((chunk[0], chunk[2], chunk[1]), []).append(chunk)
+        
+        self.chunkCount = len(theChunks)
+        self.resetStatistics()
+        
+    def __str__(self):
+        '''Returns a summary of the SimulatedDM and its retrieval statistics'''
+        
+        return "SimulatedDM with " + str(self.chunkCount) + " chunks: " + str(self.requests) + " requests, " + \
+            str(self.failures) + " failed, " + str(self.ambiguities) + " ambiguous (hit rate " + \
+            str(round(self.returnHitRate(), 3)) + ")"
+    
+    def resetStatistics(self):
+        '''Sets the retrieval statistics back to zero'''
+        
+        self.requests = 0
+        self.failures = 0               ## Requests that matched no chunk
+        self.ambiguities = 0            ## Requests that matched more than one chunk
+        self.ambiguousRequests = {}     ## (planning_unit, cue, cuelag) -> the number of times it was requested
+        
+    def request(self, thePlanningUnit, theCue, theCuelag):
+        '''Returns the chunks that match thePlanningUnit, theCue, and theCuelag (an empty list if there are none)'''
+        
+        self.requests += 1
+        key = (thePlanningUnit, theCue, theCuelag)
+        matches = self.index.get(key)
+        
+        if matches == None:
+            self.failures += 1
+            return []
+        if len(matches) > 1:
+            self.ambiguities += 1
+            self.ambiguousRequests[key] = self.ambiguousRequests.get(key, 0) + 1
+        return matches
+    
+    def returnHitRate(self):
+        '''Returns the fraction of requests that matched at least one chunk (1.0 if there have been no requests)'''
+        
+        if self.requests == 0:
+            return 1.0
+        return float(self.requests - self.failures) / self.requests
+    
+    def returnStatistics(self):
+        '''Returns the retrieval statistics as a dictionary'''
+        
+        return {"requests": self.requests, "failures": self.failures, "ambiguities": self.ambiguities,
+                "hitRate": self.returnHitRate(), "ambiguousRequests": dict(self.ambiguousRequests)}
+
+
+class SGOMSSimulator:
+    '''Runs the planning unit / unit task control flow of a model in-process, without exporting it or running ACT-R
+    
+    The simulator works from the model's SGOMS_IR, and fires the same productions as the exported file:
+        the Planning Unit's production, which starts the planning unit (cuelag:none cue:start)
+        retrieve_next_unit_task, with the DM chunk matching the planning_unit, cue, and cuelag
+        the Unit Task's production, then its Methods and their Operators in location order
+        request_next_unit_task, once the unit task is finished, and so on until
+        last_unit_task, when the retrieved unit task is 'finished'
+    Firing conditions and behaviours are not evaluated; the order of the Methods and Operators stands in for them.
+    When several chunks match a request (as with several equal chunks in ACT-R), one is chosen at random.'''
+    
+    MAX_UNIT_TASKS = 1000   ## Episodes are stopped after this many unit tasks
+    
+    def __init__(self, theModel, theIR=None):
+        '''Initializes the SGOMSSimulator
+        
+        theModel should be an SGOMS_Model; the simulator uses its current IR, so create a new simulator after editing
+        theIR is optional; if given, it is simulated instead of the model's own IR (e.g. a variant, see lowerVariant)'''
+        
+        if theIR == None:
+            theIR = theModel.lowerToIR()
+        self.ir = theIR
+        
+        ## The declarative memory, indexed once for the simulator's lifetime
+        self.dm = SimulatedDM(self.ir.chunks)
+        
+        ## The productions fired while doing each unit task: the unit task, then each method followed by its operators
+        self.unitTaskProductions = {}
+        for kind, unitTask, firingConditions, behaviours in self.ir.returnProductions("UnitTask"):
+            productions = [unitTask]
+            for method in self.ir.methodsOfUnitTask.get(unitTask, []):
+                productions.append(method)
+                productions.extend(self.ir.operatorsOfMethod.get(method, []))
+            self.unitTaskProductions[unitTask] = productions
+        
+    def returnPlanningUnits(self):
+        '''Returns the IDs of the Planning Units that have DM chunks, in model order'''
+        
+        planningUnits = []
+        for planningUnit, cuelag, cue, unitTask in self.ir.chunks:
+            if planningUnit != '' and planningUnit not in planningUnits:
+                planningUnits.append(planningUnit)
+        return planningUnits
+    
+    def run(self, thePlanningUnitID, theRandom=None, recordEvents=True):
+        '''Simulates the Planning Unit named thePlanningUnitID once, and returns a SimulationEpisode
+        
+        theRandom is an optional random.Random, used to choose between ambiguous chunks (so runs can be repeated)
+        recordEvents can be set to False to only record the unit tasks and outcome (faster, for many episodes)'''
+        
+        if theRandom == None:
+            theRandom = random
+        
+        episode = SimulationEpisode(thePlanningUnitID)
+        events = episode.events
+        
+        if recordEvents:
+            events.append((thePlanningUnitID, thePlanningUnitID, None))
+        
+        ## The planning unit starts as if 'start' were the unit task just finished, with 'none' as its cue
+        cue = 'none'
+        unitTask = 'start'
+        
+        while True:
+            matches = self.dm.request(thePlanningUnitID, unitTask, cue)
+            
+            if len(matches) == 0:
+                episode.outcome = SimulationEpisode.RETRIEVAL_FAILURE
+                return episode
+            if len(matches) > 1:
+                episode.ambiguities += 1
+                chunk = theRandom.choice(matches)
+            else:
+                chunk = matches[0]
+            
+            cue = chunk[2]
+            unitTask = chunk[3]
+            episode.unitTasks.append(unitTask)
+            if recordEvents:
+                events.append(("retrieve_next_unit_task", thePlanningUnitID, unitTask))
+            
+            if unitTask == 'finished':
+                if recordEvents:
+                    events.append(("last_unit_task", thePlanningUnitID, unitTask))
+                episode.outcome = SimulationEpisode.FINISHED
+                return episode
+            
+            if len(episode.unitTasks) >= self.MAX_UNIT_TASKS:
+                episode.outcome = SimulationEpisode.STEP_LIMIT
+                return episode
+            
+            if recordEvents:
+                for production in self.unitTaskProductions.get(unitTask, [unitTask]):
+                    events.append((production, thePlanningUnitID, unitTask))
+                events.append(("request_next_unit_task", thePlanningUnitID, unitTask))
+    
+    def runEpisodes(self, theCount, thePlanningUnitIDs=None, theSeed=None):
+        '''Simulates theCount episodes of each Planning Unit (every Planning Unit with DM chunks if thePlanningUnitIDs is None)
+        Returns a dictionary of planning unit ID -> 
+            {outcome: count, "ambiguities": count, "unitTasks": total unit tasks retrieved, "seconds": time taken}
+        
+        theSeed is an optional seed for choosing between ambiguous chunks, so that results can be repeated'''
+        
+        if thePlanningUnitIDs == None:
+            thePlanningUnitIDs = self.returnPlanningUnits()
+        
+        randomGenerator = random.Random(theSeed)
+        results = {}
+        
+        for planningUnit in thePlanningUnitIDs:
+            counts = {SimulationEpisode.FINISHED: 0, SimulationEpisode.RETRIEVAL_FAILURE: 0, 
+                      SimulationEpisode.STEP_LIMIT: 0, "ambiguities": 0, "unitTasks": 0}
+            startTime = time.time()
+            for i in xrange(theCount):
+                episode = self.run(planningUnit, randomGenerator, False)
+                counts[episode.outcome] += 1
+                counts["ambiguities"] += episode.ambiguities
+                counts["unitTasks"] += len(episode.unitTasks)
+            counts["seconds"] = time.time() - startTime
+            results[planningUnit] = counts
+            
+            print "(SGOMSSimulator.runEpisodes)", planningUnit, ":", counts
+        
+        print "(SGOMSSimulator.runEpisodes)", self.dm
+        for key in self.dm.ambiguousRequests:
+            print "XXX (SGOMSSimulator.runEpisodes) ambiguous request: planning_unit:%s cue:%s cuelag:%s XXX" % key
+        
+        return results
+
+
+class BatchSimulator:
+    '''Simulates many agents running the same Planning Unit at once, sharing one compiled copy of the model's structure
+    
+    The control flow of the model is compiled once into flat integer tables (array module arrays), with one state per DM
+    chunk: the chunk's successors (the chunks that match the request made after its unit task), whether it is the
+    'finished' chunk, and the number of productions fired for its unit task.
+    Agents are not simulated one at a time: the batch is a count of agents in each state, and each step moves every
+    agent in a state together, so the cost of a step depends on the number of states, not the number of agents.
+    Agents in a state with several successors (an ambiguous request) are split between them at random, 
+    with one binomial draw per successor (see spread), so that costs the number of successors, not the number of agents.'''
+    
+    def __init__(self, theModel, theIR=None):
+        '''Initializes the BatchSimulator, compiling the transition tables
+        
+        theModel should be an SGOMS_Model
+        theIR is optional; if given, it is simulated instead of the model's own IR (see SGOMSSimulator)'''
+        
+        simulator = SGOMSSimulator(theModel, theIR)
+        self.ir = simulator.ir
+        chunks = self.ir.chunks
+        
+        self.chunkNumbers = {}      ## id(chunk) -> its state number (its index in self.ir.chunks)
+        for i in range(len(chunks)):
+            self.chunkNumbers[id(chunks[i])] = i
+        
+        ## The successors of state i are self.successors[self.successorStart[i]:self.successorStart[i+1]]
+        self.successorStart = array('i', [0])
+        self.successors = array('i')
+        self.final = array('b')         ## 1 for the 'finished' chunks
+        self.productions = array('i')   ## The number of productions fired once the chunk is retrieved
+        
+        for planningUnit, cuelag, cue, unitTask in chunks:
+            if unitTask == 'finished':
+                self.final.append(1)
+                self.productions.append(2)  ## retrieve_next_unit_task and last_unit_task
+            else:
+                self.final.append(0)
+                self.successors.extend(self.returnStates(simulator.dm.request(planningUnit, unitTask, cue)))
+                ## retrieve_next_unit_task, the unit task with its methods and operators, and request_next_unit_task
+                self.productions.append(len(simulator.unitTaskProductions.get(unitTask, [unitTask])) + 2)
+            self.successorStart.append(len(self.successors))
+        
+        self.dm = simulator.dm
+        self.dm.resetStatistics()   ## The requests made while compiling are not retrievals
+        
+    def returnStates(self, theChunks):
+        '''Returns the state numbers of theChunks'''
+        
+        return [self.chunkNumbers[id(chunk)] for chunk in theChunks]
+    
+    def run(self, thePlanningUnitID, theAgentCount, theSeed=None, theMaxSteps=None):
+        '''Simulates theAgentCount agents doing the Planning Unit named thePlanningUnitID, all at once
+        Returns a dictionary with the number of agents that finished, had a retrieval failure, or hit the step limit,
+        the number of agents finishing after each number of unit tasks ("finishedAt"), 
+        and the total numbers of unit tasks retrieved and productions fired
+        
+        theSeed is an optional seed for splitting agents between ambiguous chunks
+        theMaxSteps is the maximum number of unit tasks (SGOMSSimulator.MAX_UNIT_TASKS by default)'''
+        
+        if theMaxSteps == None:
+            theMaxSteps = SGOMSSimulator.MAX_UNIT_TASKS
+        randomGenerator = random.Random(theSeed)
+        
+        stateCount = len(self.final)
+        results = {SimulationEpisode.FINISHED: 0, SimulationEpisode.RETRIEVAL_FAILURE: 0, SimulationEpisode.STEP_LIMIT: 0,
+                   "ambiguities": 0, "unitTasks": 0, "productions": theAgentCount, "finishedAt": {}}
+        startTime = time.time()
+        
+        ## Every agent starts by requesting the chunk with cue:start cuelag:none (and fires its planning unit's production)
+        counts = array('i', [0]) * stateCount
+        firstStates = self.returnStates(self.dm.request(thePlanningUnitID, 'start', 'none'))
+        if len(firstStates) == 0:
+            results[SimulationEpisode.RETRIEVAL_FAILURE] = theAgentCount
+            results["seconds"] = time.time() - startTime
+            return results
+        self.spread(counts, firstStates, theAgentCount, randomGenerator, results)
+        
+        active = theAgentCount
+        step = 1
+        while active > 0:
+            newCounts = array('i', [0]) * stateCount
+            
+            for state in xrange(stateCount):
+                count = counts[state]
+                if count == 0:
+                    continue
+                results["unitTasks"] += count
+                results["productions"] += count * self.productions[state]
+                
+                if self.final[state] == 1:
+                    results[SimulationEpisode.FINISHED] += count
+                    results["finishedAt"][step] = results["finishedAt"].get(step, 0) + count
+                    active -= count
+                elif step >= theMaxSteps:
+                    results[SimulationEpisode.STEP_LIMIT] += count
+                    active -= count
+                else:
+                    start = self.successorStart[state]
+                    end = self.successorStart[state + 1]
+                    if start == end:
+                        results[SimulationEpisode.RETRIEVAL_FAILURE] += count
+                        active -= count
+                    else:
+                        self.spread(newCounts, self.successors[start:end], count, randomGenerator, results)
+            
+            counts = newCounts
+            step += 1
+        
+        results["seconds"] = time.time() - startTime
+        print "(BatchSimulator.run)", thePlanningUnitID, theAgentCount, "agents:", results[SimulationEpisode.FINISHED], \
+            "finished in", round(results["seconds"], 3), "s"
+        return results
+    
+    def spread(self, theCounts, theStates, theAgentCount, theRandom, theResults):
+        '''Adds theAgentCount agents to theCounts of theStates, splitting them at random if there is more than one state
+        
+        Each agent is equally likely to go to any of the states, as if each chose at random, but the agents are split
+        with one binomial draw per state: of the agents left, each state takes its share of the states left'''
+        
+        if len(theStates) == 1:
+            theCounts[theStates[0]] += theAgentCount
+            return
+        
+        theResults["ambiguities"] += theAgentCount
+        remaining = theAgentCount
+        for i in range(len(theStates) - 1):
+            count = self.returnBinomial(remaining, 1.0 / (len(theStates) - i), theRandom)
+            theCounts[theStates[i]] += count
+            remaining -= count
+        theCounts[theStates[-1]] += remaining
+    
+    def returnBinomial(self, theTrials, theProbability, theRandom):
+        '''Returns a random number of successes out of theTrials, each with theProbability of success
+        
+        Small expected counts (up to 30) are drawn exactly, by inverting the binomial distribution,
+        and larger ones from the normal approximation, so a draw does not cost more as theTrials grows'''
+        
+        if theProbability > 0.5:
+            return theTrials - self.returnBinomial(theTrials, 1.0 - theProbability, theRandom)
+        
+        mean = theTrials * theProbability
+        if mean > 30:
+            deviation = (mean * (1.0 - theProbability)) ** 0.5
+            return min(max(int(round(theRandom.gauss(mean, deviation))), 0), theTrials)
+        
+        ## Walk up the probabilities of 0, 1, 2... successes until they add up to more than a uniform random number
+        ratio = theProbability / (1.0 - theProbability)
+        probability = (1.0 - theProbability) ** theTrials
+        u = theRandom.random()
+        successes = 0
+        while u > probability and successes < theTrials:
+            u -= probability
+            successes += 1
+            probability *= ratio * (theTrials - successes + 1) / successes
+        return successes
+
+#####
+## Sweeping model variants
+#####
+
+class SweepTask(Callable):
+    '''Simulates one variant of a model for a SweepRunner, on one of the threads of its pool'''
+    
+    ## The seed of the episode traced for each Planning Unit (see returnTrace); the same for every variant,
+    ## so that variants that fire the same productions in the same order have the same trace
+    TRACE_SEED = 0
+    
+    def __init__(self, theModel, theLabel, theUnitTaskOrders, theMethodOrders, theEpisodes, theSeed):
+        '''Initializes the SweepTask
+        
+        theModel should be the SGOMS_Model the variant is made from
+        theLabel should be a string naming the variant
+        theUnitTaskOrders and theMethodOrders describe the variant (see SGOMS_Model.lowerVariant)
+        theEpisodes should be the number of episodes to simulate for each Planning Unit
+        theSeed should be the seed for choosing between ambiguous chunks'''
+        
+        self.model = theModel
+        self.label = theLabel
+        self.unitTaskOrders = theUnitTaskOrders
+        self.methodOrders = theMethodOrders
+        self.episodes = theEpisodes
+        self.seed = theSeed
+        
+    def call(self):
+        '''Simulates the variant, and returns (label, results from SGOMSSimulator.runEpisodes, the simulator's SimulatedDM)'''
+        
+        simulator = SGOMSSimulator(self.model, self.model.lowerVariant(self.unitTaskOrders, self.methodOrders))
+        results = simulator.runEpisodes(self.episodes, None, self.seed)
+        
+        ## The order of the Methods does not change the counts (only the order the productions fire in), 
+        ## so one episode of each Planning Unit is run again, recording its productions
+        for planningUnit in results.keys():
+            results[planningUnit]["trace"] = self.returnTrace(simulator, planningUnit)
+        
+        return (self.label, results, simulator.dm)
+    
+    def returnTrace(self, theSimulator, thePlanningUnitID):
+        '''Returns a short hash of the productions fired, in order, in one episode of the Planning Unit thePlanningUnitID'''
+        
+        episode = theSimulator.run(thePlanningUnitID, random.Random(SweepTask.TRACE_SEED))
+        productions = [event[0] for event in episode.events]
+        return hashlib.md5(" ".join(productions)).hexdigest()[:12]
+
+
+class SweepRunner:
+    '''Simulates every variant of a model described by a parameter grid, on a pool of threads, 
+    and writes the statistics of each variant to a CSV results file as soon as it is finished
+    
+    The parameter grid is a dictionary (or a JSON file) of alternative orders, e.g.:
+        {"unitTaskOrders": {"prep_wrap": [["veggies", "sauce", "finished"], ["sauce", "veggies", "finished"]]},
+         "methodOrders": {"veggies": [["get_veggies", "wash"], ["wash", "get_veggies"]]}}
+    Every combination of the alternatives is a variant (four in the example); see SGOMS_Model.lowerVariant.
+    The method orders only change the order the productions fire in, not the counts, so each row also has a trace:
+    a hash of the productions fired in one episode of the Planning Unit (see SweepTask.returnTrace).
+    
+    The variants run on a java.util.concurrent thread pool with a thread for each processor
+    (Jython threads run Python code in parallel, so a process pool is not needed to use every core).
+    The model is lowered once; each variant only copies the parts of the IR that it changes.'''
+    
+    COLUMNS = ["variant", "planning_unit", "episodes", "finished", "retrieval_failure", "step_limit", 
+               "completion_rate", "mean_unit_tasks", "ambiguities", "seconds", "trace"]
+    
+    def __init__(self, theGraph, theGrid, theEpisodes=1000, theSeed=0, theThreads=None):
+        '''Initializes the SweepRunner
+        
+        theGraph should be a Graph (e.g. loaded with Graph.loadFrom)
+        theGrid should be a parameter grid dictionary (see above)
+        theEpisodes should be the number of episodes to simulate for each Planning Unit of each variant
+        theSeed should be an integer; each variant is seeded with theSeed plus its number, so that sweeps can be repeated
+        theThreads is the number of threads in the pool (by default, the number of processors)'''
+        
+        self.graph = theGraph
+        self.grid = theGrid
+        self.episodes = theEpisodes
+        self.seed = theSeed
+        
+        if theThreads == None:
+            theThreads = Runtime.getRuntime().availableProcessors()
+        self.threads = theThreads
+        
+    def returnVariants(self):
+        '''Returns a list of (label, unit task orders, method orders) for every combination of alternatives in the grid'''
+        
+        ## Each axis is one unit that has alternatives: (which orders the unit's alternatives go in, unit ID, its alternatives)
+        axes = []
+        for orderName in ["unitTaskOrders", "methodOrders"]:
+            alternatives = self.grid.get(orderName, {})
+            for unitID in sorted(alternatives.keys()):
+                axes.append((orderName, unitID, alternatives[unitID]))
+        
+        variants = []
+        for combination in itertools.product(*[axis[2] for axis in axes]):
+            orders = {"unitTaskOrders": {}, "methodOrders": {}}
+            labels = []
+            for (orderName, unitID, alternatives), order in zip(axes, combination):
+                orders[orderName][unitID] = order
+                labels.append(unitID + "=" + ">".join(order))
+            
+            label = "; ".join(labels)
+            if label == "":
+                label = "model"
+            variants.append((label, orders["unitTaskOrders"], orders["methodOrders"]))
+            
+        return variants
+    
+    def run(self, theFileName):
+        '''Simulates every variant, writing one row per variant and Planning Unit to the CSV file theFileName
+        Rows are written as the variants finish, so they are not in variant order
+        Returns the number of variants simulated'''
+        
+        variants = self.returnVariants()
+        model = self.graph.sGOMS
+        model.lowerToIR()   ## Lower once here, rather than in every thread
+        
+        print "(SweepRunner.run)", len(variants), "variants,", self.episodes, "episodes each, on", self.threads, "threads"
+        startTime = time.time()
+        
+        pool = Executors.newFixedThreadPool(self.threads)
+        try:
+            completion = ExecutorCompletionService(pool)
+            for i in range(len(variants)):
+                label, unitTaskOrders, methodOrders = variants[i]
+                completion.submit(SweepTask(model, label, unitTaskOrders, methodOrders, self.episodes, self.seed + i))
+            
+            f = open(theFileName, "wb")     ## Binary, so that csv does not double the line endings on Windows
+            try:
+                writer = csv.writer(f)
+                writer.writerow(self.COLUMNS)
+                
+                for i in range(len(variants)):
+                    label, results, dm = completion.take().get()
+                    for planningUnit in sorted(results.keys()):
+                        writer.writerow(self.returnRow(label, planningUnit, results[planningUnit]))
+                    f.flush()   ## Stream the results, so a long sweep can be watched (or used if it is stopped)
+            finally:
+                f.close()
+        finally:
+            ## The pool's threads would keep the JVM running; if a variant failed, the variants still queued are cancelled
+            pool.shutdownNow()
+        
+        print "(SweepRunner.run) sweep completed in", round(time.time() - startTime, 3), "s; results written to", theFileName
+        return len(variants)
+    
+    def returnRow(self, theLabel, thePlanningUnit, theCounts):
+        '''Returns the CSV row for the results of one Planning Unit of one variant (see SweepRunner.COLUMNS)'''
+        
+        episodes = self.episodes
+        return [theLabel, thePlanningUnit, episodes, 
+                theCounts[SimulationEpisode.FINISHED], theCounts[SimulationEpisode.RETRIEVAL_FAILURE],
+                theCounts[SimulationEpisode.STEP_LIMIT], 
+                round(float(theCounts[SimulationEpisode.FINISHED]) / episodes, 4),
+                round(float(theCounts["unitTasks"]) / episodes, 4),
+                theCounts["ambiguities"], round(theCounts["seconds"], 4), theCounts["trace"]]
+    
+    def runFromFiles(theGraphFileName, theGridFileName, theResultsFileName, theEpisodes=1000):
+        '''Loads a saved Graph and a JSON parameter grid, and runs a sweep over them (used by the --sweep option)'''
+        
+        graph = Graph().loadFrom(theGraphFileName)
+        
+        f = open(theGridFileName, "r")
+        grid = json.load(f)
+        f.close()
+        
+        return SweepRunner(graph, grid, theEpisodes).run(theResultsFileName)
+    runFromFiles = staticmethod(runFromFiles)
+
+#####
+## Benchmarking the editor and compiler
+#####
+
+class NullOutput:
+    '''A file-like object that throws away everything written to it
+    Used in place of sys.stdout while timing operations, so that their console output is not timed'''
+    
+    def write(self, theText):
+        '''Discards theText'''
+        
+        pass
+    
+    def flush(self):
+        '''Does nothing'''
+        
+        pass
+
+
+class GraphBenchmark:
+    '''Times the main operations of the editor and compiler on synthesized models of several sizes,
+    and writes the timings to a CSV or JSON results file, so that the timings of different versions can be compared
+    
+    Each shape is a list of [planning units, unit tasks per planning unit, methods per unit task, operators per method]
+    (every planning unit also ends with a 'finished' unit task); e.g. [200, 20, 4, 5] is about 100,000 nodes.
+    The graph of each shape is built with an SGOMSModelBuilder, then each operation is timed theRepeats times.
+    The console output of the operations is thrown away while they are timed (see NullOutput).
+    
+    Usage: GraphBenchmark([[10, 10, 3, 3]], 3).run("benchmark.csv")
+    or from the command line: jython SGOMS_GUI_1.5.py --benchmark <results .csv or .json file> [repeats]'''
+    
+    DEFAULT_SHAPES = [[1, 5, 2, 2], [10, 10, 3, 3], [40, 20, 4, 4], [200, 20, 4, 5]]
+    
+    ## The operations that are timed, in order (saveAs must come before loadFrom, which loads the saved file)
+    OPERATIONS = ["build", "update", "nodeAt", "returnEdges", "outputToACTR", "saveAs", "loadFrom"]
+    
+    COLUMNS = ["operation", "planning_units", "unit_tasks", "methods", "operators", "nodes", "edges",
+               "calls", "best_seconds", "mean_seconds"]
+    
+    NODE_AT_CALLS = 100     ## The number of random points nodeAt is called with in each repeat
+    
+    def __init__(self, theShapes=None, theRepeats=3, theDirectory=None, theOperations=None):
+        '''Initializes the GraphBenchmark
+        
+        theShapes should be a list of shapes (see above), by default GraphBenchmark.DEFAULT_SHAPES
+        theRepeats should be the number of times each operation is timed
+        theDirectory should be the directory the ACT-R and saved model files are written to (by default the temp directory)
+        theOperations should be a list of the OPERATIONS to time (by default, all of them)'''
+        
+        self.shapes = theShapes
+        if theShapes == None:
+            self.shapes = GraphBenchmark.DEFAULT_SHAPES
+        
+        self.repeats = max(1, theRepeats)
+        
+        self.directory = theDirectory
+        if theDirectory == None:
+            self.directory = tempfile.gettempdir()
+            
+        self.operations = theOperations
+        if theOperations == None:
+            self.operations = GraphBenchmark.OPERATIONS
+        
+    def queueGraph(self, theShape):
+        '''Returns an SGOMSModelBuilder with a model of theShape queued (see SGOMSModelBuilder.build)'''
+        
+        planningUnits, unitTasks, methods, operators = theShape
+        builder = SGOMSModelBuilder()
+        
+        for p in range(planningUnits):
+            puID = "pu" + str(p)
+            pu = builder.planningUnit(puID, ["b_context='planning_unit:" + puID + "'"], 
+                                      ["b_plan_unit.set('planning_unit:" + puID + " cuelag:none cue:start unit_task:" 
+                                       + puID + "_ut0 state:running')"])
+            for u in range(unitTasks):
+                utID = puID + "_ut" + str(u)
+                ut = builder.unitTask(pu, utID, ["b_unit_task='unit_task:" + utID + " state:start'"], 
+                                      ["b_unit_task.set('unit_task:" + utID + " state:running')"])
+                for m in range(methods):
+                    method = builder.method(ut, utID + "_m" + str(m))
+                    for o in range(operators):
+                        builder.operator(method, utID + "_m" + str(m) + "_o" + str(o))
+            builder.unitTask(pu, "finished")
+            
+        return builder
+    
+    def timeCalls(self, theFunction, theArguments, theRepeats=None):
+        '''Calls theFunction(*arguments) for each arguments in theArguments, theRepeats times over (self.repeats by default)
+        Returns (a list of the seconds taken by each repeat, the result of the last call)
+        
+        theArguments should be a list of argument tuples (one call is made per tuple in each repeat)'''
+        
+        if theRepeats == None:
+            theRepeats = self.repeats
+        
+        timings = []
+        result = None
+        
+        console = sys.stdout
+        sys.stdout = NullOutput()
+        try:
+            for repeat in range(theRepeats):
+                startTime = time.time()
+                for arguments in theArguments:
+                    result = theFunction(*arguments)
+                timings.append(time.time() - startTime)
+        finally:
+            sys.stdout = console
+            
+        return timings, result
+    
+    def runShape(self, theShape):
+        '''Times every operation on a model of theShape
+        Returns a list of result rows (see GraphBenchmark.COLUMNS)'''
+        
+        label = "x".join([str(size) for size in theShape])
+        actrFile = os.path.join(self.directory, "sgoms_benchmark_" + label + ".py")
+        saveFile = os.path.join(self.directory, "sgoms_benchmark_" + label + ".ser")
+        
+        ## Building is timed on a new builder each repeat (a builder can only build once);
+        ## the graph of the last repeat is used for everything else
+        repeats = 1
+        if "build" in self.operations:
+            repeats = self.repeats
+        
+        console = sys.stdout
+        sys.stdout = NullOutput()
+        try:
+            builders = [self.queueGraph(theShape) for repeat in range(repeats)]
+        finally:
+            sys.stdout = console
+        
+        graph = None
+        buildTimings = []
+        for builder in builders:
+            timings, graph = self.timeCalls(builder.build, [()], 1)
+            buildTimings.append(timings[0])
+        
+        nodes = len(graph.nodes)
+        edges = len(graph.returnEdges())
+        print "(GraphBenchmark.runShape) shape", label, "has", nodes, "nodes and", edges, "edges"
+        
+        ## The random points nodeAt is called with, spread over the area the builder lays the nodes out in
+        width = 80 + (theShape[0] + 1) * SGOMSModelBuilder.COLUMN_WIDTH
+        height = 40 + (theShape[1] * (1 + theShape[2] * (1 + theShape[3])) + 2) * SGOMSModelBuilder.ROW_HEIGHT
+        randomPoints = random.Random(0)
+        points = [(Point(randomPoints.randint(0, width), randomPoints.randint(0, height)),) 
+                  for i in range(GraphBenchmark.NODE_AT_CALLS)]
+        
+        calls = {"build": (None, [()]),
+                 "update": (self.updateAfterEdit, [(graph,)]),
+                 "nodeAt": (graph.nodeAt, points),
+                 "returnEdges": (graph.returnEdges, [()]),
+                 "outputToACTR": (graph.sGOMS.outputToACTR, [(actrFile,)]),
+                 "saveAs": (graph.saveAs, [(saveFile,)]),
+                 "loadFrom": (graph.loadFrom, [(saveFile,)])}     ## (loadFrom returns a new Graph)
+        
+        rows = []
+        for operation in self.operations:
+            function, arguments = calls[operation]
+            if operation == "build":
+                timings = buildTimings
+            else:
+                timings, result = self.timeCalls(function, arguments)
+            
+            rows.append([operation] + list(theShape) + [nodes, edges, len(arguments),
+                        round(min(timings), 6), round(sum(timings) / len(timings), 6)])
+            print "(GraphBenchmark.runShape)", operation, "best", round(min(timings), 4), "s"
+            
+        return rows
+    
+    def updateAfterEdit(self, theGraph):
+        '''Updates theGraph as the editor does after an edit (the "update" operation):
+        the GraphIndex (and with it the QueryCache) and the ComponentIndex are rebuilt, as after deleting an edge,
+        rather than timing an update of an unchanged graph, whose indexes and cached answers are all still valid'''
+        
+        theGraph.invalidateIndex()
+        theGraph.splitComponents()
+        theGraph.update()
+    
+    def run(self, theFileName):
+        '''Times every operation on every shape, and writes the results to theFileName
+        The file is written as JSON if theFileName ends in .json, as CSV otherwise
+        Returns the list of result rows (see GraphBenchmark.COLUMNS)'''
+        
+        print "(GraphBenchmark.run)", len(self.shapes), "shapes,", self.repeats, "repeats of", ", ".join(self.operations)
+        
+        rows = []
+        for shape in self.shapes:
+            rows += self.runShape(shape)
+        
+        f = open(theFileName, "w")
+        if theFileName.lower().endswith(".json"):
+            ## The JSON file also records when and where it was run, to compare results between releases
+            json.dump({"date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": sys.version, "platform": sys.platform,
+                       "repeats": self.repeats, 
+                       "results": [dict(zip(GraphBenchmark.COLUMNS, row)) for row in rows]}, f, indent=2)
+        else:
+            writer = csv.writer(f)
+            writer.writerow(GraphBenchmark.COLUMNS)
+            writer.writerows(rows)
+        f.close()
+        
+        print "(GraphBenchmark.run) results written to", theFileName
+        return rows
+
+
+#####
+## Profiling the editor
+#####
+
+class PerformanceMonitor:
+    '''Records how long the hot paths of the editor take while it is being used, so that it can be seen where the time goes
+    when the editor stalls (Graph.update, printModelContentsAdvanced, the mouse and key handlers, and painting)
+    
+    Each timed call is stored as a sample of (time, operation, milliseconds, counters), in a ring of the last
+    self.samples.maxlen samples; the counters are how much each count() counter went up during the call,
+    e.g. the nodes visited by the GraphIndex searches ("node_visits") during a Graph.update, 
+    or the nodes drawn ("nodes_drawn") while painting a frame.
+    
+    The editor uses the module's monitor (PerformanceMonitor.monitor):
+        startTime = PerformanceMonitor.monitor.start()
+        ...
+        PerformanceMonitor.monitor.stop("Graph.update", startTime)
+    View -> Performance Overlay draws a summary of the samples on the canvas (drawOverlay),
+    and View -> Export Performance Samples writes them to a CSV file (exportCSV).'''
+    
+    SAMPLES = 500       ## The number of samples kept by default
+    
+    monitor = None      ## The PerformanceMonitor used by the editor (set below the class)
+    
+    def __init__(self, theSamples=None):
+        '''Initializes the PerformanceMonitor
+        
+        theSamples should be the number of samples to keep (PerformanceMonitor.SAMPLES by default)'''
+        
+        if theSamples == None:
+            theSamples = PerformanceMonitor.SAMPLES
+            
+        self.enabled = True     ## When False, start, stop and count do nothing
+        self.overlay = False    ## Whether the editor draws the overlay (toggled by View -> Performance Overlay)
+        self.samples = deque([], theSamples)
+        self.counters = {}      ## counter name -> the total counted since the monitor was made
+        
+    def start(self):
+        '''Returns the start of a timed call, to be passed to stop() when the call finishes (None if the monitor is disabled)'''
+        
+        if self.enabled == False:
+            return None
+        return (time.time(), self.counters.copy())
+    
+    def stop(self, theOperation, theStart):
+        '''Records a sample for theOperation, which began at theStart (returned by start())
+        Returns the milliseconds it took (or None if the monitor is disabled)'''
+        
+        if theStart == None:
+            return None
+        
+        startTime, startCounters = theStart
+        milliseconds = (time.time() - startTime) * 1000.0
+        
+        counted = {}
+        for name, total in self.counters.items():
+            if total != startCounters.get(name, 0):
+                counted[name] = total - startCounters.get(name, 0)
+        
+        self.samples.append((startTime, theOperation, milliseconds, counted))
+        return milliseconds
+    
+    def count(self, theName, theAmount=1):
+        '''Adds theAmount to the counter theName'''
+        
+        if self.enabled:
+            self.counters[theName] = self.counters.get(theName, 0) + theAmount
+            
+    def clear(self):
+        '''Discards the samples and counters'''
+        
+        self.samples.clear()
+        self.counters = {}
+        
+    def returnSummary(self):
+        '''Returns a list of [operation, calls, mean milliseconds, slowest milliseconds, last milliseconds, last counters]
+        for each operation in the samples, slowest mean first'''
+        
+        summary = {}
+        for startTime, operation, milliseconds, counted in self.samples:
+            if operation not in summary:
+                summary[operation] = [operation, 0, 0.0, 0.0, 0.0, {}]
+            row = summary[operation]
+            row[1] += 1
+            row[2] += milliseconds
+            row[3] = max(row[3], milliseconds)
+            row[4] = milliseconds
+            row[5] = counted
+        
+        rows = summary.values()
+        for row in rows:
+            row[2] = row[2] / row[1]
+        rows.sort(key=lambda row: -row[2])
+        return rows
+    
+    def returnCounterNames(self):
+        '''Returns the sorted names of every counter in the samples'''
+        
+        names = {}
+        for sample in self.samples:
+            for name in sample[3]:
+                names[name] = True
+        return sorted(names.keys())
+    
+    def exportCSV(self, theFileName):
+        '''Writes the samples to theFileName as CSV, one row per sample (oldest first)
+        with the columns time, operation, milliseconds, and one column per counter
+        Returns the number of samples written, or False if the file could not be written'''
+        
+        print "(PerformanceMonitor.exportCSV) writing", len(self.samples), "samples to", theFileName
+        
+        names = self.returnCounterNames()
+        
+        try:
+            outFile = open(theFileName, "wb")
+        except IOError, e:
+            print "XXX (PerformanceMonitor.exportCSV) could not write", theFileName, ":", e, "XXX"
+            return False
+        
+        try:
+            writer = csv.writer(outFile)
+            writer.writerow(["time", "operation", "milliseconds"] + names)
+            for startTime, operation, milliseconds, counted in self.samples:
+                writer.writerow(["%.3f" % startTime, operation, "%.3f" % milliseconds] 
+                                + [counted.get(name, 0) for name in names])
+        finally:
+            outFile.close()
+        
+        return len(self.samples)
+    
+    def drawOverlay(self, aPen, x=10, y=10):
+        '''Draws a table of the mean, slowest and last milliseconds of each operation, 
+        and the counters of its last call, with its top left corner at (x, y)
+        
+        aPen should be a Graphics object'''
+        
+        rows = self.returnSummary()
+        lines = ["Performance (last " + str(len(self.samples)) + " samples):"]
+        for operation, calls, mean, slowest, last, counted in rows:
+            line = "%s: %d calls, mean %.1f ms, slowest %.1f ms, last %.1f ms" % (operation, calls, mean, slowest, last)
+            for name in sorted(counted.keys()):
+                line += ", " + name + " " + str(counted[name])
+            lines.append(line)
+        
+        lineHeight = 15
+        aPen.setColor(Color.white)
+        aPen.fillRect(x, y, 560, lineHeight * len(lines) + 6)
+        aPen.setColor(Color.gray)
+        aPen.drawRect(x, y, 560, lineHeight * len(lines) + 6)
+        aPen.setColor(Color.black)
+        for i in range(len(lines)):
+            aPen.drawString(lines[i], x + 5, y + lineHeight * (i + 1))
+
+
+PerformanceMonitor.monitor = PerformanceMonitor()
+
+
+#####
+## Generating synthetic models
+#####
+
+class SGOMSModelGenerator:
+    '''Generates random SGOMS models of any size, for load-testing the editor and compiler, and writes them to a file
+    
+    Each Planning Unit has a chain of Unit Tasks ending in 'finished' (chained with cue and cuelag in DM, like the
+    chains drawn in the editor), each Unit Task a chain of Methods, and each Method a chain of Operators.
+    The firing conditions and behaviours pass control down and along the chains, the way a hand-written model does.
+    Some of the Unit Tasks are taken from a small library of shared Unit Tasks (with their Methods and Operators),
+    which turn up in many Planning Units, like slave nodes.
+    
+    Every Planning Unit is generated from its own seed, so the model can be generated again, one Planning Unit at a time,
+    for each section of a file. These formats are streamed that way, so a model of any size can be written 
+    without holding it in memory:
+        "sgoms"     the SGOMSModelBuilder text format (see SGOMSModelBuilder.parse)
+        "ccmsuite"  Python ACT-R, the same as File -> Export To ACT-R would write for the model
+        "json"      the JSON IR (see SGOMS_IR.toDictionary)
+    "graph" (a saved Graph, the editor's own file format) and the other registered emitters (e.g. "lisp") 
+    build the whole model with an SGOMSModelBuilder first, with the shared Unit Tasks as slave nodes.
+    
+    Usage: SGOMSModelGenerator(1000, theSeed=1).generate("big_model.py", "ccmsuite")
+    or from the command line: jython SGOMS_GUI_1.5.py --generate <file> <format> [planning units] [seed]'''
+    
+    STREAMED_FORMATS = ["sgoms", "ccmsuite", "json"]
+    
+    ## The buffers the generated productions use, in the order SGOMS_IR declares them (the memory buffer last)
+    BUFFERS = ["b_context", "b_plan_unit", "b_unit_task", "b_method", "b_operator", "b_DM"]
+    
+    def __init__(self, thePlanningUnits=100, theUnitTasks=None, theMethods=None, theOperators=None,
+                 theSharedFraction=0.2, theSharedUnitTasks=10, theSeed=0):
+        '''Initializes the SGOMSModelGenerator
+        
+        thePlanningUnits should be the number of Planning Units
+        theUnitTasks, theMethods and theOperators should be [minimum, maximum] numbers of Unit Tasks per Planning Unit 
+            (not counting 'finished'), Methods per Unit Task, and Operators per Method; by default [3, 10], [1, 4], [1, 6]
+        theSharedFraction should be the chance (0 to 1) that a Unit Task is taken from the library of shared Unit Tasks
+        theSharedUnitTasks should be the number of Unit Tasks in that library
+        theSeed should be an integer; the same seed and sizes always generate the same model'''
+        
+        self.planningUnits = thePlanningUnits
+        
+        self.unitTasks = theUnitTasks
+        if theUnitTasks == None:
+            self.unitTasks = [3, 10]
+        self.methods = theMethods
+        if theMethods == None:
+            self.methods = [1, 4]
+        self.operators = theOperators
+        if theOperators == None:
+            self.operators = [1, 6]
+        
+        self.sharedFraction = theSharedFraction
+        self.seed = theSeed
+        
+        ## The library of shared Unit Tasks (small, so it is kept in memory), and their IDs
+        libraryRandom = random.Random(theSeed)
+        self.library = []
+        self.sharedIDs = {}
+        for i in range(theSharedUnitTasks):
+            unitTask = self.returnUnitTask(libraryRandom, "shared_ut" + str(i))
+            self.library.append(unitTask)
+            self.sharedIDs[unitTask[0]] = True
+            
+    def returnPlanningUnit(self, theNumber):
+        '''Returns Planning Unit number theNumber, as [ID, firing conditions, behaviours, Unit Tasks]
+        Each Unit Task is [ID, firing conditions, behaviours, Methods], each Method is [ID, firing conditions, behaviours,
+        Operators], and each Operator is [ID, firing conditions, behaviours]; the last Unit Task is always 'finished'
+        
+        The same number always returns the same Planning Unit (shared Unit Tasks are the same lists as in self.library)'''
+        
+        unitRandom = random.Random(self.seed * 1000003 + theNumber + 1)
+        puID = "pu" + str(theNumber)
+        
+        unitTasks = []
+        used = {}       ## A shared Unit Task is only used once in each Planning Unit, so that its chunks are not ambiguous
+        for u in range(unitRandom.randint(self.unitTasks[0], self.unitTasks[1])):
+            if len(self.library) > 0 and unitRandom.random() < self.sharedFraction:
+                unitTask = unitRandom.choice(self.library)
+                if not used.has_key(unitTask[0]):
+                    used[unitTask[0]] = True
+                    unitTasks.append(unitTask)
+                    continue
+            unitTasks.append(self.returnUnitTask(unitRandom, puID + "_ut" + str(u)))
+        unitTasks.append(["finished", [], [], []])
+        
+        return [puID, ["b_context='planning_unit:" + puID + "'"],
+                ["b_plan_unit.set('planning_unit:" + puID + " cuelag:none cue:start unit_task:" + unitTasks[0][0] + 
+                 " state:running')", "b_unit_task.set('unit_task:" + unitTasks[0][0] + " state:start')"], 
+                unitTasks]
+    
+    def returnUnitTask(self, theRandom, theID):
+        '''Returns a random Unit Task called theID, with its Methods and Operators (see returnPlanningUnit)'''
+        
+        methodIDs = [theID + "_m" + str(m) for m in range(theRandom.randint(self.methods[0], self.methods[1]))]
+        
+        methods = []
+        for m in range(len(methodIDs)):
+            operatorIDs = [methodIDs[m] + "_o" + str(o) for o in range(theRandom.randint(self.operators[0], self.operators[1]))]
+            
+            operators = []
+            for o in range(len(operatorIDs)):
+                ## Each Operator starts the next one; the last starts the next Method, or finishes the Unit Task
+                if o + 1 < len(operatorIDs):
+                    nextBehaviour = "b_operator.set('operator:" + operatorIDs[o + 1] + " state:start')"
+                elif m + 1 < len(methodIDs):
+                    nextBehaviour = "b_method.set('method:" + methodIDs[m + 1] + " state:start')"
+                else:
+                    nextBehaviour = "b_unit_task.set('unit_task:" + theID + " state:finished')"
+                operators.append([operatorIDs[o], ["b_operator='operator:" + operatorIDs[o] + " state:start'"], [nextBehaviour]])
+            
+            behaviours = ["b_method.set('method:" + methodIDs[m] + " state:running')"]
+            if len(operators) > 0:
+                behaviours.append("b_operator.set('operator:" + operatorIDs[0] + " state:start')")
+            methods.append([methodIDs[m], ["b_method='method:" + methodIDs[m] + " state:start'"], behaviours, operators])
+        
+        behaviours = ["b_unit_task.set('unit_task:" + theID + " state:running')"]
+        if len(methods) > 0:
+            behaviours.append("b_method.set('method:" + methodIDs[0] + " state:start')")
+        return [theID, ["b_unit_task='unit_task:" + theID + " state:start'"], behaviours, methods]
+    
+    def returnInitialBehaviour(self):
+        '''Returns the initial behaviour of the generated model, which starts the first Planning Unit'''
+        
+        return ["b_context.set('planning_unit:pu0')"]
+    
+    def returnChunkStrings(self, thePlanningUnit):
+        '''Returns the DM chunks of thePlanningUnit's chain of Unit Tasks, in order (see UTNode.updateRelation)'''
+        
+        chunkStrings = []
+        cuelag = 'none'
+        cue = 'start'
+        for unitTask in thePlanningUnit[3]:
+            chunkStrings.append('planning_unit:' + thePlanningUnit[0] + ' cuelag:' + cuelag + ' cue:' + cue + 
+                                ' unit_task:' + unitTask[0])
+            cuelag = cue
+            cue = unitTask[0]
+        return chunkStrings
+    
+    def returnUnits(self, theKind, theWritten):
+        '''Yields the units of theKind ("PlanningUnit", "UnitTask", "Method", or "Operator") in the order SGOMS_IR lists them
+        (Planning Unit by Planning Unit, down each chain), generating one Planning Unit at a time
+        A unit is only yielded the first time its ID turns up, so shared units and 'finished' are yielded once
+        
+        theWritten should be a dictionary for keeping track of the shared IDs yielded so far (it stays small, 
+            since only 'finished' and the units of the shared library can turn up twice)'''
+        
+        for p in range(self.planningUnits):
+            planningUnit = self.returnPlanningUnit(p)
+            if theKind == "PlanningUnit":
+                yield planningUnit
+                continue
+            
+            for unitTask in planningUnit[3]:
+                if self.sharedIDs.has_key(unitTask[0]) or unitTask[0] == "finished":
+                    if theWritten.has_key(unitTask[0]):
+                        continue
+                    theWritten[unitTask[0]] = True
+                    
+                if theKind == "UnitTask":
+                    yield unitTask
+                    continue
+                for method in unitTask[3]:
+                    if theKind == "Method":
+                        yield method
+                        continue
+                    for operator in method[3]:
+                        yield operator
+    
+    def generate(self, theFileName, theFormat="ccmsuite"):
+        '''Generates the model and writes it to theFileName in theFormat (see above)
+        Returns True if the file was written, False if theFormat is not known'''
+        
+        print "(SGOMSModelGenerator.generate) writing", self.planningUnits, "planning units to", theFileName, "as", theFormat
+        startTime = time.time()
+        
+        if theFormat in SGOMSModelGenerator.STREAMED_FORMATS:
+            f = open(theFileName, "w")
+            if theFormat == "sgoms":
+                self.writeText(f)
+            elif theFormat == "ccmsuite":
+                self.writeCCMSuite(f)
+            else:
+                self.writeJSON(f)
+            f.close()
+            
+        elif theFormat == "graph":
+            self.build().saveAs(theFileName)
+            
+        elif ModelEmitter.registry.has_key(theFormat):
+            self.build().sGOMS.compileTo(theFormat, theFileName)
+            
+        else:
+            print "XXX (SGOMSModelGenerator.generate) unknown format:", theFormat, "XXX"
+            return False
+        
+        print "(SGOMSModelGenerator.generate) written in", round(time.time() - startTime, 3), "s"
+        return True
+    
+    def writeText(self, f):
+        '''Writes the model to the file f in the SGOMSModelBuilder text format'''
+        
+        for behaviour in self.returnInitialBehaviour():
+            f.write("init: " + behaviour + "\n")
+        
+        for p in range(self.planningUnits):
+            self.writeTextUnit(f, "PU", self.returnPlanningUnit(p), 0)
+    
+    def writeTextUnit(self, f, theKeyword, theUnit, theIndent):
+        '''Writes theUnit and the units under it to the file f in the SGOMSModelBuilder text format'''
+        
+        indent = "    " * theIndent
+        f.write(indent + theKeyword + " " + theUnit[0] + "\n")
+        for firingCondition in theUnit[1]:
+            f.write(indent + "    if: " + firingCondition + "\n")
+        for behaviour in theUnit[2]:
+            f.write(indent + "    do: " + behaviour + "\n")
+        
+        if len(theUnit) > 3:
+            childKeyword = {"PU": "UT", "UT": "M", "M": "O"}[theKeyword]
+            for child in theUnit[3]:
+                self.writeTextUnit(f, childKeyword, child, theIndent + 1)
+    
+    def writeCCMSuite(self, f):
+        '''Writes the model to the file f as Python ACT-R, the way CCMSuiteEmitter.emit() writes an SGOMS_IR
+        (the model is generated once for the chunks, and once for each kind of production)'''
+        
+        emitter = CCMSuiteEmitter()
+        emitter.emitHeader(f)
+        emitter.emitAgentHeader(f, "MyAgent", "ACTR", SGOMSModelGenerator.BUFFERS, "b_DM", [])
+        
+        for p in range(self.planningUnits):
+            for chunkString in self.returnChunkStrings(self.returnPlanningUnit(p)):
+                emitter.emitChunk(f, chunkString)
+        emitter.emitInitialBehaviour(f, self.returnInitialBehaviour())
+        
+        for kind, comment, unitName in CCMSuiteEmitter.SECTIONS:
+            f.write(comment)
+            for unit in self.returnUnits(kind, {}):
+                emitter.emitProduction(f, unit[0], unit[1], unit[2], unitName)
+        
+        emitter.emitGlobalProductions(f)
+        
+        f.write("## Code to run the model\n")
+        f.write("tim = MyAgent()\n")
+        f.write("env = MyEnvironment()\n")
+        f.write("env.agent = tim\n")
+        f.write("ccm.log_everything(env)\n\n")
+        f.write("env.run()\n")
+        f.write("ccm.finished()\n")
+    
+    def writeJSON(self, f):
+        '''Writes the model to the file f as the JSON IR (the keys of SGOMS_IR.toDictionary, in sorted order)'''
+        
+        f.write('{\n  "buffers": ' + json.dumps(SGOMSModelGenerator.BUFFERS) + ',\n  "chunks": [')
+        separator = "\n    "
+        for p in range(self.planningUnits):
+            for chunkString in self.returnChunkStrings(self.returnPlanningUnit(p)):
+                slots = dict([slot.split(":", 1) for slot in chunkString.split(" ")])
+                f.write(separator + json.dumps(slots, sort_keys=True))
+                separator = ",\n    "
+        
+        f.write('\n  ],\n  "initialBehaviour": ' + json.dumps(self.returnInitialBehaviour()))
+        f.write(',\n  "memoryBuffer": "b_DM",\n  "memoryParameters": {}')
+        
+        ## The children of each Unit Task and Method, in order
+        for key, parentKind in [("methodsOfUnitTask", "UnitTask"), ("operatorsOfMethod", "Method")]:
+            f.write(',\n  "' + key + '": {')
+            separator = "\n    "
+            for unit in self.returnUnits(parentKind, {}):
+                if len(unit[3]) > 0:
+                    f.write(separator + json.dumps(unit[0]) + ": " + json.dumps([child[0] for child in unit[3]]))
+                    separator = ",\n    "
+            f.write("\n  }")
+        
+        f.write(',\n  "productions": [')
+        separator = "\n    "
+        for kind in SGOMS_IR.KINDS:
+            for unit in self.returnUnits(kind, {}):
+                f.write(separator + json.dumps({"behaviour": unit[2], "firingConditions": unit[1], "kind": kind, 
+                                                "name": unit[0]}, sort_keys=True))
+                separator = ",\n    "
+        
+        f.write('\n  ],\n  "undeclaredBuffers": [],\n  "unusedBuffers": []\n}\n')
+    
+    def build(self, theGraph=None):
+        '''Builds the whole model in a Graph with an SGOMSModelBuilder, and returns the Graph
+        Every use of a shared Unit Task is a slave node: it shares the UnitTask, Methods and Operators of the first use
+        
+        theGraph is optional; a new Graph is created by default'''
+        
+        builder = SGOMSModelBuilder(theGraph)
+        for behaviour in self.returnInitialBehaviour():
+            builder.initialBehaviour(behaviour)
+        
+        sharedUnits = {}    ## ID -> the SGOMS unit, for the units of the shared Unit Tasks (and 'finished')
+        
+        for p in range(self.planningUnits):
+            puID, firingConditions, behaviours, unitTasks = self.returnPlanningUnit(p)
+            pu = builder.planningUnit(puID, firingConditions, behaviours)
+            for unitTask in unitTasks:
+                shared = self.sharedIDs.has_key(unitTask[0]) or unitTask[0] == "finished"
+                ut = self.addUnit(builder, pu, UnitTask, unitTask, shared, sharedUnits)
+                for method in unitTask[3]:
+                    m = self.addUnit(builder, ut, Method, method, shared, sharedUnits)
+                    for operator in method[3]:
+                        self.addUnit(builder, m, Operator, operator, shared, sharedUnits)
+        
+        return builder.build()
+    
+    def addUnit(self, theBuilder, theParent, theClass, theUnit, isShared, theSharedUnits):
+        '''Queues a node for theUnit (an [ID, firing conditions, behaviours, ...] list) under theParent with theBuilder
+        Returns the PendingNode
+        
+        If isShared, the node shares the SGOMS unit in theSharedUnits with the same ID (which is made the first time)'''
         
-        for node in self.nodes:
-            node.updateOrder()
+        if not isShared:
+            return theBuilder.addSGOMSUnit(theParent, theClass(theUnit[0], list(theUnit[1]), list(theUnit[2])))
         
-        for node in self.nodes:
-            node.updateEverythingButOrder()
-            
-        self.sGOMS.printModelContentsAdvanced()
+        if not theSharedUnits.has_key(theUnit[0]):
+            theSharedUnits[theUnit[0]] = theClass(theUnit[0], list(theUnit[1]), list(theUnit[2]))
+        return theBuilder.addSGOMSUnit(theParent, theSharedUnits[theUnit[0]])
+
+
+#####
+## Working on several models at once
+#####
+
+class SGOMSWorkspace:
+    '''The models open in the editor at once (see GraphEditorFrame's Window menu), and the unit library they share
+    
+    The library is a saved model whose units are reused by many models (e.g. a common set of Unit Tasks and Methods).
+    It is loaded once (loadLibrary) into an SGOMSUnitStore that the open models only read from:
+    each unit of a model that has the same content as a library unit (see SGOMSUnitStore.returnKey) is given the 
+    firing condition and behaviour lists of the library unit instead of its own (see SGOMSUnitStore.share), 
+    and the IDs and labels are interned, so the units of every model that uses the library only hold one copy of their text.
+    The shared lists are copy-on-write, as with PlanningUnit.cloneShared(): the dialogs replace them rather than modifying them,
+    so editing a unit in one model leaves the library and the other models untouched.
+    
+    A file that is already open is not loaded again (see open).
+    Sharing saves memory, not load time: each model's file is still read in full, units and all,
+    and its units are only given the library's lists once it has been loaded (see shareUnits)'''
+    
+    def __init__(self):
+        '''Creates an empty SGOMSWorkspace, with an empty library'''
         
-    def draw(self, aPen):
-        '''Draws the graph - i.e. tell all nodes and edges to draw themselves
+        self.graphs = []                    ## The open Graphs, in the order they were opened
+        self.library = SGOMSUnitStore()     ## The units of the library (read-only; see loadLibrary)
+        self.libraryFile = None             ## The file the library was loaded from
+        self.strings = {}                   ## The interned IDs and labels of the units and nodes
         
-        aPen should be a Graphics object'''
+    def __str__(self):
+        '''Returns a string representation of the SGOMSWorkspace'''
         
-        edges = self.returnEdges()
+        return "SGOMSWorkspace with " + str(len(self.graphs)) + " open models, library: " + str(self.libraryFile) + \
+            " (" + str(len(self.library.entries)) + " units, shared " + str(self.library.sharedCount) + " times)"
+    
+    def intern(self, theString):
+        '''Returns the copy of theString kept by the workspace (theString itself the first time)'''
         
-        for edge in edges:  #Draw the edges first
-            edge.draw(aPen)
-            
-        for node in self.nodes: #Draw the nodes second
-            node.draw(aPen)
-            
-    def printGraph(self):
-        '''Prints the graph, including all of the nodes'''
+        return self.strings.setdefault(theString, theString)
         
-        print "@@@@@ Graph.printGraph @@@@@"
-        print self.label, "(", len(self.nodes), ",", len(self.returnEdges()), ")"
-        for node in self.nodes:
-            print node
-            
-        print "@@@@@ Graph.printGraph Completed @@@@@"
+    def add(self, theGraph):
+        '''Adds theGraph to the open models (if it is not already open), sharing the library's units with it
+        Returns theGraph'''
         
-    def save(self):
-        '''Saves the graph to self.saveFile'''
+        if theGraph in self.graphs:
+            return theGraph
         
-        ## This is taken from http://www.onlamp.com/pub/a/python/2002/04/11/jythontips.html?page=2
-        print "(Graph.save) Saving to self.saveFile:", self.saveFile
+        self.graphs.append(theGraph)
+        self.shareUnits(theGraph)
+        print "(SGOMSWorkspace.add)", theGraph.label, "added:", self
+        return theGraph
         
-        if self.saveFile == None:
-            print "XXX (Graph.save) Save not completed - self.saveFile is None XXX"
-            return False
+    def open(self, theFileName):
+        '''Returns the open Graph saved in theFileName, loading it (and adding it to the workspace) if it is not open yet
         
-        else:
-            outFile = io.FileOutputStream(self.saveFile)
-            outStream = io.ObjectOutputStream(outFile)
-            outStream.writeObject(self)
-            outFile.close()
+        theFileName should be a string (a FileName)'''
         
-        print "(Graph.save) Save complete"
-        return True
+        graph = self.returnGraph(theFileName)
+        if graph != None:
+            print "(SGOMSWorkspace.open)", theFileName, "is already open"
+            return graph
         
-    def saveAs(self, theFileName):
-        '''Saves the graph to a selected file passed in by the Java save dialog box
-        Sets self.saveFile to be theFileName
+        graph = Graph().loadFrom(theFileName)
+        graph.saveFile = theFileName    ## The file may have been moved since it was saved
+        return self.add(graph)
         
-        theFileName should be a string (a FileName)
-        '''
+    def close(self, theGraph):
+        '''Removes theGraph from the open models
+        Returns the model to show in its place (the one opened before it, or a new Graph if none are left open)'''
         
-        ## Update the save location for the save function
-        self.saveFile = theFileName
-        print "(Graph.saveAs) theFileName = ", theFileName, " self.saveFile (after updating) =", self.saveFile
+        if not theGraph in self.graphs:
+            print "XXX (SGOMSWorkspace.close)", theGraph.label, "is not open XXX"
+            return theGraph
         
-        ## This is taken from http://www.onlamp.com/pub/a/python/2002/04/11/jythontips.html?page=2
-        print "(Graph.saveAs) Saving to saveFile:", self.saveFile
+        i = self.graphs.index(theGraph)
+        self.graphs.remove(theGraph)
+        if len(self.graphs) == 0:
+            return self.add(Graph())
+        return self.graphs[max(i - 1, 0)]
         
-        if self.saveFile == None:
-            print "XXX (Graph.saveAs) Save not completed - self.saveFile is None XXX"
-            return False
+    def returnGraph(self, theFileName):
+        '''Returns the open Graph that was loaded from or saved to theFileName, or None'''
         
-        else:
-            outFile = io.FileOutputStream(self.saveFile)
-            outStream = io.ObjectOutputStream(outFile)
-            outStream.writeObject(self)
-            outFile.close()
+        for graph in self.graphs:
+            if getattr(graph, "saveFile", None) == theFileName:
+                return graph
+        return None
+    
+    def returnLabel(self, theGraph):
+        '''Returns the name to show for theGraph (in the Window menu and the title): its file name, or its label if unsaved'''
         
-        print "(Graph.saveAs) Save complete"
-        return True
+        saveFile = getattr(theGraph, "saveFile", None)
+        if saveFile == None:
+            return theGraph.label + " " + str(self.graphs.index(theGraph) + 1)
+        return os.path.basename(saveFile)
         
-    def loadFrom(self, theFileName):
-        '''Loads a graph from a selected file
-        sets self.saveFile to be theFileName
+    def loadLibrary(self, theFileName):
+        '''Loads the units of the model saved in theFileName as the library, and shares them with every open model
+        Returns the number of units of the open models that now share a library unit's text
         
         theFileName should be a string (a FileName)'''
         
-        self.saveFile = theFileName
+        libraryGraph = Graph().loadFrom(theFileName)
         
-        print "(Graph.loadFrom) saveFile set; Loading from file:", self.saveFile
+        self.library = SGOMSUnitStore()
+        for unit in SGOMSWorkspace.returnUnits(libraryGraph.sGOMS):
+            unit.ID = self.intern(unit.ID)
+            self.library.intern(unit)
+        self.libraryFile = theFileName
         
-        ## This is taken from http://www.onlamp.com/pub/a/python/2002/04/11/jythontips.html?page=2
-        inFile = io.FileInputStream(self.saveFile)
-        inStream = util.PythonObjectInputStream(inFile) ## Note Python Utilities use; different from standard Java IO
+        shared = 0
+        for graph in self.graphs:
+            shared += self.shareUnits(graph)
         
-        newGraph = inStream.readObject()
-        print "(Graph.loadFrom) Printing graph"
-        newGraph.printGraph()
+        print "(SGOMSWorkspace.loadLibrary)", theFileName, "loaded:", self
+        return shared
         
-        print "(Graph.loadFrom) Returning new graph"
-        return newGraph
+    def shareUnits(self, theGraph):
+        '''Gives the units of theGraph the text of the library units with the same content, and interns their IDs
+        Returns the number of units that share a library unit's text'''
+        
+        shared = 0
+        for unit in SGOMSWorkspace.returnUnits(theGraph.sGOMS):
+            unit.ID = self.intern(unit.ID)
+            if self.library.share(unit):
+                shared += 1
+        for node in theGraph.nodes:
+            node.label = self.intern(node.label)
         
+        theGraph.sGOMS.unitStore = None     ## The model's own store is built again from the shared lists
+        print "(SGOMSWorkspace.shareUnits)", shared, "units of", theGraph.label, "share the library's text"
+        return shared
         
+    def returnUnits(theModel):
+        '''Returns every PlanningUnit, UnitTask, Method, and Operator listed in theModel (an SGOMS_Model)'''
+        
+        return theModel.planningUnitList + theModel.unitTaskList + theModel.methodList + theModel.operatorList
+    
+    returnUnits = staticmethod(returnUnits)
+
+
 #####
 ## The GUI front-end related stuff (the view/controller classes)
 #####
@@ -3274,23 +7669,26 @@ class SGOMSDialog(JDialog):
         ## The first text entry is the name, the next five are the firing conditions, the next five are the behaviours
         self.sGOMSUnit.ID = self.sGOMSDialogPanel.nameEntry.getText()  ## Set the ID
         
-        ## Reset the firingConditions, and repopulate them with what is in the text entries
-        del self.sGOMSUnit.firingConditions[:]        
+        ## Replace the firingConditions with a new list populated by what is in the text entries
+        ## (The old list is not cleared in place, since pasted units may share it; see PlanningUnit.cloneShared())
+        firingConditions = []
         for textEntry in self.sGOMSDialogPanel.firingConditionTextEntries:
             textVar = textEntry.getText()
             if textVar == "":   ## Don't append empty strings to the firing conditions 
                 pass
             else:            
-                self.sGOMSUnit.firingConditions.append(textVar)  ## Add the firing conditions set in the text entries
+                firingConditions.append(textVar)  ## Add the firing conditions set in the text entries
+        self.sGOMSUnit.firingConditions = firingConditions
         
-        ## Reset the behaviours, and repopulate them with what is in the text entries
-        del self.sGOMSUnit.behaviour[:]
+        ## Replace the behaviours with a new list populated by what is in the text entries
+        behaviours = []
         for textEntry in self.sGOMSDialogPanel.behaviourTextEntries:
             textVar = textEntry.getText()
             if textVar == "":   ## Don't append empty strings to the behaviours 
                 pass
             else:            
-                self.sGOMSUnit.behaviour.append(textVar)  ## Add the behaviours set in the text entries
+                behaviours.append(textVar)  ## Add the behaviours set in the text entries
+        self.sGOMSUnit.behaviour = behaviours
         
         self.owner.dialogFinished(self.sGOMSUnit, self.point)
         print "SGOMSDialog disposed"
@@ -3339,23 +7737,26 @@ class SGOMSEditDialog(SGOMSDialog):
         ## The first text entry is the name, the next five are the firing conditions, the next five are the behaviours
         self.sGOMSUnit.ID = self.sGOMSDialogPanel.nameEntry.getText()  ## Set the ID
         
-        ## Reset the firingConditions, and repopulate them with what is in the text entries
-        del self.sGOMSUnit.firingConditions[:]        
+        ## Replace the firingConditions with a new list populated by what is in the text entries
+        ## (The old list is not cleared in place, since pasted units may share it; see PlanningUnit.cloneShared())
+        firingConditions = []
         for textEntry in self.sGOMSDialogPanel.firingConditionTextEntries:
             textVar = textEntry.getText()
             if textVar == "":   ## Don't append empty strings to the firing conditions 
                 pass
             else:            
-                self.sGOMSUnit.firingConditions.append(textVar)  ## Add the firing conditions set in the text entries
+                firingConditions.append(textVar)  ## Add the firing conditions set in the text entries
+        self.sGOMSUnit.firingConditions = firingConditions
         
-        ## Reset the behaviours, and repopulate them with what is in the text entries
-        del self.sGOMSUnit.behaviour[:]
+        ## Replace the behaviours with a new list populated by what is in the text entries
+        behaviours = []
         for textEntry in self.sGOMSDialogPanel.behaviourTextEntries:
             textVar = textEntry.getText()
             if textVar == "":   ## Don't append empty strings to the behaviours 
                 pass
             else:            
-                self.sGOMSUnit.behaviour.append(textVar)  ## Add the behaviours set in the text entries
+                behaviours.append(textVar)  ## Add the behaviours set in the text entries
+        self.sGOMSUnit.behaviour = behaviours
         
         self.owner.editDialogFinished(self.sGOMSUnit)
         print "SGOMSDialog disposed"
@@ -3400,9 +7801,11 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
         self.popupMenu = JPopupMenu()
         self.editItem = JMenuItem("Edit Node", actionPerformed=self.onEditNode)
         self.copyItem = JMenuItem("Copy Node", actionPerformed=self.onCopyNode)
+        self.copySubtreeItem = JMenuItem("Copy Subtree", actionPerformed=self.onCopySubtree)
         
         self.popupMenu.add(self.editItem)
         self.popupMenu.add(self.copyItem)
+        self.popupMenu.add(self.copySubtreeItem)
         
         ## A different popup menu to handle right-clicking on the panel (for pasting nodes)
         self.pastePopupMenu = JPopupMenu()
@@ -3417,8 +7820,8 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
         self.editNode = None
         
         ## Global variable to handle copying and pasting nodes
-        ## Stores the node that was right-clicked on for copy/pasting 
-        self.copyNode = None
+        ## Stores the nodes that were copied (the right-clicked node first), for pasting 
+        self.copyNodes = []
         
         ## A point for storing the location of where you want the pasted node to show up
         ## Set in the mouseReleased function
@@ -3450,6 +7853,8 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
         Either selects a Node or Edge, or creates a new kind of Node (if double-clicked)
         '''
         
+        startTime = PerformanceMonitor.monitor.start()
+        
         ## On a double-click
         if (event.getClickCount() == 2):
             
@@ -3489,12 +7894,15 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
                             
         # We have changed the model, so now we update the graph
         self.update()
+        PerformanceMonitor.monitor.stop("GraphEditorPanel.mouseClicked", startTime)
             
     def mousePressed(self, event):
         '''Defines what happens when the mouse is pressed
         
         Used in tandem with mouseDragged to either move objects around, or make new edges'''
         
+        startTime = PerformanceMonitor.monitor.start()
+        
         ## Find where the click occurred, return the node the click happened in
         aNode = self.frame.graph.nodeAt(event.getPoint())     ## Returns none by default
         #FDO print "(mousePressed) location = ", event.getX(), ",", event.getY()
@@ -3508,10 +7916,13 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
         
         ## Keep track of the eventPoint (for dragging edges, and multiple nodes)
         self.dragPoint = event.getPoint()
+        PerformanceMonitor.monitor.stop("GraphEditorPanel.mousePressed", startTime)
             
     def mouseDragged(self, event):
         '''Defines what happens when the mouse is dragged'''
         
+        startTime = PerformanceMonitor.monitor.start()
+        
         #FDO print "(mouseDragged)"
         ## Behaviour for dragging nodes
         if self.dragNode != None:   ## If there is a node to drag from (set in mousePressed)
@@ -3544,10 +7955,13 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
             self.dragPoint = event.getPoint()
         ## We have changed the model, so now update
         self.update()
+        PerformanceMonitor.monitor.stop("GraphEditorPanel.mouseDragged", startTime)
             
     def mouseReleased(self, event):
         '''Defines what happens when the mouse is released'''
         
+        startTime = PerformanceMonitor.monitor.start()
+        
         #FDO print "(mouseReleased)"
         
         ##Check to see if we have let go on a node
@@ -3574,23 +7988,47 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
         ##Refresh the panel either way
         self.dragNode = None
         self.update()
+        PerformanceMonitor.monitor.stop("GraphEditorPanel.mouseReleased", startTime)
             
     def keyPressed(self, event):
         '''Defines what happens when a keyboard key is pressed'''
         
+        startTime = PerformanceMonitor.monitor.start()
+        
         if event.getKeyCode() == KeyEvent.VK_DELETE:
             print "(GraphEditorPanel.keyPressed) DELETE pressed"
             
-            ## Remove selected edges
+            ## Remove selected edges and nodes in one transaction (one graph update, and one repaint)
+            transaction = self.frame.graph.beginTransaction()
+            
             for e in self.frame.graph.returnSelectedEdges():
-                self.frame.graph.deleteEdge(e)
+                transaction.deleteEdge(e)
             
-            ## Remove selected nodes
             for n in self.frame.graph.returnSelectedNodes():
-                self.frame.graph.deleteNode(n)
-                #FDO for node in self.graph.nodes:
-                    #FDO print node.label
-            self.update()       
+                transaction.deleteNode(n)
+                
+            transaction.commit(self)
+            
+        ## D makes the selected edges directed (from the node they were drawn from), or undirected again
+        if event.getKeyCode() == KeyEvent.VK_D:
+            print "(GraphEditorPanel.keyPressed) D pressed"
+            
+            for e in self.frame.graph.returnSelectedEdges():
+                if isinstance(e.startNode, UTNode) and isinstance(e.endNode, UTNode):
+                    e.toggleDirected()
+                else:
+                    print "XXX (GraphEditorPanel.keyPressed) only edges between two Unit Tasks can be directed XXX"
+            self.frame.graph.update()
+            self.update()
+            
+        ## C collapses the selected Planning Units, Unit Tasks and Methods (hiding the units they contain), or expands them
+        if event.getKeyCode() == KeyEvent.VK_C:
+            print "(GraphEditorPanel.keyPressed) C pressed"
+            
+            self.frame.graph.toggleCollapsed(self.frame.graph.returnSelectedNodes())
+            self.update()
+            
+        PerformanceMonitor.monitor.stop("GraphEditorPanel.keyPressed", startTime)
     
     def onEditNode(self, event):
         '''Specifies what happens when the 'edit node' popup menu item is clicked on
@@ -3627,56 +8065,43 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
     def onCopyNode(self, event):
         '''Event handler for the right-click copy node function
         
-        Stores the node that was clicked on in the self.copyNode variable
+        Stores the node that was clicked on in the self.copyNodes list
+        If the node that was clicked on is selected, every selected node is copied along with it
+        '''
+        
+        ## editNode is set on each right-click on a node (in self.mouseReleased function)
+        self.copyNodes = [self.editNode]
+        
+        if self.editNode.selected == True:
+            for node in self.frame.graph.returnSelectedNodes():
+                if node != self.editNode:
+                    self.copyNodes.append(node)
+        
+        print "(GraphEditorPanel.onCopyNode) Copied", len(self.copyNodes), "nodes, starting at", self.editNode
+        
+    def onCopySubtree(self, event):
+        '''Event handler for the right-click copy subtree function
+        
+        Stores the node that was clicked on, and every node below it in the hierarchy, in the self.copyNodes list
+        (e.g. a PUNode and all of its UTNodes, MNodes, and ONodes)
         '''
         
-        self.copyNode = self.editNode   ## editNode is set on each right-click on a node (in self.mouseReleased function)
+        self.copyNodes = self.frame.graph.returnSubtreeNodes(self.editNode)
         
-        print "(GraphEditorPanel.onCopyNode) Copied node = ", self.copyNode
+        print "(GraphEditorPanel.onCopySubtree) Copied", len(self.copyNodes), "nodes, starting at", self.editNode
         
     def onPasteNode(self, event):
         '''Event handler for the right-click paste node function
         
-        Creates a new node on the drawing panel based on the contents of self.copyNode
-        (Creates a deep copy of the copied node)
-        (Does nothing if copy node is None)
+        Creates new nodes on the drawing panel based on the contents of self.copyNodes
+        (The new nodes get their own SGOMS units, which share the firing conditions and behaviours copy-on-write)
+        (Does nothing if copyNodes is empty)
         '''
         
         print "(GraphEditorPanel.onPasteNode)"
         
-        if self.copyNode != None:   ## If there is a copyNode stored,
-            ## Create a new node with the same contents as copyNode (but does not point to copyNode)
-             
-            #def __init__(self, aLabel = "PUNode", aLocation = None, theIncidentEdges = None, thePU = None):     
-            #addPUNodeAdvancedNew(self, aPlanningUnit, aPoint):
-            if isinstance(self.copyNode, PUNode):
-                
-                pastePU = deepcopy(self.copyNode.planningUnit) 
-                                     
-                self.frame.graph.addPUNodeAdvancedNew(pastePU, self.pastePoint)
-                print "(GraphEditorPanel.onPasteNode) paste new PUNode"
-                
-            if isinstance(self.copyNode, UTNode):
-                
-                pasteUT = deepcopy(self.copyNode.pUxUTRelation.unitTask) 
-                                     
-                self.frame.graph.addUTNodeAdvancedNew(pasteUT, self.pastePoint)
-                print "(GraphEditorPanel.onPasteNode) paste new UTNode"
-                
-            if isinstance(self.copyNode, MNode):
-                
-                pasteM = deepcopy(self.copyNode.uTxMRelation.method) 
-                                     
-                self.frame.graph.addMNodeAdvancedNew(pasteM, self.pastePoint)
-                print "(GraphEditorPanel.onPasteNode) paste new MNode"
-                
-            if isinstance(self.copyNode, ONode):
-                
-                pasteO = deepcopy(self.copyNode.mxORelation.operator) 
-                                     
-                self.frame.graph.addONodeAdvancedNew(pasteO, self.pastePoint)
-                print "(GraphEditorPanel.onPasteNode) paste new ONode"
-                
+        if len(self.copyNodes) > 0:     ## If there are copyNodes stored,
+            self.frame.graph.pasteNodes(self.copyNodes, self.pastePoint)
         else:
             print "(GraphEditorPanel.onPasteNode) there is no copyNode!"
             
@@ -3685,43 +8110,17 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
     def onPasteSlaveNode(self, event):
         '''Defines what happens when the "Paste Slave Node" option is clicked
         on the right-click menu.
-        Creates a shallow copy of the copied node (copyNode) and pastes it
-        so that the new node is tied to the original node (any modifications
+        Pastes new nodes that point to the same SGOMS units as the copied nodes (copyNodes)
+        so that the new nodes are tied to the original nodes (any modifications
         to any tied nodes are reflected in all tied nodes)
         '''
         
         print "(GraphEditorPanel.onPasteSlaveNode)"
         
-        if self.copyNode != None:   ## If there is a copyNode stored,
-            ## Create a new node that points to the same PU or UT of the copyNode
-            
-            ## Note to self: This doesn't seem to be an issue if one unit task is deleted, 
-            ## while the copy retains a pointer to the original (there is no null pointer exception)
-            ## This is because the addUTNodeAdvancedNew creates a *new* UT in the list
-            ## So it is technically a duplicate. After testing, this seems to work fine.
-             
-            #def __init__(self, aLabel = "PUNode", aLocation = None, theIncidentEdges = None, thePU = None):     
-            #addPUNodeAdvancedNew(self, aPlanningUnit, aPoint):
-            if isinstance(self.copyNode, PUNode):
-                                                    
-                self.frame.graph.addPUNodeAdvancedNew(self.copyNode.planningUnit, self.pastePoint)
-                print "(GraphEditorPanel.onPasteSlaveNode) paste new slave PUNode"
-                
-            if isinstance(self.copyNode, UTNode):
-                                                     
-                self.frame.graph.addUTNodeAdvancedNew(self.copyNode.pUxUTRelation.unitTask, self.pastePoint)
-                print "(GraphEditorPanel.onPasteSlaveNode) paste new slave UTNode"
-                
-            if isinstance(self.copyNode, MNode):
-                                                    
-                self.frame.graph.addMNodeAdvancedNew(self.copyNode.uTxMRelation.method, self.pastePoint)
-                print "(GraphEditorPanel.onPasteSlaveNode) paste new slave MNode"
-                
-            if isinstance(self.copyNode, ONode):
-                                                     
-                self.frame.graph.addONodeAdvancedNew(self.copyNode.mxORelation.operator, self.pastePoint)
-                print "(GraphEditorPanel.onPasteSlaveNode) paste new slave ONode"
-                
+        ## The shared units are listed in the SGOMS_Model once, and counted once per node (see SGOMSUnitStore),
+        ## so deleting one of the tied nodes leaves the unit in the model for the others, and it is only exported once
+        if len(self.copyNodes) > 0:     ## If there are copyNodes stored,
+            self.frame.graph.pasteNodes(self.copyNodes, self.pastePoint, True)
         else:
             print "(GraphEditorPanel.onPasteSlaveNode) there is no copyNode!"
             
@@ -3743,6 +8142,8 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
         
         self.super__paintComponent(aPen)    ## This is the workaround here (note weird syntax)
         
+        startTime = PerformanceMonitor.monitor.start()
+        
         self.frame.graph.draw(aPen)
         
         ##If you are dragging from an unselected node, draw a line
@@ -3752,6 +8153,12 @@ class GraphEditorPanel(JPanel, MouseListener, MouseMotionListener, KeyListener):
                 aPen.drawLine(self.dragNode.location.x, self.dragNode.location.y,
                               self.elasticEndLocation.location.x, self.elasticEndLocation.location.y)
         
+        PerformanceMonitor.monitor.stop("GraphEditorPanel.paintComponent", startTime)
+        
+        ## Draw the timings on top of everything (View -> Performance Overlay), including this frame's
+        if PerformanceMonitor.monitor.overlay:
+            PerformanceMonitor.monitor.drawOverlay(aPen, 10, 10)
+        
     def update(self):
         '''Repaints the GraphEditorPanel based on the model (graph)'''
         
@@ -3859,6 +8266,8 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
     This is the main frame that the GUI is comprised of
     '''
     
+    SIMULATED_EPISODES = 1000   ## The number of episodes of each Planning Unit run by file -> Simulate Model
+    
     def __init__(self, theTitle = "Title", theGraph = None):
         '''Initializes the GraphEditorFrame
         
@@ -3870,6 +8279,11 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
         else:
             self.graph = theGraph
         
+        ## The models open at once, of which self.graph is the one shown (see the Window menu)
+        self.workspace = SGOMSWorkspace()
+        self.workspace.add(self.graph)
+        self.baseTitle = theTitle   ## The title before the model's name (not self.title, which is the JFrame's title)
+        
         ## These are the JPanels
         self.editor = GraphEditorPanel(theGraph, self)   ## The drawing panel
         self.buttonPanel = GraphEditorFrameButtonPanel(theGraph, self)  ## The RadioButton Panel
@@ -3901,6 +8315,20 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
         fileExport.setToolTipText("Convert Current Graph Into an ACT-R Readable Model")
         fileMenu.add(fileExport)
         
+        ## The Export Team to ACT-R Menu Item
+        fileExportTeam = JMenuItem("Export Team To ACT-R",
+            actionPerformed=self.exportTeamToACTR)
+        fileExportTeam.setToolTipText("Export the Current Graph and other saved models as agents in one ACT-R file")
+        fileMenu.add(fileExportTeam)
+        
+        ## The Export to other targets Menu Items (one per ModelEmitter, see SGOMS_Model.compileTo)
+        for target in ["json", "lisp"]:
+            emitter = ModelEmitter.returnEmitter(target)
+            fileExportTarget = JMenuItem("Export To " + emitter.description,
+                actionPerformed=lambda event, target=target: self.exportTo(target))
+            fileExportTarget.setToolTipText("Compile Current Graph Into a " + emitter.description + " File")
+            fileMenu.add(fileExportTarget)
+        
         ## The Save As Menu Item
         fileSaveAs = JMenuItem("Save As",
                              actionPerformed=self.saveAs)
@@ -3916,17 +8344,70 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
         ## The load from file Menu Item
         fileLoad = JMenuItem("Load",
                              actionPerformed=self.loadGraph)
-        fileLoad.setToolTipText("Load a model from a selected file")
+        fileLoad.setToolTipText("Open a model from a selected file, alongside the open models (see the Window menu)")
         fileMenu.add(fileLoad)
         
+        ## The import from ACT-R Menu Item
+        fileImport = JMenuItem("Import From ACT-R",
+                               actionPerformed=self.importFromACTR)
+        fileImport.setToolTipText("Build a new model from a Python ACT-R file")
+        fileMenu.add(fileImport)
+        
+        ## The file -> buffers and memory Menu Item
+        fileBuffers = JMenuItem("Buffers and Memory",
+                                actionPerformed=self.editBuffers)
+        fileBuffers.setToolTipText("Set the buffers and the DM parameters of the model")
+        fileMenu.add(fileBuffers)
+        
+        ## The file -> check model Menu Item
+        fileCheck = JMenuItem("Check Model",
+                              actionPerformed=self.checkModel)
+        fileCheck.setToolTipText("Check the model for problems that would stop the exported ACT-R file from running")
+        fileMenu.add(fileCheck)
+        
+        ## The file -> simulate model Menu Item
+        fileSimulate = JMenuItem("Simulate Model",
+                                 actionPerformed=self.simulateModel)
+        fileSimulate.setToolTipText("Run the Planning Units of the model without ACT-R, and print the traces to the console")
+        fileMenu.add(fileSimulate)
+        
         ## The file -> print model contents Menu Item
         filePrint = JMenuItem("Print to Console",
                               actionPerformed=self.printGraph)
         filePrint.setToolTipText("Print the Contents of the Model to the Console Window (for testing purposes)")
         fileMenu.add(filePrint)
 
-        ## The help menu
         menubar.add(fileMenu)
+        
+        ## The view menu
+        viewMenu = JMenu("View")
+        
+        ## The view -> performance overlay Menu Item
+        viewOverlay = JCheckBoxMenuItem("Performance Overlay", PerformanceMonitor.monitor.overlay,
+                                        actionPerformed=self.togglePerformanceOverlay)
+        viewOverlay.setToolTipText("Show how long the editor's updates, mouse events and painting take, on the canvas")
+        viewMenu.add(viewOverlay)
+        
+        ## The view -> export performance samples Menu Item
+        viewExportSamples = JMenuItem("Export Performance Samples",
+                                      actionPerformed=self.exportPerformanceSamples)
+        viewExportSamples.setToolTipText("Write the last " + str(PerformanceMonitor.monitor.samples.maxlen) 
+                                         + " timings of the editor to a CSV file")
+        viewMenu.add(viewExportSamples)
+        
+        ## The view -> expand all Menu Item
+        viewExpandAll = JMenuItem("Expand All", actionPerformed=self.expandAll)
+        viewExpandAll.setToolTipText("Show the units hidden by collapsing (select a unit and press C to collapse it)")
+        viewMenu.add(viewExpandAll)
+        
+        menubar.add(viewMenu)
+        
+        ## The window menu, listing the open models (filled in by updateWindowMenu)
+        self.windowMenu = JMenu("Window")
+        menubar.add(self.windowMenu)
+        self.updateWindowMenu()
+
+        ## The help menu
 
         helpMenu = JMenu("Help")
         helpItem = JMenuItem("More Information", actionPerformed=self.moreInformationSelected)
@@ -3938,7 +8419,7 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
 
 
         ## Add the title and other basic frame operations
-        self.setTitle(theTitle)
+        self.setTitle(theTitle + " - " + self.workspace.returnLabel(self.graph))
         self.setDefaultCloseOperation(JFrame.EXIT_ON_CLOSE)
         #self.pack()
         self.setSize(1200, 700)
@@ -4009,6 +8490,9 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
         
         print "(GraphEditorFrame.exportToACTR) Called"
         
+        if self.confirmExport() == False:
+            return
+        
         chooseFile = JFileChooser()
         theFilter = FileNameExtensionFilter(".py", ["py"])
         chooseFile.addChoosableFileFilter(theFilter)
@@ -4027,6 +8511,163 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
         else:
             print "(GraphEditorFrame.exportToACTR) dialog cancelled"
     
+    def exportTeamToACTR(self, event):
+        '''Exports the Graph and other saved graphs as a team of agents in one ACT-R readable python file
+        
+        This is an event handler for the file -> Export Team To ACT-R command
+        Opens a JFileChooser for choosing the saved graphs of the other agents, and another for the save location
+        Calls CCMSuiteEmitter.emitAgentsToFile; each agent is named after its file'''
+        
+        print "(GraphEditorFrame.exportTeamToACTR) Called"
+        
+        if self.confirmExport() == False:
+            return
+        
+        chooseFiles = JFileChooser()
+        chooseFiles.setMultiSelectionEnabled(True)
+        chooseFiles.setDialogTitle("Choose the saved models of the other agents")
+        if chooseFiles.showDialog(self, "Add Agents") != JFileChooser.APPROVE_OPTION:
+            print "(GraphEditorFrame.exportTeamToACTR) dialog cancelled"
+            return
+        
+        agents = []
+        names = {}
+        agents.append((self.returnAgentName(self.graph.saveFile, names), self.graph.sGOMS))
+        for theFile in chooseFiles.getSelectedFiles():
+            theFileName = theFile.getCanonicalPath()
+            ## A new Graph loads each file, since loadFrom sets the saveFile of the Graph it is called on
+            agents.append((self.returnAgentName(theFileName, names), Graph().loadFrom(theFileName).sGOMS))
+        
+        chooseFile = JFileChooser()
+        theFilter = FileNameExtensionFilter(".py", ["py"])
+        chooseFile.addChoosableFileFilter(theFilter)
+
+        if chooseFile.showDialog(self, "Export") == JFileChooser.APPROVE_OPTION:
+            theFileName = chooseFile.getSelectedFile().getCanonicalPath()
+            print "(GraphEditorFrame.exportTeamToACTR) Selected Path = ", theFileName
+            ModelEmitter.returnEmitter("ccmsuite").emitAgentsToFile(agents, theFileName)
+        else:
+            print "(GraphEditorFrame.exportTeamToACTR) dialog cancelled"
+            
+    def returnAgentName(self, theFileName, theNames):
+        '''Returns a unique agent name (a Python identifier) made from theFileName, and adds it to theNames
+        
+        theFileName should be the file a graph was saved to (or None, for an unsaved graph)
+        theNames should be a dictionary of the names already used'''
+        
+        name = "agent"
+        if theFileName != None:
+            name = re.sub("[^A-Za-z0-9_]", "_", theFileName.replace("\\", "/").split("/")[-1].split(".")[0])
+            if name == "" or name[0].isdigit():
+                name = "agent_" + name
+        
+        unique = name
+        count = 1
+        while theNames.has_key(unique):
+            count += 1
+            unique = name + "_" + str(count)
+        theNames[unique] = True
+        return unique
+        
+    def confirmExport(self):
+        '''Validates the model before it is exported
+        If errors are found, lists them and asks whether to export anyway
+        Returns True if the export should go ahead, False otherwise'''
+        
+        self.graph.validate()
+        errors = self.graph.returnIssues(ValidationIssue.ERROR)
+        self.editor.update()    ## Show the markers
+        
+        if len(errors) == 0:
+            return True
+        
+        message = "The exported model will not run correctly:\n\n" + self.returnIssuesText(errors) + "\nExport anyway?"
+        answer = JOptionPane.showConfirmDialog(self, message, "Problems Found", JOptionPane.YES_NO_OPTION,
+                                               JOptionPane.WARNING_MESSAGE)
+        return answer == JOptionPane.YES_OPTION
+    
+    def returnIssuesText(self, theIssues, theLimit=20):
+        '''Returns theIssues as text, one per line (listing at most theLimit of them)'''
+        
+        text = ""
+        for issue in theIssues[:theLimit]:
+            text += str(issue) + "\n"
+        if len(theIssues) > theLimit:
+            text += "... and " + str(len(theIssues) - theLimit) + " more (see the console)\n"
+        return text
+    
+    def editBuffers(self, event):
+        '''The event handler for the file -> Buffers and Memory function
+        Asks for the model's buffers, then for the parameters of its DM (e.g. "latency=0.05 threshold=-1")
+        
+        Buffers that are in the list but never used are not declared in the ACT-R file,
+        and buffers that are used but not in the list are declared anyway, and marked by the validator'''
+        
+        model = self.graph.sGOMS
+        
+        buffers = JOptionPane.showInputDialog(self, "Buffers (separated by spaces):", " ".join(model.bufferList))
+        if buffers == None:
+            print "(GraphEditorFrame.editBuffers) dialog cancelled"
+            return
+        model.bufferList = buffers.split()
+        
+        current = " ".join([name + "=" + value for name, value in sorted(model.returnMemoryParameters().items())])
+        parameters = JOptionPane.showInputDialog(self, "Parameters of DM=Memory(" + model.returnMemoryBuffer() + 
+                                                 ", ...), e.g. latency=0.05 threshold=-1:", current)
+        if parameters != None:
+            model.memoryParameters = {}
+            for parameter in parameters.split():
+                if parameter.find("=") > 0:
+                    model.setMemoryParameter(parameter[:parameter.find("=")], parameter[parameter.find("=")+1:])
+                else:
+                    print "XXX (GraphEditorFrame.editBuffers) ignoring", parameter, "(expected name=value) XXX"
+        
+        print "(GraphEditorFrame.editBuffers) buffers:", model.bufferList, "memory parameters:", model.returnMemoryParameters()
+        
+        self.graph.update()     ## Validate the model against the new buffers
+        self.editor.update()
+        
+    def checkModel(self, event):
+        '''The event handler for the file -> Check Model function
+        Validates the model, marks the problems on the nodes, and lists them in a message window'''
+        
+        issues = self.graph.validate()
+        self.editor.update()
+        
+        if len(issues) == 0:
+            JOptionPane.showMessageDialog(self, "No problems found", "Check Model", JOptionPane.INFORMATION_MESSAGE)
+        else:
+            JOptionPane.showMessageDialog(self, self.returnIssuesText(issues), "Check Model", JOptionPane.WARNING_MESSAGE)
+    
+    def exportTo(self, theTarget):
+        '''Exports the Graph with the ModelEmitter registered as theTarget
+        
+        This is the event handler for the file -> Export To (JSON IR, Lisp ACT-R) commands
+        Opens a JFileChooser for choosing a save location
+        Calls SGOMS_Model.compileTo(theTarget, filename)'''
+        
+        print "(GraphEditorFrame.exportTo) Called, target =", theTarget
+        
+        emitter = ModelEmitter.returnEmitter(theTarget)
+        
+        if self.confirmExport() == False:
+            return
+        
+        chooseFile = JFileChooser()
+        theFilter = FileNameExtensionFilter("." + emitter.extension, [emitter.extension])
+        chooseFile.addChoosableFileFilter(theFilter)
+
+        ret = chooseFile.showDialog(self, "Export")
+
+        if ret == JFileChooser.APPROVE_OPTION:
+            theFileName = chooseFile.getSelectedFile().getCanonicalPath()
+            print "(GraphEditorFrame.exportTo) Selected Path = ", theFileName
+        
+            self.graph.sGOMS.compileTo(theTarget, theFileName)
+        
+        else:
+            print "(GraphEditorFrame.exportTo) dialog cancelled"
+    
     def save(self, event):
         '''The event handler for the file -> save function
         
@@ -4058,6 +8699,7 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
             print "(GraphEditorFrame.saveAs) Selected Path = ", theFileName
         
             self.graph.saveAs(theFileName)
+            self.showGraph(self.graph)  ## The model is now shown by its new file name
         
         else:
             print "(GraphEditorFrame.saveAs) dialog cancelled"      
@@ -4065,8 +8707,8 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
     def loadGraph(self, event):
         '''The event handler for the file -> load function
         
-        Loads the contents of the graph from a selected file
-        calls self.graph.loadFrom(file)
+        Opens the graph saved in a selected file in the workspace, alongside the open graphs
+        calls self.workspace.open(file), which only loads the file if it is not open already
         Updates the GraphEditorFrame and GraphEditorPanel to display the new graph'''
         
         chooseFile = JFileChooser()
@@ -4082,7 +8724,7 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
             #FDO print "(GraphEditorFrame.exportToACTR), theFile =", theFile
             print "(GraphEditorFrame.loadGraph) Selected Path = ", theFileName
         
-            newGraph = self.graph.loadFrom(theFileName) ## Returns the loaded graph
+            newGraph = self.workspace.open(theFileName) ## Returns the loaded graph
             
             print"(GraphEditorFrame.loadGraph) printing graph and SGOMS Model:"
             newGraph.printGraph()
@@ -4090,14 +8732,188 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
             
             ## The frame and editor window need to point to the new graph
             print "(GraphEditorFrame.loadGraph) setting new Graph"
-            self.graph = newGraph
-            self.editor.graph = newGraph
+            self.showGraph(newGraph)
+            newGraph.validate()     ## Issues are not saved with the graph
         
         else:
             print "(GraphEditorFrame.loadGraph) dialog cancelled"
                 
         self.editor.update()
         
+    def importFromACTR(self, event):
+        '''The event handler for the file -> Import From ACT-R function
+        
+        Builds a new graph from a selected Python ACT-R file with an ACTRImporter, and opens it in the workspace
+        Updates the GraphEditorFrame and GraphEditorPanel to display the new graph'''
+        
+        chooseFile = JFileChooser()
+        theFilter = FileNameExtensionFilter(".py", ["py"])
+        chooseFile.addChoosableFileFilter(theFilter)
+
+        ret = chooseFile.showDialog(self, "Import")
+
+        if ret == JFileChooser.APPROVE_OPTION:
+            theFile = chooseFile.getSelectedFile()
+            theFileName = theFile.getCanonicalPath()
+            
+            print "(GraphEditorFrame.importFromACTR) Selected Path = ", theFileName
+        
+            importedGraph = ACTRImporter().importFile(theFileName)
+            if importedGraph == None:
+                print "XXX (GraphEditorFrame.importFromACTR) no model could be built from", theFileName, "XXX"
+                JOptionPane.showMessageDialog(self, "No model could be built from " + theFileName + 
+                                              "\n(see the console for the reason)", 
+                                              "Import From ACT-R", JOptionPane.ERROR_MESSAGE)
+            else:
+                newGraph = self.workspace.add(importedGraph)
+                
+                ## The frame and editor window need to point to the new graph
+                print "(GraphEditorFrame.importFromACTR) setting new Graph"
+                self.showGraph(newGraph)
+        
+        else:
+            print "(GraphEditorFrame.importFromACTR) dialog cancelled"
+                
+        self.editor.update()
+        
+    def showGraph(self, theGraph):
+        '''Shows theGraph (one of the workspace's open graphs) in the editor, and updates the title and Window menu'''
+        
+        print "(GraphEditorFrame.showGraph)", self.workspace.returnLabel(theGraph)
+        theGraph.selectedSGOMSType = self.graph.selectedSGOMSType   ## Keep the selected button of the button panel
+        self.graph = theGraph
+        self.editor.graph = theGraph
+        self.setTitle(self.baseTitle + " - " + self.workspace.returnLabel(theGraph))
+        self.updateWindowMenu()
+        self.editor.update()
+        
+    def updateWindowMenu(self):
+        '''Fills in the Window menu: the New, Close and Load Unit Library items, then an item for each open graph
+        (the graph shown is checked)'''
+        
+        self.windowMenu.removeAll()
+        
+        ## The window -> new model Menu Item
+        windowNew = JMenuItem("New Model", actionPerformed=self.newGraph)
+        windowNew.setToolTipText("Open an empty model alongside the open models")
+        self.windowMenu.add(windowNew)
+        
+        ## The window -> close model Menu Item
+        windowClose = JMenuItem("Close Model", actionPerformed=self.closeGraph)
+        windowClose.setToolTipText("Close the current model (without saving it)")
+        self.windowMenu.add(windowClose)
+        
+        ## The window -> load unit library Menu Item
+        windowLibrary = JMenuItem("Load Unit Library", actionPerformed=self.loadLibrary)
+        windowLibrary.setToolTipText("Share the units of a saved model with every open model that uses them")
+        self.windowMenu.add(windowLibrary)
+        
+        self.windowMenu.addSeparator()
+        
+        ## One Menu Item for each open model
+        for graph in self.workspace.graphs:
+            windowGraph = JCheckBoxMenuItem(self.workspace.returnLabel(graph), graph is self.graph,
+                                            actionPerformed=lambda event, graph=graph: self.showGraph(graph))
+            self.windowMenu.add(windowGraph)
+            
+    def newGraph(self, event):
+        '''The event handler for the window -> New Model function
+        Opens an empty graph in the workspace, and shows it'''
+        
+        self.showGraph(self.workspace.add(Graph()))
+        
+    def closeGraph(self, event):
+        '''The event handler for the window -> Close Model function
+        Closes the graph shown (without saving it), and shows the one opened before it'''
+        
+        self.showGraph(self.workspace.close(self.graph))
+        
+    def loadLibrary(self, event):
+        '''The event handler for the window -> Load Unit Library function
+        Opens a JFileChooser for choosing a saved model, whose units are shared with the open models (see SGOMSWorkspace)'''
+        
+        chooseFile = JFileChooser()
+        theFilter = FileNameExtensionFilter(".txt", ["txt"])
+        chooseFile.addChoosableFileFilter(theFilter)
+
+        ret = chooseFile.showDialog(self, "Load Library")
+
+        if ret == JFileChooser.APPROVE_OPTION:
+            theFileName = chooseFile.getSelectedFile().getCanonicalPath()
+            print "(GraphEditorFrame.loadLibrary) Selected Path = ", theFileName
+            
+            shared = self.workspace.loadLibrary(theFileName)
+            JOptionPane.showMessageDialog(self, str(len(self.workspace.library.entries)) + " units loaded; " + 
+                                          str(shared) + " units of the open models share their text", 
+                                          "Load Unit Library", JOptionPane.INFORMATION_MESSAGE)
+        
+        else:
+            print "(GraphEditorFrame.loadLibrary) dialog cancelled"
+        
+    def simulateModel(self, event):
+        '''The event handler for the file -> Simulate Model function
+        
+        Runs SIMULATED_EPISODES episodes of each Planning Unit with an SGOMSSimulator, 
+        then simulates each once more, printing the productions fired to the console, and shows a summary
+        (including the hit rate of the simulated DM retrievals)'''
+        
+        simulator = SGOMSSimulator(self.graph.sGOMS)
+        results = simulator.runEpisodes(GraphEditorFrame.SIMULATED_EPISODES)
+        
+        summary = ""
+        for planningUnit in simulator.returnPlanningUnits():
+            episode = simulator.run(planningUnit)
+            print "(GraphEditorFrame.simulateModel)", episode
+            print "    ", ", ".join(episode.returnTrace())
+            
+            counts = results[planningUnit]
+            summary += str(episode) + "\n    " + str(counts[SimulationEpisode.FINISHED]) + " of " + \
+                str(GraphEditorFrame.SIMULATED_EPISODES) + " episodes finished, " + str(counts["ambiguities"]) + \
+                " ambiguous retrievals (" + str(round(counts["seconds"], 3)) + " s)\n"
+        
+        if summary == "":
+            summary = "There are no Planning Units with Unit Tasks to simulate"
+        else:
+            summary += "\nDM retrievals: " + str(simulator.dm)
+        
+        JOptionPane.showMessageDialog(self, summary, "Simulate Model", JOptionPane.INFORMATION_MESSAGE)
+        
+    def togglePerformanceOverlay(self, event):
+        '''The event handler for the view -> Performance Overlay function
+        Shows or hides the PerformanceMonitor's overlay on the drawing panel'''
+        
+        PerformanceMonitor.monitor.overlay = event.getSource().isSelected()
+        print "(GraphEditorFrame.togglePerformanceOverlay) overlay =", PerformanceMonitor.monitor.overlay
+        self.editor.update()
+        
+    def expandAll(self, event):
+        '''The event handler for the view -> Expand All function
+        Expands every collapsed node, showing the whole graph again'''
+        
+        self.graph.expandAll()
+        self.editor.update()
+        
+    def exportPerformanceSamples(self, event):
+        '''The event handler for the view -> Export Performance Samples function
+        Opens a JFileChooser for choosing a save location, and writes the PerformanceMonitor's samples to it as CSV'''
+        
+        print "(GraphEditorFrame.exportPerformanceSamples) Called"
+        
+        chooseFile = JFileChooser()
+        theFilter = FileNameExtensionFilter(".csv", ["csv"])
+        chooseFile.addChoosableFileFilter(theFilter)
+
+        ret = chooseFile.showDialog(self, "Export")
+
+        if ret == JFileChooser.APPROVE_OPTION:
+            theFileName = chooseFile.getSelectedFile().getCanonicalPath()
+            print "(GraphEditorFrame.exportPerformanceSamples) Selected Path = ", theFileName
+            
+            PerformanceMonitor.monitor.exportCSV(theFileName)
+        
+        else:
+            print "(GraphEditorFrame.exportPerformanceSamples) dialog cancelled"
+    
     def printGraph(self, event):
         '''Prints the contents of the model to the console window
         Used mostly for testing purposes
@@ -4126,7 +8942,38 @@ class GraphEditorFrame(JFrame, DialogClientInterface):
 #frame = GraphEditorFrame("SGOMS_GUI_1.1", map1)
 
 #map1 = Graph("SGOMS Test")
-frame = GraphEditorFrame("SGOMS_GUI_1.5")
+
+## Only start the GUI when this file is run directly (not when it is loaded as a module, e.g. to use SGOMSModelBuilder)
+## A parameter sweep can be run instead, without the GUI:
+##     jython SGOMS_GUI_1.5.py --sweep <saved model file> <grid .json file> <results .csv file> [episodes]
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--sweep":
+        if len(sys.argv) < 5:
+            print "usage: jython SGOMS_GUI_1.5.py --sweep <saved model file> <grid .json file> <results .csv file> [episodes]"
+        elif len(sys.argv) > 5:
+            SweepRunner.runFromFiles(sys.argv[2], sys.argv[3], sys.argv[4], int(sys.argv[5]))
+        else:
+            SweepRunner.runFromFiles(sys.argv[2], sys.argv[3], sys.argv[4])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        if len(sys.argv) < 3:
+            print "usage: jython SGOMS_GUI_1.5.py --benchmark <results .csv or .json file> [repeats]"
+        elif len(sys.argv) > 3:
+            GraphBenchmark(None, int(sys.argv[3])).run(sys.argv[2])
+        else:
+            GraphBenchmark().run(sys.argv[2])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--generate":
+        if len(sys.argv) < 4:
+            print "usage: jython SGOMS_GUI_1.5.py --generate <file> <sgoms|ccmsuite|json|graph|lisp> [planning units] [seed]"
+        else:
+            planningUnits = 100
+            seed = 0
+            if len(sys.argv) > 4:
+                planningUnits = int(sys.argv[4])
+            if len(sys.argv) > 5:
+                seed = int(sys.argv[5])
+            SGOMSModelGenerator(planningUnits, theSeed=seed).generate(sys.argv[2], sys.argv[3])
+    else:
+        frame = GraphEditorFrame("SGOMS_GUI_1.5")
 
 
 #print frame.graph